@@ -0,0 +1,101 @@
+from collections import Counter
+from models import *
+from miscutils import MiscUtils
+from backends import Increment
+
+# Wrong answers are cut to this length so one odd answer can't bloat the analytics document
+MAX_ANSWER_LENGTH = 40
+# Wrong answers that aren't the answer to any question of the quiz are counted together under
+# this key, so a question's wrong answers are a fixed set of keys however many attempts it gets
+OTHER_ANSWER = "(other)"
+
+class AnalyticsUtils:
+    @staticmethod
+    def get_id(quiz_id: str, question_language: str, answer_language: str):
+        return f"{quiz_id}-{question_language}-{answer_language}"
+
+    # 0 for 0-9%, 1 for 10-19% ... 10 for 100%
+    @staticmethod
+    def get_bucket(score: float):
+        return min(int(score*10 + 1e-9), HISTOGRAM_BUCKETS - 1)
+
+    # Equivalent answers (by grading rules) are counted together, and only the quiz's own
+    # answers (another question's answer being the mix-up worth seeing) by name
+    @staticmethod
+    def get_answer_key(answer: str, known_answers):
+        answer = MiscUtils.normalize_answer(answer or "")
+        if not answer:
+            return "(blank)"
+        return answer[:MAX_ANSWER_LENGTH] if answer in known_answers else OTHER_ANSWER
+
+    # Normalized answers to every question of the attempt's quiz, in its answer language
+    @staticmethod
+    def get_known_answers(attempt: QuizAttempt):
+        return {MiscUtils.normalize_answer(a) for r in attempt.responses.values() for a in r.answers}
+
+    # Merged write fields that add one attempt to its quiz and language pair
+    @staticmethod
+    def get_fields(attempt: QuizAttempt):
+        questions = {}
+        known_answers = AnalyticsUtils.get_known_answers(attempt)
+        for r in attempt.responses.values():
+            question = {'attempts': Increment(1), 'correct': Increment(1 if r.correct else 0)}
+            if not r.correct:
+                question['wrong_answers'] = {AnalyticsUtils.get_answer_key(r.user_answer, known_answers): Increment(1)}
+            questions[str(r.question_id)] = question
+        return {
+            'quiz_id': attempt.quiz_id,
+            'question_language': attempt.question_language,
+            'answer_language': attempt.answer_language,
+            'count_attempts': Increment(1),
+            'total_score': Increment(attempt.score),
+            'score_histogram': {str(AnalyticsUtils.get_bucket(attempt.score)): Increment(1)},
+            'questions': questions
+        }
+
+    # Batch version of get_fields for backfills: whole analytics documents for a set of
+    # attempts, one per quiz and language pair, with the counting done in NumPy
+    @staticmethod
+    def compute(attempts):
+        import numpy as np
+        groups = {}
+        for a in attempts:
+            groups.setdefault((a.quiz_id, a.question_language, a.answer_language), []).append(a)
+
+        docs = []
+        for ((quiz_id, question_language, answer_language), group) in groups.items():
+            question_ids = sorted({str(id) for a in group for id in a.responses}, key=lambda id: (len(id), id))
+            index = {id: i for (i, id) in enumerate(question_ids)}
+            columns = []
+            correct = []
+            wrong_answers = [Counter() for _ in question_ids]
+            for a in group:
+                known_answers = AnalyticsUtils.get_known_answers(a)
+                for r in a.responses.values():
+                    column = index[str(r.question_id)]
+                    columns.append(column)
+                    correct.append(r.correct)
+                    if not r.correct:
+                        wrong_answers[column][AnalyticsUtils.get_answer_key(r.user_answer, known_answers)] += 1
+
+            columns = np.array(columns, dtype=np.int64)
+            attempts_per_question = np.bincount(columns, minlength=len(question_ids))
+            correct_per_question = np.bincount(columns, weights=np.array(correct, dtype=np.float64), minlength=len(question_ids))
+            scores = np.fromiter((a.score for a in group), dtype=np.float64, count=len(group))
+            buckets = np.minimum((scores*10 + 1e-9).astype(np.int64), HISTOGRAM_BUCKETS - 1)
+            histogram = np.bincount(buckets, minlength=HISTOGRAM_BUCKETS)
+
+            docs.append({
+                'quiz_id': quiz_id,
+                'question_language': question_language,
+                'answer_language': answer_language,
+                'count_attempts': len(group),
+                'total_score': float(scores.sum()),
+                'score_histogram': {str(b): int(n) for (b, n) in enumerate(histogram) if n},
+                'questions': {id: {
+                    'attempts': int(attempts_per_question[i]),
+                    'correct': int(correct_per_question[i]),
+                    'wrong_answers': dict(wrong_answers[i])
+                } for (id, i) in index.items()}
+            })
+        return docs
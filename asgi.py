@@ -0,0 +1,319 @@
+"""Async serving mode.
+
+The hot routes (home, quiz, submit, profile) and the OAuth login flow run natively
+async on Quart, with the async repos in asyncrepo.py and httpx for outbound calls, so a
+request waiting on Firestore or Google doesn't hold a thread. Every other route is
+handed to the Flask app in main.py. Sessions are shared, both apps read and write the
+same signed session cookie.
+
+    hypercorn asgi:application --bind 0.0.0.0:8080
+"""
+import json
+import time
+import asyncio
+import functools
+import httpx
+from quart import Quart, request, session, redirect, abort, make_response, render_template, g
+from quart.signals import before_render_template, template_rendered
+from quart.sessions import SecureCookieSessionInterface
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from werkzeug.exceptions import NotFound, MethodNotAllowed
+from werkzeug.routing import RequestRedirect
+from flask_login.utils import decode_cookie
+import main
+from models import *
+from asyncrepo import *
+from quizutils import QuizUtils
+from miscutils import MiscUtils
+from httputils import HttpUtils, HTTP_TIMEOUT
+from writeutils import get_write_queue
+from leaderboardutils import ALL_TIME
+from metricsutils import metrics, logger
+
+# Same lazily fetched secret key as the Flask app
+class LazySecretSessionInterface(SecureCookieSessionInterface):
+    async def open_session(self, app, request):
+        if not request.cookies.get(self.get_cookie_name(app)):
+            if request.cookies.get(REMEMBER_COOKIE_NAME):
+                self.load_secret_key(app)
+            return self.session_class()
+        return await super().open_session(app, request)
+
+    def get_signing_serializer(self, app):
+        self.load_secret_key(app)
+        return super().get_signing_serializer(app)
+
+    @staticmethod
+    def load_secret_key(app):
+        if not app.secret_key:
+            app.secret_key = main.secret_key.get()
+
+REMEMBER_COOKIE_NAME = main.app.config.get("REMEMBER_COOKIE_NAME", "remember_token")
+
+app = Quart(__name__)
+app.session_interface = LazySecretSessionInterface()
+app.config["PERMANENT_SESSION_LIFETIME"] = main.app.config["PERMANENT_SESSION_LIFETIME"]
+
+users_repo = AsyncUsersRepo()
+quizzes_repo = AsyncQuizzesRepo()
+quiz_attempts_repo = AsyncQuizAttemptsRepo(write_queue=get_write_queue())
+user_stats_repo = AsyncUserStatsRepo()
+leaderboards_repo = AsyncLeaderboardsRepo()
+quiz_counters_repo = AsyncQuizCountersRepo()
+
+# Same request metrics as the Flask app, they end up on its /metrics page
+@app.before_request
+async def start_request_metrics():
+    g.request_metrics = metrics.start_request()
+
+@app.after_request
+async def record_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+async def finish_request_metrics(error):
+    started = g.pop('request_metrics', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.finish_request(started, request.method, route, g.get('response_status', 500))
+
+# Async receivers, Quart would run sync ones on its thread pool
+async def render_started(sender, **kwargs):
+    metrics.render_started(sender, **kwargs)
+
+async def render_finished(sender, **kwargs):
+    metrics.render_finished(sender, **kwargs)
+
+before_render_template.connect(render_started, app)
+template_rendered.connect(render_finished, app)
+
+http = httpx.AsyncClient(
+    timeout=httpx.Timeout(HTTP_TIMEOUT[1], connect=HTTP_TIMEOUT[0]),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+provider_cfg = {'document': None, 'expires_at': 0}
+
+async def get_google_provider_cfg():
+    # Kept until the document's max-age runs out
+    if provider_cfg['document'] is None or time.monotonic() >= provider_cfg['expires_at']:
+        with metrics.timed('oauth'):
+            response = await http.get(main.GOOGLE_DISCOVERY_URL)
+        provider_cfg['document'] = response.json()
+        provider_cfg['expires_at'] = time.monotonic() + HttpUtils.get_max_age(response.headers)
+    return provider_cfg['document']
+
+# The user flask_login put in the session, read at most once per request
+async def get_current_user():
+    if 'user' not in g:
+        user_id = session.get('_user_id') or load_remembered_user_id()
+        g.user = await users_repo.get(user_id) if user_id else None
+    return g.user
+
+# Same as flask_login: without a user in the session, a valid remember cookie logs them back in
+def load_remembered_user_id():
+    cookie = request.cookies.get(REMEMBER_COOKIE_NAME)
+    if not cookie:
+        return None
+    app.session_interface.load_secret_key(app)
+    user_id = decode_cookie(cookie, key=app.secret_key)
+    if user_id is not None:
+        session['_user_id'] = user_id
+        session['_fresh'] = False
+    return user_id
+
+async def is_logged_in():
+    user = await get_current_user()
+    return user is not None and user.is_active
+
+def login_required(view):
+    @functools.wraps(view)
+    async def wrapper(*args, **kwargs):
+        if not await is_logged_in():
+            return redirect("/")
+        # Same as flask_login's confirm_login
+        session['_fresh'] = True
+        return await view(*args, **kwargs)
+    return wrapper
+
+# Async version of main.anonymous_page_cache, sharing its cache
+def anonymous_page_cache(view):
+    @functools.wraps(view)
+    async def wrapper(*args, **kwargs):
+        if await is_logged_in():
+            return await view(*args, **kwargs)
+
+        page = main.page_cache.get(request.path)
+        if page is None:
+            page = main.page_cache.put(request.path, await view(*args, **kwargs))
+
+        response = await make_response(page.body)
+        response.set_etag(page.etag)
+        response.last_modified = page.last_modified
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return await response.make_conditional(request)
+    return wrapper
+
+@app.context_processor
+async def inject_fragments():
+    user_logged_in = await is_logged_in()
+    return {
+        'head': main.fragments['head'],
+        'nav': main.fragments['nav'][user_logged_in],
+        'foot': main.fragments['foot']
+    }
+
+@app.route("/login")
+async def login():
+    url = request.args.get('url')
+    if url is None:
+        url = "/"
+
+    google_provider_cfg = await get_google_provider_cfg()
+    request_uri = main.oauth_client.get().prepare_request_uri(
+        google_provider_cfg["authorization_endpoint"],
+        redirect_uri=request.base_url + "/callback",
+        scope=["openid", "email", "profile"],
+    )
+    resp = redirect(request_uri)
+    resp.set_cookie('redirect_url', url)
+    return resp
+
+@app.route("/login/callback")
+async def callback():
+    code = request.args.get("code")
+    google_provider_cfg = await get_google_provider_cfg()
+
+    token_url, headers, body = main.oauth_client.get().prepare_token_request(
+        google_provider_cfg["token_endpoint"],
+        authorization_response=request.url,
+        redirect_url=request.base_url,
+        code=code
+    )
+    with metrics.timed('oauth'):
+        token_response = await http.post(token_url, headers=headers, content=body,
+            auth=main.get_client_credentials())
+    main.oauth_client.get().parse_request_body_response(json.dumps(token_response.json()))
+
+    uri, headers, body = main.oauth_client.get().add_token(google_provider_cfg["userinfo_endpoint"])
+    with metrics.timed('oauth'):
+        userinfo = (await http.get(uri, headers=headers)).json()
+    if not userinfo.get("email_verified"):
+        return "User email not available or not verified by Google.", 400
+
+    user = await users_repo.login(userinfo["sub"], userinfo["given_name"], userinfo["email"])
+
+    # The session keys flask_login.login_user(user, remember=True) sets, so both apps see the login
+    session['_user_id'] = user.id
+    session['_fresh'] = True
+    session['_remember'] = 'set'
+    resp = redirect(request.cookies.get('redirect_url') or "/")
+    resp.delete_cookie('redirect_url')
+    return resp
+
+@app.route("/")
+@anonymous_page_cache
+async def home():
+    (board, quizzes, counters) = await asyncio.gather(leaderboards_repo.get_board(ALL_TIME), quizzes_repo.get_all(), quiz_counters_repo.get_all())
+    ranks = board.top(main.LEADERBOARD_SIZE)
+    user_logged_in = await is_logged_in()
+    user_rank = None
+    if user_logged_in:
+        session['_fresh'] = True
+        user_rank = board.rank((await get_current_user()).id)
+        if user_rank and user_rank.place <= main.LEADERBOARD_SIZE:
+            user_rank = None
+
+    return await render_template('home.html', base_url=main.BASE_URL, user_logged_in=user_logged_in, ranks=ranks, user_rank=user_rank,
+        quizzes=quizzes, levels=sorted({q.level for q in quizzes}), counters=counters)
+
+@app.route("/user/profile")
+@login_required
+async def user_profile():
+    user = await get_current_user()
+    ((attempts, next_cursor), stats) = await asyncio.gather(
+        quiz_attempts_repo.get_page_for_user(user.id, main.PROFILE_PAGE_SIZE), user_stats_repo.get(user.id))
+    return await render_template('profile.html', user=user.to_stats_display_dict(stats), attempts=[a.to_display_dict() for a in attempts], next_cursor=next_cursor, base_url=main.BASE_URL)
+
+@app.route("/quiz/<quiz_id>")
+@login_required
+async def quiz(quiz_id):
+    question_language = request.args.get('question_language')
+    answer_language = request.args.get('answer_language')
+
+    # If someone tries to go directly to the URL
+    if question_language == answer_language:
+        return redirect("/")
+    if question_language not in LANGUAGES or answer_language not in LANGUAGES:
+        return abort(400)
+
+    quiz = await quizzes_repo.get(quiz_id)
+    if not quiz:
+        return abort(404)
+
+    return await render_template('quiz.html',
+        quiz_id=quiz.id,
+        quiz=quiz.get_quiz_view(question_language),
+        quiz_question_ids=quiz.question_ids,
+        question_language=question_language,
+        answer_language=answer_language,
+        max_answer_chars=quiz.get_submission_schema().max_answer_chars,
+        base_url=main.BASE_URL)
+
+@app.route('/quiz/<quiz_id>/submit', methods=['POST'])
+@login_required
+async def quiz_submit(quiz_id):
+    user = await get_current_user()
+    quiz = await quizzes_repo.get(quiz_id)
+    if not quiz:
+        return abort(404)
+
+    # Same limit and schema as the Flask route, the body stops being read past the limit
+    schema = quiz.get_submission_schema()
+    if (request.content_length or 0) > schema.max_body_bytes:
+        return abort(413)
+    body = bytearray()
+    async for chunk in request.body:
+        body += chunk
+        if len(body) > schema.max_body_bytes:
+            return abort(413)
+    try:
+        (question_language, answer_language, answers) = schema.parse(json.loads(body))
+    except (ValueError, RecursionError) as e:
+        return abort(400, str(e))
+
+    try:
+        with metrics.timed('grading'):
+            attempt = QuizUtils.score_answers(user, quiz, question_language, answer_language, answers)
+        await quiz_attempts_repo.save(attempt, user.display_name)
+    except Exception as e:
+        logger.exception(f"Quiz {quiz_id} submission failed")
+        return abort(500, str(e))
+
+    response = {
+        'results': attempt.get_results(),
+        'score': MiscUtils.format_percent(attempt.score)
+    }
+    return json.dumps(response, ensure_ascii=False)
+
+class RouteDispatcher:
+    """Sends requests for the routes above to the async app and everything else to the
+    WSGI app, which runs on the server's thread pool."""
+    def __init__(self, async_app, wsgi_app):
+        self.async_app = async_app
+        self.wsgi_app = AsyncioWSGIMiddleware(wsgi_app)
+        self.routes = async_app.url_map.bind("localhost")
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not self.is_async_route(scope):
+            return await self.wsgi_app(scope, receive, send)
+        return await self.async_app(scope, receive, send)
+
+    def is_async_route(self, scope):
+        try:
+            self.routes.match(scope['path'], method=scope['method'])
+            return True
+        except (NotFound, MethodNotAllowed, RequestRedirect):
+            return False
+
+application = RouteDispatcher(app, main.app)
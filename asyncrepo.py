@@ -0,0 +1,131 @@
+import time
+from models import *
+from repo import UsersRepo, QuizAttemptsRepo, UserStatsRepo, QuizzesRepo, LeaderboardsRepo, ReviewItemsRepo, QuizCountersRepo
+from leaderboardutils import SortedLeaderboard, ALL_TIME
+from reviewutils import ReviewUtils
+from backends import get_async_backend
+
+# Async counterparts of the repos in repo.py for the ASGI app, covering what its routes need.
+# Documents and caches are shared with the sync repos.
+
+class AsyncFirestoreRepo:
+    def __init__(self, collection, backend=None):
+        self.explicit_backend = backend
+        self.collection = collection
+
+    @property
+    def backend(self):
+        return self.explicit_backend or get_async_backend()
+
+    async def get(self, filename):
+        return await self.backend.get(self.collection, filename)
+
+    async def get_all(self):
+        return await self.backend.get_all(self.collection)
+
+class AsyncUsersRepo(AsyncFirestoreRepo):
+    def __init__(self, backend=None):
+        super().__init__("users", backend)
+
+    async def get(self, user_id: str):
+        user = UsersRepo.get_cached(user_id)
+        if user is None:
+            user = await super().get(user_id)
+        if user:
+            return User.from_dict(user)
+        return None
+
+    # Same as UsersRepo.login, one read and one write
+    async def login(self, user_id: str, name: str, email: str):
+        user = await self.get(user_id)
+        UsersRepo.invalidate(user_id)
+        if not user:
+            user = User(id=user_id, name=name, display_name=name, email=email, is_active=True, is_authenticated=True)
+            await self.backend.save(self.collection, user_id, dict(user.to_dict(), updated_at=time.time()))
+            return user
+        await self.backend.update(self.collection, user_id, {'is_active': True, 'is_authenticated': True, 'updated_at': time.time()})
+        user.is_active = True
+        user.is_authenticated = True
+        return user
+
+class AsyncQuizAttemptsRepo(AsyncFirestoreRepo):
+    def __init__(self, backend=None, write_queue=None):
+        super().__init__(QuizAttemptsRepo.COLLECTION, backend)
+        self.write_queue = write_queue
+
+    async def get_page_for_user(self, user_id: str, limit: int, cursor: tuple = None):
+        docs = await self.backend.query_page(self.collection, 'user_id', user_id, 'timestamp', limit,
+            start_after=cursor, descending=True, fields=QuizAttempt.SUMMARY_FIELDS)
+        return QuizAttemptsRepo.to_page(docs, limit)
+
+    async def save(self, attempt: QuizAttempt, display_name: str = None):
+        # Same writes as QuizAttemptsRepo.save, only the reads and the commit are async
+        item_ids = ReviewUtils.get_item_ids(attempt)
+        review_items = ReviewItemsRepo.to_items(item_ids, await self.backend.get_many(ReviewItemsRepo.COLLECTION, item_ids), self.write_queue)
+        writes = QuizAttemptsRepo.get_writes(attempt, display_name, review_items)
+        if not (self.write_queue and self.write_queue.put(writes)):
+            await self.backend.batch_save(writes)
+        LeaderboardsRepo.record(attempt, display_name)
+
+class AsyncUserStatsRepo(AsyncFirestoreRepo):
+    def __init__(self, backend=None):
+        super().__init__(UserStatsRepo.COLLECTION, backend)
+
+    async def get(self, user_id: str):
+        stats = await super().get(user_id)
+        if stats:
+            return UserStats.from_dict(stats)
+        return None
+
+    async def get_all(self):
+        return [UserStats.from_dict(s) for s in await self.backend.order_by(self.collection, 'total_score', descending=True)]
+
+class AsyncLeaderboardsRepo(AsyncFirestoreRepo):
+    def __init__(self, backend=None):
+        super().__init__(LeaderboardsRepo.COLLECTION, backend)
+
+    # Shares LeaderboardsRepo's boards
+    async def get_board(self, scope: str):
+        board = LeaderboardsRepo.get_cached(scope)
+        if board is None:
+            board = LeaderboardsRepo.put_cached(scope, SortedLeaderboard(await self.load(scope)))
+        return board
+
+    async def load(self, scope: str):
+        if scope == ALL_TIME:
+            docs = await self.backend.query(UserStatsRepo.COLLECTION, 'count_quizzes', ">", 0)
+        else:
+            docs = await self.backend.query(self.collection, 'scope', "==", scope)
+        return [UserStats.from_dict(d) for d in docs]
+
+class AsyncQuizCountersRepo(AsyncFirestoreRepo):
+    def __init__(self, backend=None):
+        super().__init__(QuizCountersRepo.COLLECTION, backend)
+
+    # Shares QuizCountersRepo's cached sums
+    async def get_all(self):
+        counters = QuizCountersRepo.get_cached()
+        if counters is None:
+            counters = QuizCountersRepo.put_cached(QuizCountersRepo.sum_shards(await super().get_all()))
+        return counters
+
+class AsyncQuizzesRepo(AsyncFirestoreRepo):
+    def __init__(self, backend=None):
+        super().__init__("quizzes", backend)
+
+    async def get(self, quiz_id: str):
+        return (await self.get_catalog()).get(quiz_id)
+
+    async def get_all(self):
+        return list((await self.get_catalog()).values())
+
+    # Shares QuizzesRepo's process cache, warm lookups do no I/O
+    async def get_catalog(self):
+        return await QuizzesRepo.cache.get_items_async(self.get_version, self.load_catalog)
+
+    async def load_catalog(self):
+        return {q.id: q for q in [Quiz.from_dict(q) for q in await super().get_all()]}
+
+    async def get_version(self):
+        doc = await self.backend.get(QuizzesRepo.METADATA_COLLECTION, "quizzes")
+        return doc.get('version') if doc else None
@@ -0,0 +1,611 @@
+import os
+import time
+import copy
+import json
+import heapq
+import asyncio
+import sqlite3
+import operator
+import threading
+from startuputils import startup_timer
+from metricsutils import metrics
+
+# Storage engines behind FirestoreRepo. Every backend deals in plain dicts keyed by
+# (collection, document id) so the model repos don't care where the data lives.
+
+class Increment:
+    """Atomic numeric increment for a field, used in merged writes."""
+    def __init__(self, value):
+        self.value = value
+
+# Applies a merged write to doc in place the way Firestore's set(merge=True) does: nested
+# maps are merged field by field and increments add to what is there (or start from 0).
+# With keep_increments the result stays a write rather than a document, for coalescing
+# several writes before they are sent.
+def merge_fields(doc, data, keep_increments=False):
+    for (k, v) in data.items():
+        previous = doc.get(k)
+        if isinstance(v, Increment):
+            if isinstance(previous, Increment):
+                doc[k] = Increment(previous.value + v.value)
+            elif isinstance(previous, (int, float)) and not isinstance(previous, bool):
+                doc[k] = previous + v.value
+            else:
+                doc[k] = Increment(v.value) if keep_increments else v.value
+        elif isinstance(v, dict):
+            doc[k] = merge_fields(previous if isinstance(previous, dict) else {}, v, keep_increments)
+        else:
+            doc[k] = copy.deepcopy(v)
+    return doc
+
+class StorageBackend:
+    """Interface every storage engine implements."""
+    def query(self, collection, field, operation, val):
+        raise NotImplementedError()
+
+    def get(self, collection, id):
+        raise NotImplementedError()
+
+    def get_all(self, collection):
+        raise NotImplementedError()
+
+    # Existing documents among ids, in the order asked for
+    def get_many(self, collection, ids):
+        raise NotImplementedError()
+
+    def order_by(self, collection, field, descending=False):
+        raise NotImplementedError()
+
+    # One page of the documents where field == val, ordered by (order_field, id) and starting
+    # after start_after, the last document's (order_field value, id). fields limits which
+    # fields come back.
+    def query_page(self, collection, field, val, order_field, limit, start_after=None, descending=True, fields=None):
+        raise NotImplementedError()
+
+    # list[(id, document)] for the whole collection, for one-off backfills
+    def items(self, collection):
+        raise NotImplementedError()
+
+    # One page of (id, document) in document id order, or in (order_field, id) order limited
+    # to since < order_field <= until. start_after is the last item's id, or its
+    # (order_field value, id), and documents without the order field are left out.
+    def items_page(self, collection, limit, start_after=None, order_field=None, since=None, until=None):
+        raise NotImplementedError()
+
+    def save(self, collection, id, data, merge=False):
+        raise NotImplementedError()
+
+    # Changes only the given fields of an existing document with no prior read,
+    # returns False if the document doesn't exist
+    def update(self, collection, id, fields):
+        raise NotImplementedError()
+
+    # writes: list of (collection, id, data, merge), applied atomically
+    def batch_save(self, writes):
+        raise NotImplementedError()
+
+class FirestoreBackend(StorageBackend):
+    def __init__(self):
+        import firebase_admin
+        from firebase_admin import firestore
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app()
+        self.firestore = firestore
+        self.db = firestore.client()
+
+    def query(self, collection, field, operation, val):
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        docs = self.db.collection(collection).where(filter=FieldFilter(field, operation, val)).stream()
+        return [doc.to_dict() for doc in docs]
+
+    def get(self, collection, id):
+        return self.db.collection(collection).document(id).get().to_dict()
+
+    def get_all(self, collection):
+        docs = self.db.collection(collection).get()
+        return [doc.to_dict() for doc in docs]
+
+    # One BatchGetDocuments round trip, which returns snapshots in any order
+    def get_many(self, collection, ids):
+        snapshots = self.db.get_all([self.db.collection(collection).document(id) for id in ids])
+        docs = {s.id: s.to_dict() for s in snapshots if s.exists}
+        return [docs[id] for id in ids if id in docs]
+
+    def order_by(self, collection, field, descending=False):
+        direction = self.firestore.Query.DESCENDING if descending else self.firestore.Query.ASCENDING
+        docs = self.db.collection(collection).order_by(field, direction=direction).stream()
+        return [doc.to_dict() for doc in docs]
+
+    def query_page(self, collection, field, val, order_field, limit, start_after=None, descending=True, fields=None):
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        from google.cloud.firestore_v1.field_path import FieldPath
+        direction = self.firestore.Query.DESCENDING if descending else self.firestore.Query.ASCENDING
+        query = self.db.collection(collection).where(filter=FieldFilter(field, '==', val)) \
+            .order_by(order_field, direction=direction).order_by(FieldPath.document_id(), direction=direction)
+        if start_after is not None:
+            (value, id) = start_after
+            query = query.start_after({order_field: value, FieldPath.document_id(): self.db.collection(collection).document(id)})
+        if fields:
+            query = query.select(fields)
+        return [doc.to_dict() for doc in query.limit(limit).stream()]
+
+    def items(self, collection):
+        return [(doc.id, doc.to_dict()) for doc in self.db.collection(collection).stream()]
+
+    def items_page(self, collection, limit, start_after=None, order_field=None, since=None, until=None):
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        from google.cloud.firestore_v1.field_path import FieldPath
+        query = self.db.collection(collection)
+        if order_field:
+            if since is not None:
+                query = query.where(filter=FieldFilter(order_field, '>', since))
+            if until is not None:
+                query = query.where(filter=FieldFilter(order_field, '<=', until))
+            query = query.order_by(order_field)
+        query = query.order_by(FieldPath.document_id())
+        if start_after is not None:
+            (value, id) = start_after if order_field else (None, start_after)
+            cursor = {FieldPath.document_id(): self.db.collection(collection).document(id)}
+            query = query.start_after({order_field: value, **cursor} if order_field else cursor)
+        return [(doc.id, doc.to_dict()) for doc in query.limit(limit).stream()]
+
+    def save(self, collection, id, data, merge=False):
+        self.db.collection(collection).document(id).set(self.to_firestore(data), merge=merge)
+
+    def update(self, collection, id, fields):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.db.collection(collection).document(id).update(self.to_firestore(fields))
+            return True
+        except NotFound:
+            return False
+
+    def batch_save(self, writes):
+        batch = self.db.batch()
+        for (collection, id, data, merge) in writes:
+            batch.set(self.db.collection(collection).document(id), self.to_firestore(data), merge=merge)
+        batch.commit()
+
+    def to_firestore(self, data):
+        return to_firestore(self.firestore, data)
+
+# Swaps our Increments for Firestore's, including inside nested maps
+def to_firestore(firestore, data):
+    converted = {}
+    for (k, v) in data.items():
+        if isinstance(v, Increment):
+            converted[k] = firestore.Increment(v.value)
+        elif isinstance(v, dict):
+            converted[k] = to_firestore(firestore, v)
+        else:
+            converted[k] = v
+    return converted
+
+class MemoryBackend(StorageBackend):
+    """In-process stand-in for Firestore, for benchmarks and local runs with no network."""
+    OPERATIONS = {
+        '==': operator.eq,
+        '!=': operator.ne,
+        '<': operator.lt,
+        '<=': operator.le,
+        '>': operator.gt,
+        '>=': operator.ge,
+        'in': lambda a, b: a in b,
+        'not-in': lambda a, b: a not in b,
+        'array_contains': lambda a, b: b in a
+    }
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.collections = {} # dict[collection, dict[id, document]]
+
+    def documents(self, collection):
+        return self.collections.setdefault(collection, {})
+
+    def query(self, collection, field, operation, val):
+        match = self.OPERATIONS[operation]
+        with self.lock:
+            return [copy.deepcopy(d) for d in self.documents(collection).values() if field in d and match(d[field], val)]
+
+    def get(self, collection, id):
+        with self.lock:
+            return copy.deepcopy(self.documents(collection).get(id))
+
+    def get_all(self, collection):
+        with self.lock:
+            return [copy.deepcopy(d) for (_, d) in sorted(self.documents(collection).items())]
+
+    def get_many(self, collection, ids):
+        with self.lock:
+            docs = self.documents(collection)
+            return [copy.deepcopy(docs[id]) for id in ids if id in docs]
+
+    def order_by(self, collection, field, descending=False):
+        with self.lock:
+            docs = [copy.deepcopy(d) for d in self.documents(collection).values() if field in d]
+        return sorted(docs, key=lambda d: d[field], reverse=descending)
+
+    def query_page(self, collection, field, val, order_field, limit, start_after=None, descending=True, fields=None):
+        with self.lock:
+            items = [(d[order_field], id, d) for (id, d) in self.documents(collection).items() if order_field in d and d.get(field) == val]
+            if start_after is not None:
+                after = tuple(start_after)
+                items = [i for i in items if (i[:2] < after if descending else i[:2] > after)]
+            items = (heapq.nlargest if descending else heapq.nsmallest)(limit, items, key=lambda i: i[:2])
+            # Only the returned page is copied
+            return [{k: copy.deepcopy(d[k]) for k in fields if k in d} if fields else copy.deepcopy(d) for (_, _, d) in items]
+
+    def items(self, collection):
+        with self.lock:
+            return [(id, copy.deepcopy(d)) for (id, d) in sorted(self.documents(collection).items())]
+
+    def items_page(self, collection, limit, start_after=None, order_field=None, since=None, until=None):
+        key = (lambda item: (item[1][order_field], item[0])) if order_field else (lambda item: item[0])
+        with self.lock:
+            items = [(id, d) for (id, d) in self.documents(collection).items() if not order_field or (order_field in d
+                and (since is None or d[order_field] > since) and (until is None or d[order_field] <= until))]
+            if start_after is not None:
+                after = tuple(start_after) if order_field else start_after
+                items = [i for i in items if key(i) > after]
+            # Only the returned page is copied
+            return [(id, copy.deepcopy(d)) for (id, d) in heapq.nsmallest(limit, items, key=key)]
+
+    def save(self, collection, id, data, merge=False):
+        self.batch_save([(collection, id, data, merge)])
+
+    def update(self, collection, id, fields):
+        with self.lock:
+            if id not in self.documents(collection):
+                return False
+            self.batch_save([(collection, id, fields, True)])
+            return True
+
+    def batch_save(self, writes):
+        with self.lock:
+            for (collection, id, data, merge) in writes:
+                docs = self.documents(collection)
+                docs[id] = merge_fields(docs.get(id, {}) if merge else {}, data)
+
+class SqliteBackend(StorageBackend):
+    """Single-file local engine. Documents are stored as JSON, with user_id and quiz_id
+    copied into indexed columns so the per-user and per-quiz attempt queries don't scan."""
+    INDEXED_FIELDS = ['user_id', 'quiz_id']
+    # (collection, filter field, order field) of the query_page queries on fields without a column,
+    # the collection is only part of the index name
+    EXPRESSION_INDEXES = [('review_items', 'deck', 'due')]
+    # (collection, order field) of the items_page exports that page in that field's order
+    ORDER_INDEXES = [('quiz_attempts', 'timestamp'), ('users', 'updated_at')]
+    OPERATIONS = {
+        '==': '=',
+        '!=': '!=',
+        '<': '<',
+        '<=': '<=',
+        '>': '>',
+        '>=': '>=',
+        'in': 'IN',
+        'not-in': 'NOT IN'
+    }
+
+    def __init__(self, path: str = None):
+        self.path = path or os.environ.get("SQLITE_PATH", "jce.sqlite3")
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    collection TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    user_id TEXT,
+                    quiz_id TEXT,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (collection, id)
+                )""")
+            for field in self.INDEXED_FIELDS:
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS documents_{field} ON documents (collection, {field})")
+            for (collection, field, order_field) in self.EXPRESSION_INDEXES:
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS documents_{collection}_{field}_{order_field} ON documents "
+                    f"(collection, json_extract(data, '$.{field}'), json_extract(data, '$.{order_field}'))")
+            for (collection, order_field) in self.ORDER_INDEXES:
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS documents_{collection}_{order_field} ON documents "
+                    f"(collection, json_extract(data, '$.{order_field}'), id)")
+
+    def column(self, field):
+        return field if field in self.INDEXED_FIELDS else "json_extract(data, ?)"
+
+    def select(self, sql, params):
+        with self.lock:
+            return [json.loads(row[0]) for row in self.connection.execute(sql, params)]
+
+    def query(self, collection, field, operation, val):
+        if operation not in self.OPERATIONS:
+            match = MemoryBackend.OPERATIONS[operation]
+            return [d for d in self.get_all(collection) if field in d and match(d[field], val)]
+
+        params = [collection]
+        column = self.column(field)
+        if field not in self.INDEXED_FIELDS:
+            params.append(f"$.{field}")
+        if operation in ['in', 'not-in']:
+            values = list(val)
+            condition = f"{column} {self.OPERATIONS[operation]} ({', '.join('?' for _ in values)})"
+            params += values
+        else:
+            condition = f"{column} {self.OPERATIONS[operation]} ?"
+            params.append(val)
+        return self.select(f"SELECT data FROM documents WHERE collection = ? AND {condition}", params)
+
+    def get(self, collection, id):
+        docs = self.select("SELECT data FROM documents WHERE collection = ? AND id = ?", [collection, id])
+        return docs[0] if docs else None
+
+    def get_all(self, collection):
+        return self.select("SELECT data FROM documents WHERE collection = ? ORDER BY id", [collection])
+
+    def get_many(self, collection, ids):
+        ids = list(ids)
+        docs = {}
+        # Stay well under SQLite's bound parameter limit
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            with self.lock:
+                rows = self.connection.execute(f"SELECT id, data FROM documents WHERE collection = ? AND id IN ({', '.join('?' for _ in chunk)})",
+                    [collection] + chunk).fetchall()
+            docs.update({row[0]: json.loads(row[1]) for row in rows})
+        return [docs[id] for id in ids if id in docs]
+
+    def order_by(self, collection, field, descending=False):
+        column = self.column(field)
+        params = [collection] + ([f"$.{field}"] * 2 if field not in self.INDEXED_FIELDS else [])
+        return self.select(f"SELECT data FROM documents WHERE collection = ? AND {column} IS NOT NULL "
+            f"ORDER BY {column} {'DESC' if descending else 'ASC'}", params)
+
+    def query_page(self, collection, field, val, order_field, limit, start_after=None, descending=True, fields=None):
+        # A literal path, so the expression indexes can serve it
+        column = field if field in self.INDEXED_FIELDS else f"json_extract(data, '$.{field}')"
+        params = [collection, val]
+        order = f"json_extract(data, '$.{order_field}')"
+        direction = 'DESC' if descending else 'ASC'
+        condition = ""
+        if start_after is not None:
+            condition = f" AND ({order}, id) {'<' if descending else '>'} (?, ?)"
+            params += list(start_after)
+        docs = self.select(f"SELECT data FROM documents WHERE collection = ? AND {column} = ? AND {order} IS NOT NULL{condition} "
+            f"ORDER BY {order} {direction}, id {direction} LIMIT ?", params + [limit])
+        return [{k: d[k] for k in fields if k in d} if fields else d for d in docs]
+
+    def items(self, collection):
+        with self.lock:
+            return [(row[0], json.loads(row[1])) for row in self.connection.execute(
+                "SELECT id, data FROM documents WHERE collection = ? ORDER BY id", [collection])]
+
+    def items_page(self, collection, limit, start_after=None, order_field=None, since=None, until=None):
+        params = [collection]
+        conditions = ""
+        if order_field:
+            order = f"json_extract(data, '$.{order_field}')"
+            conditions += f" AND {order} IS NOT NULL"
+            if since is not None:
+                conditions += f" AND {order} > ?"
+                params.append(since)
+            if until is not None:
+                conditions += f" AND {order} <= ?"
+                params.append(until)
+            if start_after is not None:
+                conditions += f" AND ({order}, id) > (?, ?)"
+                params += list(start_after)
+        elif start_after is not None:
+            conditions += " AND id > ?"
+            params.append(start_after)
+        order_by = f"{order}, id" if order_field else "id"
+        with self.lock:
+            return [(row[0], json.loads(row[1])) for row in self.connection.execute(
+                f"SELECT id, data FROM documents WHERE collection = ?{conditions} ORDER BY {order_by} LIMIT ?", params + [limit])]
+
+    def save(self, collection, id, data, merge=False):
+        self.batch_save([(collection, id, data, merge)])
+
+    def update(self, collection, id, fields):
+        return self.batch_save([(collection, id, fields, True)], must_exist=True)
+
+    def batch_save(self, writes, must_exist=False):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for (collection, id, data, merge) in writes:
+                    doc = {}
+                    if merge:
+                        row = cursor.execute("SELECT data FROM documents WHERE collection = ? AND id = ?", [collection, id]).fetchone()
+                        if not row and must_exist:
+                            cursor.execute("ROLLBACK")
+                            return False
+                        doc = json.loads(row[0]) if row else {}
+                    merge_fields(doc, data)
+                    cursor.execute("INSERT OR REPLACE INTO documents (collection, id, user_id, quiz_id, data) VALUES (?, ?, ?, ?, ?)",
+                        [collection, id, doc.get('user_id'), doc.get('quiz_id'), json.dumps(doc, ensure_ascii=False)])
+                cursor.execute("COMMIT")
+                return True
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+class LatencyBackend:
+    """Adds a fixed delay to every call of a local backend to stand in for Firestore's
+    network round trips in load tests (DATASTORE_LATENCY_MS)."""
+    def __init__(self, backend: StorageBackend, latency_seconds: float):
+        self.backend = backend
+        self.latency_seconds = latency_seconds
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+        def call(*args, **kwargs):
+            time.sleep(self.latency_seconds)
+            return method(*args, **kwargs)
+        return call
+
+class AsyncFirestoreBackend:
+    """Async counterpart of FirestoreBackend on Firestore's AsyncClient, for the ASGI app."""
+    def __init__(self):
+        import firebase_admin
+        from firebase_admin import firestore, firestore_async
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app()
+        self.firestore = firestore
+        self.db = firestore_async.client()
+
+    async def query(self, collection, field, operation, val):
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        return [doc.to_dict() async for doc in self.db.collection(collection).where(filter=FieldFilter(field, operation, val)).stream()]
+
+    async def get(self, collection, id):
+        return (await self.db.collection(collection).document(id).get()).to_dict()
+
+    async def get_all(self, collection):
+        return [doc.to_dict() async for doc in self.db.collection(collection).stream()]
+
+    async def get_many(self, collection, ids):
+        snapshots = [s async for s in self.db.get_all([self.db.collection(collection).document(id) for id in ids])]
+        docs = {s.id: s.to_dict() for s in snapshots if s.exists}
+        return [docs[id] for id in ids if id in docs]
+
+    async def order_by(self, collection, field, descending=False):
+        direction = self.firestore.Query.DESCENDING if descending else self.firestore.Query.ASCENDING
+        return [doc.to_dict() async for doc in self.db.collection(collection).order_by(field, direction=direction).stream()]
+
+    async def query_page(self, collection, field, val, order_field, limit, start_after=None, descending=True, fields=None):
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        from google.cloud.firestore_v1.field_path import FieldPath
+        direction = self.firestore.Query.DESCENDING if descending else self.firestore.Query.ASCENDING
+        query = self.db.collection(collection).where(filter=FieldFilter(field, '==', val)) \
+            .order_by(order_field, direction=direction).order_by(FieldPath.document_id(), direction=direction)
+        if start_after is not None:
+            (value, id) = start_after
+            query = query.start_after({order_field: value, FieldPath.document_id(): self.db.collection(collection).document(id)})
+        if fields:
+            query = query.select(fields)
+        return [doc.to_dict() async for doc in query.limit(limit).stream()]
+
+    async def save(self, collection, id, data, merge=False):
+        await self.db.collection(collection).document(id).set(self.to_firestore(data), merge=merge)
+
+    async def update(self, collection, id, fields):
+        from google.api_core.exceptions import NotFound
+        try:
+            await self.db.collection(collection).document(id).update(self.to_firestore(fields))
+            return True
+        except NotFound:
+            return False
+
+    async def batch_save(self, writes):
+        batch = self.db.batch()
+        for (collection, id, data, merge) in writes:
+            batch.set(self.db.collection(collection).document(id), self.to_firestore(data), merge=merge)
+        await batch.commit()
+
+    def to_firestore(self, data):
+        return to_firestore(self.firestore, data)
+
+class AsyncBackendAdapter:
+    """Async face for the local backends. Their calls are in-process and fast, so they run
+    directly on the event loop, after awaiting the simulated latency if there is one."""
+    def __init__(self, backend: StorageBackend, latency_seconds: float = 0):
+        self.backend = backend
+        self.latency_seconds = latency_seconds
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+        async def call(*args, **kwargs):
+            if self.latency_seconds:
+                await asyncio.sleep(self.latency_seconds)
+            return method(*args, **kwargs)
+        return call
+
+class InstrumentedBackend:
+    """Times every call to a backend, sync or async, for /metrics and the current
+    request's Firestore call count. Wrapped methods are cached on first use."""
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+        if not callable(method):
+            return method
+        if asyncio.iscoroutinefunction(method):
+            async def call(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = await method(*args, **kwargs)
+                except Exception:
+                    metrics.add_firestore_call(name, time.perf_counter() - started, failed=True)
+                    raise
+                metrics.add_firestore_call(name, time.perf_counter() - started)
+                return result
+        else:
+            def call(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = method(*args, **kwargs)
+                except Exception:
+                    metrics.add_firestore_call(name, time.perf_counter() - started, failed=True)
+                    raise
+                metrics.add_firestore_call(name, time.perf_counter() - started)
+                return result
+        setattr(self, name, call)
+        return call
+
+BACKENDS = {
+    'firestore': FirestoreBackend,
+    'memory': MemoryBackend,
+    'sqlite': SqliteBackend
+}
+
+backend = None
+local_backend = None
+async_backend = None
+backend_lock = threading.Lock()
+
+def get_backend_name():
+    return os.environ.get("DATASTORE_BACKEND", "firestore")
+
+def get_latency_seconds():
+    return float(os.environ.get("DATASTORE_LATENCY_MS", 0))/1000
+
+# The memory and sqlite engines are shared by the sync and async backends so both see the same data
+def get_local_backend():
+    global local_backend
+    if local_backend is None:
+        local_backend = BACKENDS[get_backend_name()]()
+    return local_backend
+
+# The process-wide backend, chosen by the DATASTORE_BACKEND environment variable
+# (firestore, memory or sqlite, the last one stored at SQLITE_PATH)
+def get_backend():
+    global backend
+    if backend is not None:
+        return backend
+    with backend_lock:
+        if backend is None:
+            if get_backend_name() == 'firestore':
+                with startup_timer.phase("firestore client"):
+                    backend = InstrumentedBackend(FirestoreBackend())
+            elif get_latency_seconds() > 0:
+                backend = InstrumentedBackend(LatencyBackend(get_local_backend(), get_latency_seconds()))
+            else:
+                backend = InstrumentedBackend(get_local_backend())
+        return backend
+
+# The process-wide async backend for the ASGI app
+def get_async_backend():
+    global async_backend
+    if async_backend is not None:
+        return async_backend
+    with backend_lock:
+        if async_backend is None:
+            if get_backend_name() == 'firestore':
+                with startup_timer.phase("firestore async client"):
+                    async_backend = InstrumentedBackend(AsyncFirestoreBackend())
+            else:
+                async_backend = InstrumentedBackend(AsyncBackendAdapter(get_local_backend(), get_latency_seconds()))
+        return async_backend
@@ -0,0 +1,267 @@
+"""Benchmarks for grading, the leaderboard and page rendering.
+
+Runs with no network against the in-memory datastore, seeded with the real
+quizzes/*.json files plus synthetic users and attempts:
+
+    python benchmark.py --users 200 --attempts 20 --save baseline.json
+    python benchmark.py --users 200 --attempts 20 --compare baseline.json
+
+It also compares the slotted models against __dict__ versions of the same classes, for
+memory per 100k decoded attempts and decode/encode throughput (--model-attempts).
+"""
+import os
+import gc
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tracemalloc
+from urllib.parse import urlsplit
+import stubidp
+
+# Must be configured before main is imported. Logins go to a local stub identity provider.
+identity_provider = stubidp.serve_in_background()
+os.environ["DATASTORE_BACKEND"] = "memory"
+os.environ["OPENID_DISCOVERY_URL"] = stubidp.discovery_url(identity_provider)
+os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
+for key in ["SECRET_KEY", "GOOGLE_CLIENT_ID", "GOOGLE_CLIENT_SECRET"]:
+    os.environ.setdefault(key, "benchmark")
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import render_template
+from models import *
+from quizutils import QuizUtils
+from leaderboardutils import SortedLeaderboard, ALL_TIME
+from httputils import HTTP_TIMEOUT
+import main
+
+class BenchmarkData:
+    """Synthetic dataset: every bundled quiz, `users` users with `attempts` attempts each."""
+    def __init__(self, users: int, attempts: int, seed: int = 1):
+        self.random = random.Random(seed)
+        main.quizzes_repo.sync()
+        self.quizzes = main.quizzes_repo.get_all()
+        self.users = []
+        for i in range(users):
+            user = User(f"user-{i}", f"User {i}", f"Student {i}", f"user{i}@example.com", True, True)
+            main.users_repo.save(user)
+            self.users.append(user)
+            for _ in range(attempts):
+                quiz = self.random.choice(self.quizzes)
+                attempt = QuizUtils.score(user, quiz, self.submission(quiz))
+                main.quiz_attempts_repo.save(attempt, user.display_name)
+        self.user = self.users[0] if self.users else None
+
+    # A submission payload that gets roughly 70% of the answers right
+    def submission(self, quiz: Quiz):
+        (question_language, answer_language) = self.random.sample(LANGUAGES, 2)
+        responses = {}
+        for (id, question) in quiz.questions.items():
+            answer = self.random.choice(question.get_answers(answer_language))
+            if self.random.random() > 0.7:
+                answer = answer[::-1]
+            responses[str(id)] = {'id': str(id), 'answer': answer}
+        return {'question_language': question_language, 'answer_language': answer_language, 'responses': responses}
+
+class Benchmark:
+    def __init__(self, data: BenchmarkData, iterations: int):
+        self.data = data
+        self.iterations = iterations
+        self.results = {}
+        self.memory = {}
+
+    def measure(self, name: str, fn):
+        fn() # warm up
+        timings = []
+        started = time.perf_counter()
+        for _ in range(self.iterations):
+            t = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - started
+        timings.sort()
+        self.results[name] = {
+            'iterations': self.iterations,
+            'ops_per_sec': self.iterations/elapsed if elapsed > 0 else 0,
+            'mean_ms': sum(timings)/len(timings)*1000,
+            'p50_ms': Benchmark.percentile(timings, 50)*1000,
+            'p99_ms': Benchmark.percentile(timings, 99)*1000
+        }
+        return self.results[name]
+
+    @staticmethod
+    def percentile(sorted_values, p):
+        index = min(len(sorted_values) - 1, max(0, round(p/100*len(sorted_values)) - 1))
+        return sorted_values[index]
+
+    def run(self, requests: bool = True):
+        data = self.data
+        user = data.user
+        quiz = max(data.quizzes, key=lambda q: len(q.questions))
+        submission = data.submission(quiz)
+        attempts = main.quiz_attempts_repo.get_all_for_user(user.id)
+        # The all-time board as the home page serves it
+        stats = main.leaderboards_repo.load(ALL_TIME)
+        board = SortedLeaderboard(stats)
+        ranks = board.top(main.LEADERBOARD_SIZE)
+        counters = main.quiz_counters_repo.get_all()
+
+        self.measure('score', lambda: QuizUtils.score(user, quiz, submission))
+        self.measure('build_leaderboard', lambda: SortedLeaderboard(stats))
+        self.measure('leaderboard_top', lambda: board.top(main.LEADERBOARD_SIZE))
+        self.measure('user_to_display_dict', lambda: user.to_display_dict(attempts))
+
+        with main.app.test_request_context('/'):
+            self.measure('render_home', lambda: render_template('home.html', base_url=main.BASE_URL, user_logged_in=True,
+                ranks=ranks, quizzes=data.quizzes, counters=counters))
+            self.measure('render_quiz', lambda: render_template('quiz.html', quiz_id=quiz.id, quiz=quiz.get_quiz_view('english'),
+                quiz_question_ids=quiz.question_ids, question_language='english', answer_language='romanji',
+                base_url=main.BASE_URL))
+
+        if requests:
+            self.run_requests(quiz, submission)
+        return self.results
+
+    # Decoding stored attempts with the slotted models and with __dict__ copies of them
+    def run_models(self, count: int):
+        quiz = max(self.data.quizzes, key=lambda q: len(q.questions))
+        user = self.data.user or User("user-0", "User 0", "Student 0", "user0@example.com", True, True)
+        docs = []
+        for i in range(count):
+            attempt = QuizUtils.score(user, quiz, self.data.submission(quiz))
+            attempt.id = f"attempt-{i}"
+            docs.append(attempt.to_document())
+
+        (DictQuizAttempt, DictQuizResponse) = (unslotted(QuizAttempt), unslotted(QuizResponse))
+        def decode_dict(d):
+            return DictQuizAttempt(d['user_id'], d['quiz_id'], d['quiz_title'], d['question_language'], d['answer_language'], d['score'],
+                {r.question_id: r for r in [DictQuizResponse(q['question_id'], q['question'], q['answers'], q['user_answer'], q['correct']) for q in d['questions'].values()]},
+                d['date'], d.get('timestamp'), d.get('id'))
+
+        self.memory['slots_mb_per_100k'] = Benchmark.memory_per_100k(docs, QuizAttempt.from_dict)
+        self.memory['dict_mb_per_100k'] = Benchmark.memory_per_100k(docs, decode_dict)
+
+        sample = docs[:1000]
+        del docs
+        gc.collect()
+        attempts = [QuizAttempt.from_dict(d) for d in sample]
+        self.measure('decode_1k_attempts', lambda: [QuizAttempt.from_dict(d) for d in sample])
+        self.measure('decode_1k_attempts_dict', lambda: [decode_dict(d) for d in sample])
+        self.measure('encode_1k_attempts', lambda: [a.to_document() for a in attempts])
+
+    # MB held by decoding every doc, scaled to 100k attempts
+    @staticmethod
+    def memory_per_100k(docs, decode):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        decoded = [decode(d) for d in docs]
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del decoded
+        return used/len(docs)*100000/(1024*1024)
+
+    # Whole requests through the Flask test client, logged in as the first synthetic user
+    def run_requests(self, quiz: Quiz, submission: dict):
+        client = main.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = self.data.user.id
+            session['_fresh'] = True
+
+        def request(method, url, **kwargs):
+            response = getattr(client, method)(url, **kwargs)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{method.upper()} {url} returned {response.status_code}")
+
+        self.measure('request_login', self.login)
+
+        quiz_url = f"/quiz/{quiz.id}?question_language={submission['question_language']}&answer_language={submission['answer_language']}"
+        self.measure('request_home', lambda: request('get', '/'))
+        self.measure('request_quiz', lambda: request('get', quiz_url))
+        self.measure('request_submit', lambda: request('post', f"/quiz/{quiz.id}/submit", json=submission))
+        self.measure('request_profile', lambda: request('get', '/user/profile'))
+
+    # The whole OAuth flow against the stub provider: /login, authorize, /login/callback
+    def login(self):
+        client = main.app.test_client()
+        response = client.get('/login?url=/')
+        authorize_url = response.headers['Location'] + "&login_hint=" + self.data.user.id
+        authorized = main.http.get(authorize_url, allow_redirects=False, timeout=HTTP_TIMEOUT)
+        callback = urlsplit(authorized.headers['Location'])
+        response = client.get(callback.path + "?" + callback.query)
+        if response.status_code != 302:
+            raise RuntimeError(f"Login callback returned {response.status_code}")
+
+    def to_dict(self, users: int, attempts: int):
+        return {
+            'meta': {
+                'users': users,
+                'attempts_per_user': attempts,
+                'iterations': self.iterations,
+                'python': platform.python_version(),
+                'date': time.strftime("%Y-%m-%dT%H:%M:%S")
+            },
+            'results': self.results,
+            'memory': self.memory
+        }
+
+# The same class without __slots__, so instances keep their fields in a __dict__
+def unslotted(cls):
+    namespace = {k: v for (k, v) in cls.__dict__.items() if k not in cls.__slots__ and k != '__slots__'}
+    return type(cls.__name__, cls.__bases__, namespace)
+
+# Prints each operation against a saved baseline, returns the ones slower by more than threshold percent
+def compare(results: dict, baseline: dict, threshold: float):
+    regressions = []
+    print(f"\n{'operation':<24}{'p50 ms':>10}{'base':>10}{'delta':>9}{'p99 ms':>10}{'base':>10}{'delta':>9}")
+    for (name, r) in results.items():
+        b = baseline['results'].get(name)
+        if not b:
+            print(f"{name:<24}{r['p50_ms']:>10.3f}{'-':>10}{'-':>9}{r['p99_ms']:>10.3f}{'-':>10}{'-':>9}")
+            continue
+        p50_delta = (r['p50_ms'] - b['p50_ms'])/b['p50_ms']*100 if b['p50_ms'] else 0
+        p99_delta = (r['p99_ms'] - b['p99_ms'])/b['p99_ms']*100 if b['p99_ms'] else 0
+        print(f"{name:<24}{r['p50_ms']:>10.3f}{b['p50_ms']:>10.3f}{p50_delta:>+8.1f}%{r['p99_ms']:>10.3f}{b['p99_ms']:>10.3f}{p99_delta:>+8.1f}%")
+        if p50_delta > threshold:
+            regressions.append(name)
+    return regressions
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark grading, leaderboard and page rendering in memory")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--attempts', type=int, default=20, help="attempts per user")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--no-requests', action='store_true', help="skip the Flask test client benchmarks")
+    parser.add_argument('--model-attempts', type=int, default=100000, help="attempts decoded for the model memory benchmark, 0 to skip")
+    parser.add_argument('--save', help="write the results to this JSON baseline")
+    parser.add_argument('--compare', help="compare against this JSON baseline")
+    parser.add_argument('--threshold', type=float, default=10.0, help="p50 regression percent that fails --compare")
+    args = parser.parse_args(argv)
+
+    data = BenchmarkData(args.users, args.attempts)
+    benchmark = Benchmark(data, args.iterations)
+    results = benchmark.run(requests=not args.no_requests)
+    if args.model_attempts > 0:
+        benchmark.run_models(args.model_attempts)
+
+    print(f"{'operation':<24}{'ops/sec':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for (name, r) in results.items():
+        print(f"{name:<24}{r['ops_per_sec']:>12.1f}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}")
+    for (name, mb) in benchmark.memory.items():
+        print(f"{name:<24}{mb:>12.1f} MB")
+
+    if args.save:
+        with open(args.save, 'w', encoding="utf-8") as f:
+            json.dump(benchmark.to_dict(args.users, args.attempts), f, indent=4)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\nRegressed beyond {args.threshold}%: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
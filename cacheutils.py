@@ -0,0 +1,118 @@
+import time
+import hashlib
+import threading
+from cachetools import LRUCache
+from datetime import datetime, timezone
+
+class VersionedCache:
+    """Process-wide cache of a whole collection. Within the TTL it is served with no I/O,
+    after that the stored version is checked and the items are only reloaded if it changed."""
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.items = None
+        self.version = None
+        self.expires_at = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.invalidations = 0
+
+    def get_items(self, load_version, load_items):
+        with self.lock:
+            if self.items is not None and time.monotonic() < self.expires_at:
+                self.hits += 1
+                return self.items
+            self.misses += 1
+            items = self.items
+            version = self.version
+
+        latest_version = load_version()
+        # Unversioned data falls back to plain TTL expiry
+        if items is None or latest_version is None or latest_version != version:
+            items = load_items()
+            with self.lock:
+                self.reloads += 1
+
+        with self.lock:
+            self.items = items
+            self.version = latest_version
+            self.expires_at = time.monotonic() + self.ttl_seconds
+        return items
+
+    # Same as get_items for async loaders
+    async def get_items_async(self, load_version, load_items):
+        with self.lock:
+            if self.items is not None and time.monotonic() < self.expires_at:
+                self.hits += 1
+                return self.items
+            self.misses += 1
+            items = self.items
+            version = self.version
+
+        latest_version = await load_version()
+        if items is None or latest_version is None or latest_version != version:
+            items = await load_items()
+            with self.lock:
+                self.reloads += 1
+
+        with self.lock:
+            self.items = items
+            self.version = latest_version
+            self.expires_at = time.monotonic() + self.ttl_seconds
+        return items
+
+    def invalidate(self):
+        with self.lock:
+            self.items = None
+            self.version = None
+            self.expires_at = 0
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+                'invalidations': self.invalidations,
+                'version': self.version,
+                'size': len(self.items) if self.items is not None else 0
+            }
+
+class PageCache:
+    """Rendered pages by key for up to ttl_seconds, the max_pages most recently used kept.
+    The ETag is a hash of the body, so a re-render that comes out the same keeps its ETag
+    and Last-Modified."""
+    def __init__(self, ttl_seconds: float, max_pages: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_pages = max_pages
+        self.lock = threading.Lock()
+        self.pages = LRUCache(maxsize=max_pages) # LRUCache[key, CachedPage]
+
+    def get(self, key):
+        with self.lock:
+            page = self.pages.get(key)
+            if page and time.monotonic() < page.expires_at:
+                return page
+            return None
+
+    def put(self, key, body: str):
+        etag = hashlib.sha256(body.encode("utf-8")).hexdigest()[:32]
+        with self.lock:
+            previous = self.pages.get(key)
+            last_modified = previous.last_modified if previous and previous.etag == etag else datetime.now(timezone.utc).replace(microsecond=0)
+            page = CachedPage(body, etag, last_modified, time.monotonic() + self.ttl_seconds)
+            self.pages[key] = page
+            return page
+
+    def clear(self):
+        with self.lock:
+            self.pages = LRUCache(maxsize=self.max_pages)
+
+class CachedPage:
+    def __init__(self, body: str, etag: str, last_modified: datetime, expires_at: float):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
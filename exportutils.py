@@ -0,0 +1,93 @@
+import os
+import json
+
+# Documents read from the datastore per round trip, and held in memory, while exporting
+EXPORT_PAGE_SIZE = int(os.environ.get("EXPORT_PAGE_SIZE", 500))
+EXPORT_FORMATS = ['jsonl', 'parquet', 'arrow']
+# Exported collections and the timestamp field incremental exports select documents by
+EXPORT_COLLECTIONS = {'quiz_attempts': 'timestamp', 'users': 'updated_at'}
+# Incremental exports stop this far behind now by default. An attempt is timestamped when it
+# is graded but, with ATTEMPT_WRITE_BEHIND, stored up to a flush (ATTEMPT_WRITE_FLUSH_SECONDS)
+# and its retries later, and the next export starts where this one stopped, so the margin has
+# to be longer than that for no attempt to be missed.
+EXPORT_SAFETY_MARGIN_SECONDS = float(os.environ.get("EXPORT_SAFETY_MARGIN_SECONDS", 300))
+
+class JsonlWriter:
+    """One stored document per line, as it is stored."""
+    def __init__(self, path: str):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, docs):
+        self.file.writelines(json.dumps(d, ensure_ascii=False, sort_keys=True) + "\n" for d in docs)
+
+    def close(self):
+        self.file.close()
+
+class ArrowWriter:
+    """Parquet or Arrow IPC file with a fixed schema per collection, written a record batch
+    (one datastore page) at a time. Needs pyarrow, which the app itself doesn't."""
+    def __init__(self, path: str, collection: str, format: str):
+        import pyarrow as pa
+        self.pa = pa
+        self.collection = collection
+        self.schema = ExportUtils.get_schema(pa, collection)
+        if format == 'parquet':
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(path, self.schema)
+        else:
+            self.writer = pa.ipc.new_file(path, self.schema)
+
+    def write(self, docs):
+        self.writer.write_table(self.pa.Table.from_pylist([ExportUtils.get_row(self.collection, d) for d in docs], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+class ExportUtils:
+    @staticmethod
+    def get_schema(pa, collection: str):
+        if collection == 'quiz_attempts':
+            response = pa.struct([('question_id', pa.int64()), ('question', pa.string()), ('answers', pa.list_(pa.string())),
+                ('user_answer', pa.string()), ('correct', pa.bool_())])
+            return pa.schema([('id', pa.string()), ('user_id', pa.string()), ('quiz_id', pa.string()), ('quiz_title', pa.string()),
+                ('quiz_level', pa.int64()), ('date', pa.string()), ('timestamp', pa.float64()), ('question_language', pa.string()),
+                ('answer_language', pa.string()), ('score', pa.float64()), ('questions', pa.list_(response))])
+        return pa.schema([('id', pa.string()), ('name', pa.string()), ('email', pa.string()), ('display_name', pa.string()),
+            ('is_active', pa.bool_()), ('is_authenticated', pa.bool_()), ('updated_at', pa.float64())])
+
+    # Columns of the collection's schema from a stored document, responses in question order
+    @staticmethod
+    def get_row(collection: str, doc: dict):
+        if collection == 'quiz_attempts':
+            row = {f: doc.get(f) for f in ['id', 'user_id', 'quiz_id', 'quiz_title', 'quiz_level', 'date', 'timestamp', 'question_language', 'answer_language', 'score']}
+            questions = sorted(doc.get('questions', {}).values(), key=lambda q: int(q['question_id']))
+            row['questions'] = [dict(q, question_id=int(q['question_id'])) for q in questions]
+            return row
+        return {f: doc.get(f) for f in ['id', 'name', 'email', 'display_name', 'is_active', 'is_authenticated', 'updated_at']}
+
+    # Full exports are named after the collection, incremental ones after their time range too
+    @staticmethod
+    def get_filename(collection: str, format: str, since: float = None, until: float = None):
+        if since is None:
+            return f"{collection}.{format}"
+        return f"{collection}-{since:.0f}-{until:.0f}.{format}"
+
+    # Streams a repo's documents to path a page at a time and returns how many were written.
+    # Written to a temporary file first, so a failed export never leaves a partial file at path.
+    @staticmethod
+    def export(repo, path: str, format: str, since: float = None, until: float = None, page_size: int = EXPORT_PAGE_SIZE):
+        order_field = EXPORT_COLLECTIONS[repo.collection] if since is not None else None
+        partial_path = path + ".partial"
+        writer = JsonlWriter(partial_path) if format == 'jsonl' else ArrowWriter(partial_path, repo.collection, format)
+        count = 0
+        try:
+            for docs in repo.stream_pages(page_size, order_field, since, until):
+                writer.write(docs)
+                count += len(docs)
+        except BaseException:
+            writer.close()
+            os.remove(partial_path)
+            raise
+        writer.close()
+        os.replace(partial_path, path)
+        return count
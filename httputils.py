@@ -0,0 +1,34 @@
+import requests
+from requests.adapters import HTTPAdapter, Retry
+
+# (connect, read) seconds for every outbound call
+HTTP_TIMEOUT = (3.05, 10)
+
+class HttpUtils:
+    @staticmethod
+    def create_session(pool_size: int = 20):
+        """A keep-alive session shared by all outbound OAuth traffic. Nothing is cached:
+        the userinfo responses are per user behind the same URL, so the discovery document
+        is cached by its callers (get_max_age)."""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=2, backoff_factor=0.1, allowed_methods=["GET"]))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    # Seconds a response may be cached for according to its Cache-Control header, 0 if it may not
+    @staticmethod
+    def get_max_age(headers):
+        directives = [d.strip().lower() for d in headers.get('Cache-Control', '').split(',')]
+        if 'no-store' in directives or 'no-cache' in directives:
+            return 0
+        for d in directives:
+            if d.startswith('max-age='):
+                try:
+                    return max(0, int(d[len('max-age='):]))
+                except ValueError:
+                    return 0
+        return 0
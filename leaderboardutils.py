@@ -0,0 +1,117 @@
+import os
+import threading
+from datetime import datetime, date, timezone
+from sortedcontainers import SortedList
+from models import *
+from miscutils import MiscUtils
+
+# The all-time board, kept in the user_stats aggregate rather than the leaderboards collection
+ALL_TIME = "all"
+# Comma separated YYYY-MM-DD term start dates, e.g. "2026-01-12,2026-04-20,2026-09-07".
+# Without them a term is a calendar quarter.
+TERM_STARTS = sorted(date.fromisoformat(d.strip()) for d in os.environ.get("LEADERBOARD_TERM_STARTS", "").split(",") if d.strip())
+
+class SortedLeaderboard:
+    """One leaderboard in rank order (total score, the same key as
+    QuizUtils.calculate_leaderboard). Updates are O(log n), the top k are read in O(k) and a
+    user's place in O(log n) without building the rest of the board."""
+    def __init__(self, entries=()):
+        self.lock = threading.Lock()
+        self.entries = {} # dict[user id, UserStats]
+        self.ranking = SortedList() # (-total score, user id)
+        for entry in entries:
+            if entry.count_quizzes > 0:
+                self.entries[entry.user_id] = entry
+                self.ranking.add((-entry.total_score, entry.user_id))
+
+    def __len__(self):
+        return len(self.ranking)
+
+    # Adds an attempt's score for a user
+    def add(self, user_id: str, display_name: str, score: float):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                entry = UserStats(user_id, display_name, 0, 0)
+                self.entries[user_id] = entry
+            else:
+                self.ranking.remove((-entry.total_score, user_id))
+            entry.total_score += score
+            entry.count_quizzes += 1
+            if display_name is not None:
+                entry.display_name = display_name
+            self.ranking.add((-entry.total_score, user_id))
+
+    def rename(self, user_id: str, display_name: str):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None:
+                entry.display_name = display_name
+
+    def top(self, k: int):
+        with self.lock:
+            return [self.to_rank(place, self.entries[user_id]) for (place, (_, user_id)) in enumerate(self.ranking.islice(0, k), 1)]
+
+    # The user's LeaderboardRank, None if they aren't on this board
+    def rank(self, user_id: str):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            return self.to_rank(self.ranking.index((-entry.total_score, user_id)) + 1, entry)
+
+    @staticmethod
+    def to_rank(place: int, entry: UserStats):
+        average = entry.total_score/entry.count_quizzes if entry.count_quizzes > 0 else 0
+        return LeaderboardRank(place, entry.user_id, entry.display_name, entry.count_quizzes, MiscUtils.format_percent(average))
+
+class LeaderboardUtils:
+    @staticmethod
+    def get_quiz_scope(quiz_id: str):
+        return f"quiz:{quiz_id}"
+
+    @staticmethod
+    def get_level_scope(level):
+        return f"level:{level}"
+
+    # ISO week in UTC, e.g. week:2026-W42
+    @staticmethod
+    def get_week_scope(timestamp: float):
+        (year, week, _) = datetime.fromtimestamp(timestamp, timezone.utc).isocalendar()
+        return f"week:{year}-W{week:02d}"
+
+    # term:<start date> with LEADERBOARD_TERM_STARTS, otherwise term:2026-Q4
+    @staticmethod
+    def get_term_scope(timestamp: float):
+        day = datetime.fromtimestamp(timestamp, timezone.utc).date()
+        starts = [s for s in TERM_STARTS if s <= day]
+        if starts:
+            return f"term:{starts[-1].isoformat()}"
+        return f"term:{day.year}-Q{(day.month - 1)//3 + 1}"
+
+    # The scoped boards an attempt counts towards, besides the all-time one
+    @staticmethod
+    def get_scopes(attempt: QuizAttempt):
+        scopes = [
+            LeaderboardUtils.get_quiz_scope(attempt.quiz_id),
+            LeaderboardUtils.get_week_scope(attempt.timestamp),
+            LeaderboardUtils.get_term_scope(attempt.timestamp)
+        ]
+        if attempt.quiz_level is not None:
+            scopes.append(LeaderboardUtils.get_level_scope(attempt.quiz_level))
+        return scopes
+
+    # The stored scope for what a client asks for: all, week, term (both the current one),
+    # quiz:<quiz id> or level:<level>. None for anything else, so clients can't make the
+    # process load boards that don't exist.
+    @staticmethod
+    def resolve_scope(scope: str, now: float, quizzes):
+        if scope in (None, "", ALL_TIME):
+            return ALL_TIME
+        if scope == "week":
+            return LeaderboardUtils.get_week_scope(now)
+        if scope == "term":
+            return LeaderboardUtils.get_term_scope(now)
+        if scope in [LeaderboardUtils.get_quiz_scope(q.id) for q in quizzes] + [LeaderboardUtils.get_level_scope(q.level) for q in quizzes]:
+            return scope
+        return None
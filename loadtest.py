@@ -0,0 +1,309 @@
+"""Load test of the student journey against a locally started app, comparing the sync
+(Flask on a fixed thread pool) and async (Quart on hypercorn) serving modes.
+
+Each mode runs in its own server process against the in-memory datastore seeded from
+quizzes/, with DATASTORE_LATENCY_MS added to every datastore call to stand in for
+Firestore round trips. Every simulated student first logs in through the real login
+routes against the stub identity provider (stubidp.py) instead of Google, then loops
+over the journey: the home page, a quiz in a random language pair, its submission and
+the profile page.
+
+Reports throughput and per-route latency percentiles and error rates for each mode and
+concurrency. Students are seeded random generators, so with --journeys (a fixed number
+of journeys per student instead of --duration) two runs send the same requests.
+--output saves the results and --compare prints the change from a saved run.
+
+    python loadtest.py --concurrency 16 64 128 --duration 10 --latency-ms 20
+    python loadtest.py --journeys 20 --output before.json
+    python loadtest.py --journeys 20 --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from models import LANGUAGES
+
+MODES = ['sync', 'async']
+ROUTES = ['login', 'home', 'quiz', 'submit', 'profile']
+# Each student logs in once, the totals are over the journey they repeat
+JOURNEY_ROUTES = ['home', 'quiz', 'submit', 'profile']
+PERCENTILES = [50, 90, 99]
+SECRET_KEY = "loadtest"
+
+def configure(latency_ms: float):
+    os.environ["DATASTORE_BACKEND"] = "memory"
+    os.environ["DATASTORE_LATENCY_MS"] = str(latency_ms)
+    os.environ["SECRET_KEY"] = SECRET_KEY
+    os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
+    for key in ["GOOGLE_CLIENT_ID", "GOOGLE_CLIENT_SECRET"]:
+        os.environ.setdefault(key, "loadtest")
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+# Seeds the quizzes straight into the local engine, so seeding pays no latency. Students are
+# created by their first login.
+def seed():
+    from repo import QuizzesRepo
+    from backends import get_local_backend
+    QuizzesRepo(get_local_backend()).sync()
+
+class PooledWSGIServer:
+    """werkzeug's server with a fixed pool of worker threads, like a sync worker with
+    `threads` threads on App Engine."""
+    def __init__(self, host: str, port: int, app, threads: int):
+        from werkzeug.serving import BaseWSGIServer
+        from stubidp import QuietRequestHandler
+        pool = ThreadPoolExecutor(threads)
+
+        class Server(BaseWSGIServer):
+            def process_request(self, request, client_address):
+                pool.submit(self.process_request_thread, request, client_address)
+
+            def process_request_thread(self, request, client_address):
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+
+        self.server = Server(host, port, app, handler=QuietRequestHandler)
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+def serve(mode: str, port: int, threads: int):
+    seed()
+    if mode == 'sync':
+        import main
+        PooledWSGIServer("127.0.0.1", port, main.app, threads).serve_forever()
+    else:
+        from hypercorn.config import Config
+        from hypercorn.asyncio import serve as hypercorn_serve
+        import asgi
+        config = Config()
+        config.bind = [f"127.0.0.1:{port}"]
+        config.accesslog = None
+        config.backlog = 1024
+        asyncio.run(hypercorn_serve(asgi.application, config))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class LoadTest:
+    def __init__(self, base_url: str, concurrency: int, duration: float, users: int, journeys: int = None, think_ms: float = 0, seed: int = 0):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.duration = duration
+        self.users = users
+        self.journeys = journeys # per student, instead of running for duration
+        self.think_seconds = think_ms/1000
+        self.seed = seed
+        self.timings = {r: [] for r in ROUTES}
+        self.errors = {r: Counter() for r in ROUTES} # dict[route, Counter[status code or exception name]]
+        self.completed_journeys = 0
+
+    async def run(self):
+        from repo import QuizzesRepo
+        from backends import get_local_backend
+        self.quizzes = QuizzesRepo(get_local_backend()).get_all()
+        self.deadline = time.monotonic() + self.duration
+        started = time.monotonic()
+        await asyncio.gather(*[self.student(i) for i in range(self.concurrency)])
+        self.elapsed = time.monotonic() - started
+        return self
+
+    # One simulated student with their own connection and cookies: logs in, then loops over
+    # the journey until the deadline or for the set number of journeys
+    async def student(self, n: int):
+        import httpx
+        rng = random.Random(f"{self.seed}-{n}")
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=60) as client:
+            if not await self.login(client, f"student-{n % self.users}"):
+                return
+            journeys = 0
+            while (journeys < self.journeys) if self.journeys is not None else (time.monotonic() < self.deadline):
+                quiz = rng.choice(self.quizzes)
+                (question_language, answer_language) = rng.sample(LANGUAGES, 2)
+                submission = {
+                    'question_language': question_language,
+                    'answer_language': answer_language,
+                    'answers': [rng.choice(q.get_answers(answer_language)) for q in quiz.questions.values()]
+                }
+                await self.request(client, rng, 'home', 'GET', "/")
+                await self.request(client, rng, 'quiz', 'GET', f"/quiz/{quiz.id}?question_language={question_language}&answer_language={answer_language}")
+                await self.request(client, rng, 'submit', 'POST', f"/quiz/{quiz.id}/submit", json=submission)
+                await self.request(client, rng, 'profile', 'GET', "/user/profile")
+                journeys += 1
+                self.completed_journeys += 1
+
+    # The whole OAuth flow, with the stub identity provider logging in as user_id: /login,
+    # the provider's authorize redirect, then /login/callback, which sets the session cookie
+    async def login(self, client, user_id: str):
+        t = time.perf_counter()
+        try:
+            response = await client.get("/login?url=/")
+            if response.status_code == 302:
+                response = await client.get(response.headers['Location'] + "&login_hint=" + user_id)
+            if response.status_code == 302:
+                response = await client.get(response.headers['Location'])
+            if response.status_code != 302 or 'session' not in client.cookies:
+                self.errors['login'][response.status_code] += 1
+                return False
+        except Exception as e:
+            self.errors['login'][type(e).__name__] += 1
+            return False
+        self.timings['login'].append(time.perf_counter() - t)
+        return True
+
+    async def request(self, client, rng, route: str, method: str, url: str, **kwargs):
+        t = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            if response.status_code >= 400:
+                self.errors[route][response.status_code] += 1
+            else:
+                self.timings[route].append(time.perf_counter() - t)
+        except Exception as e:
+            self.errors[route][type(e).__name__] += 1
+        if self.think_seconds:
+            await asyncio.sleep(rng.uniform(0.5, 1.5)*self.think_seconds)
+
+    def summary(self):
+        all_timings = sorted(t for route in JOURNEY_ROUTES for t in self.timings[route])
+        errors = sum(sum(e.values()) for e in self.errors.values())
+        summary = {
+            'concurrency': self.concurrency,
+            'elapsed_sec': self.elapsed,
+            'requests_per_sec': len(all_timings)/self.elapsed,
+            'journeys_per_sec': self.completed_journeys/self.elapsed,
+            'errors': errors,
+            'error_rate': errors/(len(all_timings) + errors) if all_timings or errors else 0,
+            'routes': {}
+        }
+        for p in PERCENTILES:
+            summary[f'p{p}_ms'] = LoadTest.percentile(all_timings, p)*1000
+        for route in ROUTES:
+            timings = sorted(self.timings[route])
+            errors = sum(self.errors[route].values())
+            summary['routes'][route] = {
+                'requests': len(timings) + errors,
+                'errors': errors,
+                'error_rate': errors/(len(timings) + errors) if timings or errors else 0,
+                'error_kinds': {str(k): n for (k, n) in self.errors[route].most_common()},
+                **{f'p{p}_ms': LoadTest.percentile(timings, p)*1000 for p in PERCENTILES}
+            }
+        return summary
+
+    @staticmethod
+    def percentile(sorted_values, p):
+        if not sorted_values:
+            return 0
+        index = min(len(sorted_values) - 1, max(0, round(p/100*len(sorted_values)) - 1))
+        return sorted_values[index]
+
+def wait_for_server(port: int, process, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start on port {port}")
+
+def run_mode(mode: str, concurrency: int, args):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port),
+        '--threads', str(args.threads), '--latency-ms', str(args.latency_ms)])
+    try:
+        wait_for_server(port, process)
+        test = LoadTest(f"http://127.0.0.1:{port}", concurrency, args.duration, args.users, args.journeys, args.think_ms, args.seed)
+        return asyncio.run(test.run()).summary()
+    finally:
+        process.terminate()
+        process.wait()
+
+def print_summary(mode: str, s: dict):
+    print(f"\n{mode}, {s['concurrency']} students: {s['requests_per_sec']:.1f} req/sec, {s['journeys_per_sec']:.1f} journeys/sec, "
+        f"{s['error_rate']:.2%} errors")
+    print(f"{'route':<10}{'requests':>10}{'errors':>8}{'err %':>8}" + "".join(f"{f'p{p} ms':>10}" for p in PERCENTILES))
+    for (route, r) in s['routes'].items():
+        print(f"{route:<10}{r['requests']:>10}{r['errors']:>8}{r['error_rate']:>8.2%}" + "".join(f"{r[f'p{p}_ms']:>10.1f}" for p in PERCENTILES))
+        if r['error_kinds']:
+            print(f"{'':<10}" + ", ".join(f"{kind}: {n}" for (kind, n) in r['error_kinds'].items()))
+
+# Change of each mode and concurrency's throughput and latency from a saved run
+def print_comparison(results: dict, baseline: dict):
+    print(f"\n{'vs baseline':<16}{'req/sec':>16}{'p50 ms':>16}{'p99 ms':>16}{'err %':>16}")
+    for (key, s) in results.items():
+        b = baseline.get(key)
+        if b is None:
+            print(f"{key:<16}{'not in baseline':>16}")
+            continue
+        cells = []
+        for field in ['requests_per_sec', 'p50_ms', 'p99_ms']:
+            change = (s[field] - b[field])/b[field] if b[field] else 0
+            cells.append(f"{s[field]:.1f} ({change:+.0%})")
+        cells.append(f"{s['error_rate']:.2%} ({b['error_rate']:.2%})")
+        print(f"{key:<16}" + "".join(f"{c:>16}" for c in cells))
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the student journey in the sync and async serving modes")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[64], help="simultaneous simulated students, one run per value")
+    parser.add_argument('--duration', type=float, default=10, help="seconds per run")
+    parser.add_argument('--journeys', type=int, help="journeys per student instead of --duration, for repeatable runs")
+    parser.add_argument('--think-ms', type=float, default=0, help="average pause after each request")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the students' choices")
+    parser.add_argument('--threads', type=int, default=8, help="worker threads for the sync server")
+    parser.add_argument('--users', type=int, default=50, help="distinct students logged in, shared when concurrency is higher")
+    parser.add_argument('--latency-ms', type=float, default=20, help="simulated latency of each datastore call")
+    parser.add_argument('--output', help="save the results as JSON")
+    parser.add_argument('--compare', help="results JSON of an earlier run to compare with")
+    parser.add_argument('--serve', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    configure(args.latency_ms)
+    if args.serve:
+        serve(args.serve, args.port, args.threads)
+        return 0
+
+    # The server processes inherit the provider's address
+    import stubidp
+    identity_provider = stubidp.serve_in_background()
+    os.environ["OPENID_DISCOVERY_URL"] = stubidp.discovery_url(identity_provider)
+    seed()
+
+    results = {} # dict["mode/concurrency", summary]
+    for mode in args.modes:
+        for concurrency in args.concurrency:
+            results[f"{mode}/{concurrency}"] = run_mode(mode, concurrency, args)
+            print_summary(mode, results[f"{mode}/{concurrency}"])
+
+    print(f"\n{'run':<16}{'req/sec':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for (key, s) in results.items():
+        print(f"{key:<16}{s['requests_per_sec']:>10.1f}{s['p50_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['errors']:>8}")
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f)['results'])
+    if args.output:
+        meta = {k: v for (k, v) in vars(args).items() if k not in ['output', 'compare', 'serve', 'port']}
+        with open(args.output, "w") as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+    identity_provider.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -1,14 +1,31 @@
+from startuputils import startup_timer, Lazy
 import json
+import time
 from datetime import datetime, timedelta
 import os
+import random
+import functools
+import importlib.util
+import hmac
+import click
 import transaction
-from flask import Flask, redirect, request, url_for, abort, make_response, render_template
+import threading
+from flask import Flask, redirect, request, url_for, abort, make_response, render_template, g, before_render_template, template_rendered
+from flask.sessions import SecureCookieSessionInterface
 from models import *
 from repo import * 
 from quizutils import QuizUtils
 from secretutils import SecretUtils
 from miscutils import MiscUtils
+from httputils import HttpUtils, HTTP_TIMEOUT
+from cacheutils import PageCache
+from writeutils import get_write_queue
+from leaderboardutils import LeaderboardUtils, ALL_TIME
+from reviewutils import ReviewUtils, MAX_INTERVAL_DAYS, DAY_SECONDS
+from exportutils import ExportUtils, EXPORT_FORMATS, EXPORT_COLLECTIONS, EXPORT_SAFETY_MARGIN_SECONDS
+from metricsutils import metrics, logger, SamplingProfiler
 from flask_cors import CORS
+from markupsafe import Markup
 
 from flask_login import (
     LoginManager,
@@ -16,19 +33,39 @@ from flask_login import (
     login_required,
     login_user,
     logout_user,
-    confirm_login,
-    login_fresh,
-    login_remembered
+    confirm_login
 )
 
 from oauthlib.oauth2 import WebApplicationClient
-import requests
+startup_timer.mark("imports")
 
-app = Flask(__name__)
-CORS(app)
+# Secrets and clients are created on first use (or by the warmup request), not at import
 secret_util = SecretUtils()
+secret_key = Lazy("secret key", lambda: secret_util.get_secret("SECRET_KEY") or os.urandom(24))
+oauth_client = Lazy("oauth client", lambda: WebApplicationClient(secret_util.get_secret("GOOGLE_CLIENT_ID")))
+
+class LazySecretSessionInterface(SecureCookieSessionInterface):
+    # Requests without a session cookie don't need the key to open their (empty) session,
+    # unless they have flask_login's remember cookie, which is checked with the same key
+    def open_session(self, app, request):
+        if not request.cookies.get(self.get_cookie_name(app)):
+            if request.cookies.get(app.config.get("REMEMBER_COOKIE_NAME", "remember_token")):
+                self.load_secret_key(app)
+            return self.session_class()
+        return super().open_session(app, request)
+
+    def get_signing_serializer(self, app):
+        self.load_secret_key(app)
+        return super().get_signing_serializer(app)
+
+    @staticmethod
+    def load_secret_key(app):
+        if not app.secret_key:
+            app.secret_key = secret_key.get()
 
-app.secret_key = secret_util.get_secret("SECRET_KEY") or os.urandom(24)
+app = Flask(__name__)
+CORS(app)
+app.session_interface = LazySecretSessionInterface()
 app.config["IMAGE_UPLOADS"] = "static"
 app.config["REMEMBER_COOKIE_REFRESH_EACH_REQUEST"] = True
 app.config["SESSION_REFRESH_EACH_REQUEST"] = True
@@ -36,28 +73,132 @@ app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(hours=1)
 
 
 # Env setup
-GOOGLE_CLIENT_ID = secret_util.get_secret("GOOGLE_CLIENT_ID")
-GOOGLE_CLIENT_SECRET = secret_util.get_secret("GOOGLE_CLIENT_SECRET")
-GOOGLE_DISCOVERY_URL = (
+GOOGLE_DISCOVERY_URL = os.environ.get("OPENID_DISCOVERY_URL",
     "https://accounts.google.com/.well-known/openid-configuration")
 BASE_URL = os.environ.get("BASE_URL", None)
+PROFILE_PAGE_SIZE = 20
+QUIZ_VIEW_MAX_AGE_SECONDS = 300
+PAGE_CACHE_TTL_SECONDS = int(os.environ.get("PAGE_CACHE_TTL_SECONDS", 60))
+LEADERBOARD_SIZE = int(os.environ.get("LEADERBOARD_SIZE", 25))
+# Questions in one review session, and the largest review submission accepted
+REVIEW_SESSION_SIZE = int(os.environ.get("REVIEW_SESSION_SIZE", 20))
+REVIEW_MAX_BODY_BYTES = 64*1024
+# Comma separated emails of the users allowed on the /admin routes
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get("ADMIN_EMAILS", "").split(",") if e.strip()}
+# Lets a metrics scraper, which can't sign in, read /metrics and /stats with "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+# Lets admins profile a single request by adding ?_profile=1
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") in ("1", "true")
+PROFILE_INTERVAL_SECONDS = 0.001
 
 users_repo = UsersRepo()
 quizzes_repo = QuizzesRepo()
-quiz_attempts_repo = QuizAttemptsRepo()
-
-
-client = WebApplicationClient(GOOGLE_CLIENT_ID)
+quiz_attempts_repo = QuizAttemptsRepo(write_queue=get_write_queue())
+user_stats_repo = UserStatsRepo()
+quiz_analytics_repo = QuizAnalyticsRepo()
+quiz_counters_repo = QuizCountersRepo()
+leaderboards_repo = LeaderboardsRepo()
+review_items_repo = ReviewItemsRepo(write_queue=get_write_queue())
+
+http = HttpUtils.create_session()
 login_manager = LoginManager()
 login_manager.init_app(app)
-
+before_render_template.connect(metrics.render_started, app)
+template_rendered.connect(metrics.render_finished, app)
+startup_timer.mark("app and repos")
+
+# Request instrumentation, served at /metrics and logged when REQUEST_LOGS is set
+@app.before_request
+def start_request_metrics():
+    g.request_metrics = metrics.start_request()
+    if PROFILING_ENABLED and request.args.get('_profile') and is_admin(current_user):
+        g.profiler = SamplingProfiler(threading.get_ident(), PROFILE_INTERVAL_SECONDS).start()
+
+# A profiled request answers with its collapsed stacks instead of the page
+@app.after_request
+def finish_profile(response):
+    g.response_status = response.status_code
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    response = make_response(profiler.stop().collapsed())
+    response.mimetype = 'text/plain'
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error):
+    started = g.pop('request_metrics', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.finish_request(started, request.method, route, g.get('response_status', 500))
+
+def get_client_credentials():
+    return (secret_util.get_secret("GOOGLE_CLIENT_ID"), secret_util.get_secret("GOOGLE_CLIENT_SECRET"))
+
+# Cached for the rest of the request, so a page view reads the user at most once
 @login_manager.user_loader
 def load_user(user_id):
-    return users_repo.get(user_id)
+    users = g.setdefault('users', {})
+    if user_id not in users:
+        users[user_id] = users_repo.get(user_id)
+    return users[user_id]
+
+# Full-response cache for pages as anonymous visitors see them. Repeat visits
+# revalidate with ETag/Last-Modified and get a 304 without any rendering. Keyed by path
+# alone: the cached views ignore query strings, which would otherwise each add a page.
+page_cache = PageCache(PAGE_CACHE_TTL_SECONDS)
+
+def anonymous_page_cache(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_user and current_user.is_active:
+            return view(*args, **kwargs)
+
+        page = page_cache.get(request.path)
+        if page is None:
+            page = page_cache.put(request.path, view(*args, **kwargs))
+
+        response = make_response(page.body)
+        response.set_etag(page.etag)
+        response.last_modified = page.last_modified
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return response.make_conditional(request)
+    return wrapper
+
+def is_admin(user):
+    return bool(user and user.is_active and (user.email or "").lower() in ADMIN_EMAILS)
+
+def admin_required(view):
+    @functools.wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if not is_admin(current_user):
+            return abort(403)
+        return view(*args, **kwargs)
+    return wrapper
+
+# Admins, or requests carrying METRICS_TOKEN
+def stats_required(view):
+    admin_view = admin_required(view)
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if METRICS_TOKEN and hmac.compare_digest(request.headers.get('Authorization', "").encode("utf-8"), f"Bearer {METRICS_TOKEN}".encode("utf-8")):
+            return view(*args, **kwargs)
+        return admin_view(*args, **kwargs)
+    return wrapper
 
 # Temp landing page
+# The OpenID discovery document, kept until its max-age runs out
+provider_cfg = {'document': None, 'expires_at': 0}
+
 def get_google_provider_cfg():
-    return requests.get(GOOGLE_DISCOVERY_URL).json()
+    if provider_cfg['document'] is None or time.monotonic() >= provider_cfg['expires_at']:
+        with metrics.timed('oauth'):
+            response = http.get(GOOGLE_DISCOVERY_URL, timeout=HTTP_TIMEOUT)
+        provider_cfg['document'] = response.json()
+        provider_cfg['expires_at'] = time.monotonic() + HttpUtils.get_max_age(response.headers)
+    return provider_cfg['document']
 
 @login_manager.unauthorized_handler
 def unauthorized():
@@ -74,7 +215,7 @@ def login():
     google_provider_cfg = get_google_provider_cfg()
     authorization_endpoint = google_provider_cfg["authorization_endpoint"]
 
-    request_uri = client.prepare_request_uri(
+    request_uri = oauth_client.get().prepare_request_uri(
         authorization_endpoint,
         redirect_uri=request.base_url + "/callback",
         scope=["openid", "email", "profile"],
@@ -86,8 +227,7 @@ def login():
 @app.route("/logout")
 @login_required
 def logout():
-    user = load_user(current_user.id)
-    users_repo.set_inactive(user.id)
+    users_repo.set_inactive(current_user.id)
     logout_user()
     return redirect("/")
 
@@ -101,26 +241,29 @@ def callback():
     token_endpoint = google_provider_cfg["token_endpoint"]
 
     # Get token via code
-    token_url, headers, body = client.prepare_token_request(
+    token_url, headers, body = oauth_client.get().prepare_token_request(
         token_endpoint,
         authorization_response=request.url,
         redirect_url=request.base_url,
         code=code
     )
 
-    token_response = requests.post(
-        token_url,
-        headers=headers,
-        data=body,
-        auth=(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET)
-    )
+    with metrics.timed('oauth'):
+        token_response = http.post(
+            token_url,
+            headers=headers,
+            data=body,
+            auth=get_client_credentials(),
+            timeout=HTTP_TIMEOUT
+        )
 
-    client.parse_request_body_response(json.dumps(token_response.json()))
+    oauth_client.get().parse_request_body_response(json.dumps(token_response.json()))
 
     # Hit user info endpoint
     userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
-    uri, headers, body = client.add_token(userinfo_endpoint)
-    userinfo_response = requests.get(uri, headers=headers, data=body)
+    uri, headers, body = oauth_client.get().add_token(userinfo_endpoint)
+    with metrics.timed('oauth'):
+        userinfo_response = http.get(uri, headers=headers, data=body, timeout=HTTP_TIMEOUT)
 
     if userinfo_response.json().get("email_verified"):
         unique_id = userinfo_response.json()["sub"]
@@ -129,15 +272,11 @@ def callback():
     else:
         return "User email not available or not verified by Google.", 400
 
-    user = users_repo.get(unique_id)
-    if not user:
-        user = User(id=unique_id, name=users_name, display_name=users_name, email=users_email, is_active=True, is_authenticated=True)
-        users_repo.save(user)
-    else:
-        users_repo.set_active(user.id)
-    user = users_repo.get(unique_id)
+    user = users_repo.login(unique_id, users_name, users_email)
 
-    # Begin user session by logging the user in
+    # Begin user session by logging the user in. flask_login signs the remember cookie with
+    # the secret key after the request, before the session would load it.
+    app.session_interface.load_secret_key(app)
     login_user(user, remember=True)
     url = request.cookies.get('redirect_url') 
     resp = make_response(make_response(redirect(url)))
@@ -147,46 +286,84 @@ def callback():
 
 # Other routes
 @app.route("/")
+@anonymous_page_cache
 def home():
-    def get_formatted_user(u):
-        user_quizzes = quiz_attempts_repo.get_all_for_user(u.id)
-        return u.to_display_dict(user_quizzes)
-
-    all_users = users_repo.get_all()
-    formatted_users = [get_formatted_user(u) for u in all_users]
-    # Only calculate leaderboard for users who have taken a quiz before
-    quiz_users = list(filter(lambda u: u['count_quizzes'] > 0, formatted_users))
-    leaderboard = QuizUtils.calculate_leaderboard(quiz_users)
+    # Only users who have taken a quiz before are on the board
+    board = leaderboards_repo.get_board(ALL_TIME)
+    ranks = board.top(LEADERBOARD_SIZE)
 
     quizzes = quizzes_repo.get_all()
+    counters = quiz_counters_repo.get_all()
     user_logged_in = (current_user and current_user.is_active)
+    user_rank = None
     if user_logged_in:
         confirm_login()
+        # Shown under the board when the user isn't already on it
+        user_rank = board.rank(current_user.id)
+        if user_rank and user_rank.place <= LEADERBOARD_SIZE:
+            user_rank = None
 
-    return render_template('home.html', base_url=BASE_URL, user_logged_in=user_logged_in, ranks=list(leaderboard.values()), quizzes=quizzes, nav=get_nav(), head=get_head(), foot=get_foot())
+    return render_template('home.html', base_url=BASE_URL, user_logged_in=user_logged_in, ranks=ranks, user_rank=user_rank,
+        quizzes=quizzes, levels=sorted({q.level for q in quizzes}), counters=counters)
 
 @app.route("/user/profile")
 @login_required
 def user_profile():
-    user = load_user(current_user.id)
+    user = current_user
     confirm_login()
-    attempts = quiz_attempts_repo.get_all_for_user(user.id)
-    return render_template('profile.html', user=user.to_display_dict(attempts), attempts=[a.to_display_dict() for a in attempts], base_url=BASE_URL, nav=get_nav(), head=get_head(), foot=get_foot())
+    (attempts, next_cursor) = quiz_attempts_repo.get_page_for_user(user.id, PROFILE_PAGE_SIZE)
+    stats = user_stats_repo.get(user.id)
+    return render_template('profile.html', user=user.to_stats_display_dict(stats), attempts=[a.to_display_dict() for a in attempts], next_cursor=next_cursor, base_url=BASE_URL)
+
+# Next page of the attempt history, pass the previous page's next_cursor as timestamp,id
+@app.route("/user/attempts")
+@login_required
+def user_attempts():
+    confirm_login()
+    try:
+        cursor = request.args.get('cursor')
+        if cursor:
+            (timestamp, id) = cursor.split(',', 1)
+            cursor = (float(timestamp), id)
+    except ValueError:
+        return abort(400)
+
+    (attempts, next_cursor) = quiz_attempts_repo.get_page_for_user(current_user.id, PROFILE_PAGE_SIZE, cursor)
+    response = {
+        'attempts': [a.to_display_dict() for a in attempts],
+        'next_cursor': next_cursor
+    }
+    return json.dumps(response, ensure_ascii=False)
+
+# Full per-question responses for one attempt
+@app.route("/user/attempts/<attempt_id>")
+@login_required
+def user_attempt(attempt_id):
+    confirm_login()
+    attempt = quiz_attempts_repo.get(attempt_id)
+    if not attempt or attempt.user_id != current_user.id:
+        return abort(404)
+    response = {
+        'results': attempt.get_results(),
+        'score': MiscUtils.format_percent(attempt.score)
+    }
+    return json.dumps(response, ensure_ascii=False)
 
 @app.route("/quiz/<quiz_id>")
 @login_required
 def quiz(quiz_id):
     confirm_login()
-    try:
-        question_language = request.args.get('question_language')
-        answer_language = request.args.get('answer_language')
+    question_language = request.args.get('question_language')
+    answer_language = request.args.get('answer_language')
+    # If someone tries to go directly to the URL
+    if question_language == answer_language:
+        return redirect("/")
+    if question_language not in LANGUAGES or answer_language not in LANGUAGES:
+        return abort(400)
 
+    try:
         if not current_user or not current_user.is_active:
             return redirect(url_for('login', url = f"/quiz/{quiz_id}?question_language={question_language}&answer_language={answer_language}"))
-        
-        # If someone tries to go directly to the URL
-        if question_language == answer_language:
-            return redirect("/")
 
         quiz = quizzes_repo.get(quiz_id)
         if not quiz:
@@ -197,31 +374,60 @@ def quiz(quiz_id):
         return render_template('quiz.html', \
             quiz_id=quiz.id,
             quiz=quiz_view,
-            quiz_question_ids = list(quiz.questions.keys()),
+            quiz_question_ids = quiz.question_ids,
             question_language=question_language,
             answer_language=answer_language,
-            base_url=BASE_URL,
-            nav=get_nav(),
-            head=get_head(),
-            foot=get_foot())
+            max_answer_chars=quiz.get_submission_schema().max_answer_chars,
+            base_url=BASE_URL)
     except Exception as e:
-        print(e)
+        logger.exception(f"Quiz {quiz_id} failed to load")
         return abort(500, str(e))
 
+# The prebuilt question view as JSON, with a strong ETag so a CDN or browser can cache it
+@app.route("/quiz/<quiz_id>/view")
+def quiz_view(quiz_id):
+    question_language = request.args.get('question_language')
+    if question_language not in LANGUAGES:
+        return abort(400)
+
+    quiz = quizzes_repo.get(quiz_id)
+    if not quiz:
+        return abort(404)
+
+    view = quiz.get_prebuilt_view(question_language)
+    response = make_response(view.json)
+    response.mimetype = 'application/json'
+    response.set_etag(view.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = QUIZ_VIEW_MAX_AGE_SECONDS
+    return response.make_conditional(request)
+
 @app.route('/quiz/<quiz_id>/submit', methods=['POST'])
 @login_required
 def quiz_submit(quiz_id):
     confirm_login()
+    quiz = quizzes_repo.get(quiz_id)
+    if not quiz:
+        return abort(404)
+
+    # The body is read up to the quiz's limit and checked against its schema before any grading
+    schema = quiz.get_submission_schema()
+    if (request.content_length or 0) > schema.max_body_bytes:
+        return abort(413)
+    body = request.stream.read(schema.max_body_bytes + 1)
+    if len(body) > schema.max_body_bytes:
+        return abort(413)
     try:
-        user = load_user(current_user.id)
-        data = request.get_json()
-        quiz = quizzes_repo.get(quiz_id)
-        if not quiz:
-            return abort(404)
+        (question_language, answer_language, answers) = schema.parse(json.loads(body))
+    except (ValueError, RecursionError) as e:
+        return abort(400, str(e))
 
+    try:
+        user = current_user
         # Score quiz
-        attempt = QuizUtils.score(user, quiz, data)
-        quiz_attempts_repo.save(attempt)
+        with metrics.timed('grading'):
+            attempt = QuizUtils.score_answers(user, quiz, question_language, answer_language, answers)
+        quiz_attempts_repo.save(attempt, user.display_name)
 
         # Commit the changes and return
         response = {
@@ -232,105 +438,292 @@ def quiz_submit(quiz_id):
         return json.dumps(response, ensure_ascii=False)
     except Exception as e:
         transaction.abort()
+        logger.exception(f"Quiz {quiz_id} submission failed")
         return abort(500, str(e))
 
+# A mixed quiz of the user's questions due for review across every quiz, for one language pair
+@app.route("/review")
+@login_required
+def review():
+    confirm_login()
+    question_language = request.args.get('question_language')
+    answer_language = request.args.get('answer_language')
+    if question_language not in LANGUAGES or answer_language not in LANGUAGES or question_language == answer_language:
+        return abort(400)
+
+    now = time.time()
+    (items, next_due) = review_items_repo.get_due(current_user.id, question_language, answer_language, now, REVIEW_SESSION_SIZE)
+    catalog = quizzes_repo.get_catalog()
+    questions = []
+    for item in items:
+        quiz = catalog.get(item.quiz_id)
+        question = quiz.questions.get(item.question_id) if quiz else None
+        if question:
+            questions.append({
+                'key': f"{item.quiz_id}:{item.question_id}",
+                'quiz_title': quiz.title,
+                'question': question.get_question(question_language),
+                'max_answer_chars': quiz.get_submission_schema().max_answer_chars
+            })
+    random.shuffle(questions)
+    # Items scheduled before intervals were capped can be due past what datetime can format
+    if next_due:
+        next_due = min(next_due, now + MAX_INTERVAL_DAYS*DAY_SECONDS)
+
+    return render_template('review.html',
+        questions=questions,
+        review_items=[q['key'] for q in questions],
+        question_language=question_language,
+        answer_language=answer_language,
+        next_due=datetime.fromtimestamp(next_due).strftime(DATE_FORMAT) if next_due and not questions else None,
+        base_url=BASE_URL)
+
+# Grades a review session: {"question_language", "answer_language", "items": [...], "answers": [...]}
+# with the answers in the order of the items the review page listed
+@app.route("/review/submit", methods=['POST'])
+@login_required
+def review_submit():
+    confirm_login()
+    if (request.content_length or 0) > REVIEW_MAX_BODY_BYTES:
+        return abort(413)
+    body = request.stream.read(REVIEW_MAX_BODY_BYTES + 1)
+    if len(body) > REVIEW_MAX_BODY_BYTES:
+        return abort(413)
+    try:
+        data = json.loads(body)
+        question_language = data['question_language']
+        answer_language = data['answer_language']
+        keys = data['items']
+        answers = data['answers']
+        if question_language not in LANGUAGES or answer_language not in LANGUAGES or question_language == answer_language:
+            raise SubmissionError("Unknown or identical question and answer languages")
+        if not isinstance(keys, list) or not isinstance(answers, list) or len(keys) != len(answers) or not keys \
+                or len(keys) > REVIEW_SESSION_SIZE or len(set(map(str, keys))) != len(keys):
+            raise SubmissionError(f"items and answers must list the same 1 to {REVIEW_SESSION_SIZE} questions")
+        # Only ever the user's own deck
+        deck = ReviewUtils.get_deck(current_user.id, question_language, answer_language)
+        item_ids = [f"{deck}:{key}" for key in map(str, keys)]
+        (items, responses) = ReviewUtils.grade_answers(item_ids, answers, review_items_repo.get_items(item_ids), quizzes_repo.get_catalog(), time.time())
+    except (ValueError, RecursionError, KeyError, TypeError) as e:
+        return abort(400, str(e))
+
+    review_items_repo.save_all(items)
+    response = {
+        'results': [r.get_result() for r in responses],
+        'score': MiscUtils.format_percent(sum(r.correct for r in responses)/len(responses))
+    }
+    return json.dumps(response, ensure_ascii=False)
+
 @app.route('/user/display_name', methods=['POST'])
 @login_required
 def user_display_name():
     confirm_login()
     try:
-        user = load_user(current_user.id)
         data = request.get_json()
 
-        users_repo.set_display_name(user.id, data['display_name'])
+        users_repo.set_display_name(current_user.id, data['display_name'])
 
         return json.dumps({'success':True}), 200, {'ContentType':'application/json'} 
     except Exception as e:
         return abort(500, str(e))
 
+@app.route("/stats/cache")
+@stats_required
+def cache_stats():
+    return json.dumps({'quizzes': quizzes_repo.cache_stats()}), 200, {'ContentType':'application/json'}
+
+@app.route("/stats/writes")
+@stats_required
+def write_stats():
+    write_queue = get_write_queue()
+    return json.dumps({'quiz_attempts': write_queue.stats() if write_queue else None}), 200, {'ContentType':'application/json'}
+
+# Top of a leaderboard plus the current user's place. scope is all (the default), week,
+# term, quiz:<quiz id> or level:<level>.
+@app.route("/leaderboard")
+def leaderboard():
+    scope = LeaderboardUtils.resolve_scope(request.args.get('scope'), time.time(), quizzes_repo.get_all())
+    if scope is None:
+        return abort(400)
+    limit = max(0, min(request.args.get('limit', LEADERBOARD_SIZE, type=int), 100))
+
+    board = leaderboards_repo.get_board(scope)
+    user_rank = board.rank(current_user.id) if current_user and current_user.is_active else None
+    response = {
+        'scope': scope,
+        'count': len(board),
+        'ranks': [r.to_dict() for r in board.top(limit)],
+        'user_rank': user_rank.to_dict() if user_rank else None
+    }
+    return json.dumps(response, ensure_ascii=False), 200, {'ContentType':'application/json'}
+
+# Just the current user's place on a leaderboard
+@app.route("/leaderboard/rank")
+@login_required
+def leaderboard_rank():
+    scope = LeaderboardUtils.resolve_scope(request.args.get('scope'), time.time(), quizzes_repo.get_all())
+    if scope is None:
+        return abort(400)
+    user_rank = leaderboards_repo.get_board(scope).rank(current_user.id)
+    return json.dumps({'scope': scope, 'user_rank': user_rank.to_dict() if user_rank else None}, ensure_ascii=False), 200, {'ContentType':'application/json'}
+
+# Question difficulty, common wrong answers and score histograms for a quiz, for every
+# language pair or only the one given by question_language and answer_language
+@app.route("/admin/analytics/<quiz_id>")
+@admin_required
+def quiz_analytics(quiz_id):
+    quiz = quizzes_repo.get(quiz_id)
+    if not quiz:
+        return abort(404)
+
+    question_language = request.args.get('question_language')
+    answer_language = request.args.get('answer_language')
+    if question_language and answer_language:
+        analytics = [a for a in [quiz_analytics_repo.get(quiz_id, question_language, answer_language)] if a]
+    else:
+        analytics = quiz_analytics_repo.get_all_for_quiz(quiz_id)
+    analytics.sort(key=lambda a: (a.question_language, a.answer_language))
+
+    response = {
+        'quiz_id': quiz.id,
+        'title': quiz.title,
+        'analytics': [a.to_display_dict(quiz) for a in analytics]
+    }
+    return json.dumps(response, ensure_ascii=False), 200, {'ContentType':'application/json'}
+
+# App Engine sends this to a new instance before giving it traffic (inbound_services: warmup
+# in app.yaml), so the secrets, clients and caches are ready before the first real request
+@app.route("/_ah/warmup")
+def warmup():
+    with startup_timer.phase("warmup"):
+        secret_util.prefetch(["SECRET_KEY", "GOOGLE_CLIENT_ID", "GOOGLE_CLIENT_SECRET"])
+        app.session_interface.load_secret_key(app)
+        oauth_client.get()
+        with startup_timer.phase("warm quiz catalog"):
+            quizzes_repo.get_all()
+        with startup_timer.phase("warm leaderboard"):
+            leaderboards_repo.get_board(ALL_TIME)
+        try:
+            with startup_timer.phase("warm openid discovery"):
+                get_google_provider_cfg()
+        except Exception:
+            logger.exception("OpenID discovery warmup failed")
+    return "", 200
+
+# Prometheus text format: request latency per route, Firestore calls, grading, render and OAuth time
+@app.route("/metrics")
+@stats_required
+def metrics_page():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+@app.route("/stats/startup")
+@stats_required
+def startup_stats():
+    return json.dumps(startup_timer.report()), 200, {'ContentType':'application/json'}
+
 @app.route("/about")
+@anonymous_page_cache
 def about():
     confirm_login()
-    return render_template('about.html', nav=get_nav(), head=get_head(), foot=get_foot())
+    return render_template('about.html')
 
 @app.route("/links")
+@anonymous_page_cache
 def links():
     confirm_login()
-    return render_template('links.html', nav=get_nav(), head=get_head(), foot=get_foot())
+    return render_template('links.html')
 
 
-# Janky templating ¯\_(ツ)_/¯
-def get_nav():
-    user_logged_in = (current_user and current_user.is_active)
+# Page fragments, rendered once at startup: the head, the foot and a nav per login state
+def render_fragments():
+    with app.test_request_context():
+        nav = app.jinja_env.get_template('partials/nav.html')
+        return {
+            'head': Markup(app.jinja_env.get_template('partials/head.html').render()),
+            'nav': {logged_in: Markup(nav.render(base_url=BASE_URL, user_logged_in=logged_in)) for logged_in in [True, False]},
+            'foot': Markup(app.jinja_env.get_template('partials/foot.html').render())
+        }
 
-    profile_styling = f"""<a class="nav-link" href="{BASE_URL}/user/profile">""" if user_logged_in else """<a class="nav-link disabled" href="#" tabindex="-1" aria-disabled="true">"""
-    login_logout_link = f"""{BASE_URL}/logout""" if user_logged_in else f"""{BASE_URL}/login""" 
-    login_logout_text = "Log Out" if user_logged_in else "Log In"
-    login_logout_toast = "Logging Out..." if user_logged_in else "Logging In..."
-
-    return f"""
-        <nav class="navbar navbar-expand-lg navbar-light bg-light">
-            <div class="container-fluid">
-                <a class="navbar-brand" href="{BASE_URL}/">JCE Quiz Portal</a>
-                <button class="navbar-toggler" type="button" data-bs-toggle="collapse" data-bs-target="#navbarNav" aria-controls="navbarNav" aria-expanded="false" aria-label="Toggle navigation">
-                    <span class="navbar-toggler-icon"></span>
-                </button>
-                <div class="collapse navbar-collapse" id="navbarNav">
-                    <ul class="navbar-nav me-auto">
-                        <li class="nav-item">
-                            <a class="nav-link" href="{BASE_URL}/">Home</a>
-                        </li>
-                        <li class="nav-item">
-                            <a class="nav-link" href="{BASE_URL}/about">About</a>
-                        </li>
-                        <li class="nav-item">
-                            <a class="nav-link" href="{BASE_URL}/links">Links</a>
-                        </li>
-                    </ul>
-                    <ul class="navbar-nav ms-auto">
-                        <li class="nav-item">
-                            {profile_styling}Profile</a>
-                        </li>
-                        <li class="nav-item">
-                            <a class="btn btn-outline-secondary" href="{login_logout_link}" role="button" onclick="$('#loginToast').toast('show');">{login_logout_text}</a>
-                        </li>
-                    </ul>
-                </div>
-            </div>
-        </nav>
-        <div class="position-fixed bottom-0 end-0 p-3" style="z-index: 11">
-            <div class="toast align-items-center bg-secondary fade hide" role="alert" aria-live="assertive" aria-atomic="true" id="loginToast">
-                <div class="d-flex">
-                    <div class="toast-body">
-                        {login_logout_toast}
-                    </div>
-                    <button type="button" class="btn-close me-2 m-auto" data-bs-dismiss="toast" aria-label="Close"></button>
-                </div>
-            </div>
-        </div>
-        """
-
-def get_head():
-    return f"""
-    <head>
-        <meta charset="UTF-8">
-        <meta http-equiv="X-UA-Compatible" content="IE=edge">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.0.2/dist/css/bootstrap.min.css" rel="stylesheet">
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-        <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.2.3/dist/js/bootstrap.bundle.min.js"></script>
-        <script src="https://code.jquery.com/jquery-3.7.1.min.js" integrity="sha256-/JqT3SQfawRcv/BIHPThkBvs0OEvtFFmqPF/lYI/Cxo=" crossorigin="anonymous"></script>
-        <link rel="stylesheet" type="text/css" href="{url_for('static',filename='index.css')}">
-        <title>JCE Class Study Resource Portal</title>
-    </head>
-    """
-
-def get_foot():
-    return """
-    <footer>
-        <p class="text-center">Copyright &copy; 2024</p>
-    </footer>
-    """
+fragments = render_fragments()
+startup_timer.mark("fragments")
+
+@app.context_processor
+def inject_fragments():
+    user_logged_in = bool(current_user and current_user.is_active)
+    return {
+        'head': fragments['head'],
+        'nav': fragments['nav'][user_logged_in],
+        'foot': fragments['foot']
+    }
+
+# Validates the quiz files and pushes the new and changed ones: flask --app main sync-quizzes
+@app.cli.command("sync-quizzes")
+@click.option('--path', default='quizzes', help="Directory of quiz JSON files.")
+@click.option('--dry-run', is_flag=True, help="Report what would change without writing.")
+def sync_quizzes(path, dry_run):
+    started = time.perf_counter()
+    result = quizzes_repo.sync(path, dry_run)
+    for error in result['errors']:
+        print(f"Invalid: {error}")
+    if result['errors']:
+        raise SystemExit(1)
+    for quiz_id in result['not_in_source']:
+        print(f"Stored but not in {path}: {quiz_id}")
+    print(f"{'Would push' if dry_run else 'Pushed'} {len(result['created'])} new and {len(result['updated'])} changed quizzes, "
+        f"{result['unchanged']} unchanged, in {time.perf_counter() - started:.2f}s")
+
+# Streams quiz attempts and users to files: flask --app main export --format parquet --since <timestamp>
+@app.cli.command("export")
+@click.option('--out', default='exports', help="Directory to write the files to.")
+@click.option('--format', 'format', type=click.Choice(EXPORT_FORMATS), default='jsonl', help="parquet and arrow need pyarrow.")
+@click.option('--since', type=float, default=None, help="Only documents written after this Unix timestamp.")
+@click.option('--until', type=float, default=None, help="With --since, only documents written up to this Unix timestamp (default now less EXPORT_SAFETY_MARGIN_SECONDS).")
+@click.option('--collection', 'collections', type=click.Choice(list(EXPORT_COLLECTIONS)), multiple=True, help="Export only these (default all).")
+def export(out, format, since, until, collections):
+    if until is None:
+        until = time.time() - EXPORT_SAFETY_MARGIN_SECONDS
+    if since is not None and since >= until:
+        raise click.ClickException(f"--since has to be before --until ({until})")
+    if format != 'jsonl' and importlib.util.find_spec("pyarrow") is None:
+        raise click.ClickException(f"{format} exports need pyarrow (pip install pyarrow)")
+    repos = {'quiz_attempts': quiz_attempts_repo, 'users': users_repo}
+    os.makedirs(out, exist_ok=True)
+    for collection in collections or EXPORT_COLLECTIONS:
+        started = time.perf_counter()
+        path = os.path.join(out, ExportUtils.get_filename(collection, format, since, until))
+        count = ExportUtils.export(repos[collection], path, format, since, until)
+        print(f"Exported {count} {collection} to {path} in {time.perf_counter() - started:.2f}s")
+    print(f"Next incremental export: --since {until}")
+
+# Backfills the per-user totals the all-time board and profiles read: flask --app main rebuild-user-stats
+@app.cli.command("rebuild-user-stats")
+def rebuild_user_stats():
+    count = user_stats_repo.rebuild(users_repo, quiz_attempts_repo)
+    print(f"Rebuilt user stats for {count} users")
+
+# Adds the id and timestamp fields the profile history pages on: flask --app main backfill-attempts
+@app.cli.command("backfill-attempts")
+def backfill_attempts():
+    count = quiz_attempts_repo.backfill()
+    print(f"Backfilled {count} quiz attempts")
+
+# Backfills the quiz, level, week and term leaderboards: flask --app main rebuild-leaderboards
+@app.cli.command("rebuild-leaderboards")
+def rebuild_leaderboards():
+    count = leaderboards_repo.rebuild(users_repo, quizzes_repo)
+    print(f"Rebuilt {count} leaderboard entries")
+
+# Builds everyone's review items from their stored attempts: flask --app main rebuild-review
+@app.cli.command("rebuild-review")
+def rebuild_review():
+    count = review_items_repo.rebuild()
+    print(f"Rebuilt {count} review items")
+
+# Recomputes every quiz's analytics from the stored attempts: flask --app main rebuild-analytics
+@app.cli.command("rebuild-analytics")
+def rebuild_analytics():
+    count = quiz_analytics_repo.rebuild(quiz_attempts_repo, [q.id for q in quizzes_repo.get_all()])
+    print(f"Rebuilt analytics for {count} quiz language pairs")
 
 if __name__ == "__main__":
     app.run(host="127.0.0.1", ssl_context=('adhoc'), port=8080, debug=True)
\ No newline at end of file
@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+
+# Seconds, the upper bounds of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Firestore calls made by one request
+CALL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# The timed parts of a request besides Firestore calls
+PHASES = ['grading', 'render', 'oauth']
+# One JSON log line per request when set, App Engine turns them into structured log entries
+REQUEST_LOGS = os.environ.get("REQUEST_LOGS", "0") in ("1", "true")
+
+class MetricFamily:
+    """A Prometheus counter or histogram, one series per combination of label values."""
+    def __init__(self, name: str, help: str, type: str, labels, buckets=()):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {} # dict[label values, [count per bucket..., count, sum]]
+
+    def observe(self, value: float, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0]*(len(self.buckets) + 2)
+            if self.buckets:
+                index = bisect.bisect_left(self.buckets, value)
+                if index < len(self.buckets):
+                    series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def inc(self, *label_values, amount: float = 1):
+        self.observe(amount, *label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            series = sorted(self.series.items())
+            series = [(k, list(v)) for (k, v) in series]
+        for (label_values, values) in series:
+            labels = [f'{l}="{MetricFamily.escape(v)}"' for (l, v) in zip(self.labels, label_values)]
+            if self.type == 'counter':
+                lines.append(f"{self.name}{MetricFamily.format_labels(labels)} {MetricFamily.format_value(values[-1])}")
+                continue
+            cumulative = 0
+            for (bound, count) in zip(self.buckets, values):
+                cumulative += count
+                bucket_labels = MetricFamily.format_labels(labels + [f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = MetricFamily.format_labels(labels + ['le="+Inf"'])
+            lines.append(f"{self.name}_bucket{bucket_labels} {values[-2]}")
+            lines.append(f"{self.name}_sum{MetricFamily.format_labels(labels)} {MetricFamily.format_value(values[-1])}")
+            lines.append(f"{self.name}_count{MetricFamily.format_labels(labels)} {values[-2]}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    @staticmethod
+    def format_labels(labels):
+        return "{" + ",".join(labels) + "}" if labels else ""
+
+    @staticmethod
+    def format_value(value):
+        return repr(float(value)) if isinstance(value, float) else str(value)
+
+class RequestMetrics:
+    """What one request spent its time on, kept in a context variable so the backend and
+    the timed phases can add to it without it being passed around."""
+    __slots__ = ('started', 'firestore_calls', 'firestore_seconds', 'phase_seconds', 'render_started')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.firestore_calls = 0
+        self.firestore_seconds = 0.0
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self.render_started = None
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+class Metrics:
+    """Process-wide request, Firestore and phase metrics, served at /metrics in the
+    Prometheus text format. Each instance keeps its own, so sum over instances when
+    querying."""
+    def __init__(self):
+        self.requests = MetricFamily("jce_requests_total", "Requests served.", 'counter', ['method', 'route', 'status'])
+        self.request_seconds = MetricFamily("jce_request_duration_seconds", "Request latency.", 'histogram', ['method', 'route'], LATENCY_BUCKETS)
+        self.request_firestore_calls = MetricFamily("jce_request_firestore_calls", "Firestore calls made by one request.", 'histogram', ['route'], CALL_COUNT_BUCKETS)
+        self.request_firestore_seconds = MetricFamily("jce_request_firestore_seconds_total", "Time requests spent in Firestore calls.", 'counter', ['route'])
+        self.firestore_seconds = MetricFamily("jce_firestore_call_duration_seconds", "Firestore call latency, through the repos.", 'histogram', ['operation'], LATENCY_BUCKETS)
+        self.firestore_errors = MetricFamily("jce_firestore_call_errors_total", "Firestore calls that raised.", 'counter', ['operation'])
+        self.phase_seconds = MetricFamily("jce_phase_duration_seconds", "Time spent grading, rendering templates and calling the OAuth provider.", 'histogram', ['phase'], LATENCY_BUCKETS)
+        self.families = [self.requests, self.request_seconds, self.request_firestore_calls, self.request_firestore_seconds,
+            self.firestore_seconds, self.firestore_errors, self.phase_seconds]
+
+    # Starts timing a request in the current context, pass the result to finish_request
+    def start_request(self):
+        request_metrics = RequestMetrics()
+        return (request_metrics, current_request.set(request_metrics))
+
+    def finish_request(self, started, method: str, route: str, status: int):
+        (request_metrics, token) = started
+        current_request.reset(token)
+        seconds = time.perf_counter() - request_metrics.started
+        self.requests.inc(method, route, str(status))
+        self.request_seconds.observe(seconds, method, route)
+        self.request_firestore_calls.observe(request_metrics.firestore_calls, route)
+        self.request_firestore_seconds.inc(route, amount=request_metrics.firestore_seconds)
+        if REQUEST_LOGS:
+            fields = {
+                'method': method,
+                'route': route,
+                'status': status,
+                'latency_ms': round(seconds*1000, 3),
+                'firestore_calls': request_metrics.firestore_calls,
+                'firestore_ms': round(request_metrics.firestore_seconds*1000, 3)
+            }
+            for (phase, phase_seconds) in request_metrics.phase_seconds.items():
+                if phase_seconds:
+                    fields[f"{phase}_ms"] = round(phase_seconds*1000, 3)
+            logger.info(f"{method} {route} {status}", extra={'fields': fields})
+
+    def add_firestore_call(self, operation: str, seconds: float, failed: bool = False):
+        self.firestore_seconds.observe(seconds, operation)
+        if failed:
+            self.firestore_errors.inc(operation)
+        request_metrics = current_request.get()
+        if request_metrics is not None:
+            request_metrics.firestore_calls += 1
+            request_metrics.firestore_seconds += seconds
+
+    def add_phase(self, phase: str, seconds: float):
+        self.phase_seconds.observe(seconds, phase)
+        request_metrics = current_request.get()
+        if request_metrics is not None:
+            request_metrics.phase_seconds[phase] += seconds
+
+    @contextmanager
+    def timed(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(phase, time.perf_counter() - started)
+
+    # Receivers for the before_render_template and template_rendered signals
+    def render_started(self, sender, **kwargs):
+        request_metrics = current_request.get()
+        if request_metrics is not None:
+            request_metrics.render_started = time.perf_counter()
+
+    def render_finished(self, sender, **kwargs):
+        request_metrics = current_request.get()
+        if request_metrics is not None and request_metrics.render_started is not None:
+            self.add_phase('render', time.perf_counter() - request_metrics.render_started)
+            request_metrics.render_started = None
+
+    def render(self):
+        return "\n".join(f.render() for f in self.families) + "\n"
+
+metrics = Metrics()
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line with the severity and message fields Cloud Logging reads,
+    plus whatever was passed as extra={'fields': ...}."""
+    def format(self, record):
+        entry = {'severity': record.levelname, 'message': record.getMessage(), 'logger': record.name}
+        if record.exc_info:
+            entry['message'] += "\n" + self.formatException(record.exc_info)
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+logger = logging.getLogger("jce")
+if not logger.handlers:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonLogFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+class SamplingProfiler:
+    """Samples one thread's call stack from a background thread about every interval
+    seconds, for profiling a single request without slowing down the others. The result
+    is in the collapsed stack format flamegraph.pl and speedscope read."""
+    def __init__(self, thread_id: int, interval: float = 0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter() # Counter[stack]
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for (stack, count) in self.samples.most_common())
@@ -1,6 +1,17 @@
-import os
+# Characters ignored when grading, removed in a single translate pass
+ANSWER_IGNORED_CHARS = str.maketrans('', '', "',.!? \"_。")
+ANSWER_IGNORED_WORDS = ["(beginning)", "(end)"]
 
 class MiscUtils:
     @staticmethod
     def format_percent(n):
         return "{:.2f}%".format(float(n)*100)
+
+    # Grading normalization, tests/test_grading_parity.py checks it against the original rules
+    @staticmethod
+    def normalize_answer(string):
+        string = string.lower().translate(ANSWER_IGNORED_CHARS)
+        if '(' in string:
+            for w in ANSWER_IGNORED_WORDS:
+                string = string.replace(w, "")
+        return string.strip()
@@ -1,12 +1,30 @@
 import os
+import json
+import time
 import random
+import hashlib
+from types import MappingProxyType
 from datetime import datetime 
 from miscutils import MiscUtils
-from flask_login import UserMixin
 
 BASE_URL = os.environ.get("BASE_URL", None)
+LANGUAGES = ['english', 'romanji', 'hiragana']
+# Bump when answer normalization or the question text changes, stored derived data with
+# another version is ignored and rebuilt by the next quiz sync
+DERIVED_VERSION = 1
+DATE_FORMAT = "%d/%m/%Y %H:%M:%S"
+# Score histogram buckets, 0-9% up to 90-99% plus one for 100%
+HISTOGRAM_BUCKETS = 11
+
+# Every model declares __slots__: attempts are loaded by the thousand, and a slotted
+# instance is a fraction of the size of one with a __dict__. to_dict() always builds a
+# new dict, so callers can modify what it returns without touching the model.
+
+# Has the attributes and get_id() flask_login reads itself, rather than subclassing its
+# UserMixin, which would give every instance a __dict__
+class User:
+    __slots__ = ('id', 'name', 'email', 'display_name', 'is_active', 'is_authenticated', 'is_anonymous')
 
-class User(UserMixin):
     def __init__(self, id: str, name: str, display_name: str, email: str, is_active: bool, is_authenticated: bool):
         self.id = id
         self.name = name
@@ -19,21 +37,20 @@ class User(UserMixin):
     def get_id(self):
         return self.id
 
-    def is_authenticated(self):
-        return self.is_authenticated
-
-    def is_active(self):
-        return self.is_active
-
-    def is_anonymous(self):
-        return self.is_anonymous
-    
     @staticmethod
     def from_dict(dict: dict):
         return User(dict['id'], dict['name'], dict['display_name'], dict['email'], dict['is_active'], dict['is_authenticated'])
 
     def to_dict(self):
-        return self.__dict__
+        return {
+            'id': self.id,
+            'name': self.name,
+            'email': self.email,
+            'display_name': self.display_name,
+            'is_active': self.is_active,
+            'is_authenticated': self.is_authenticated,
+            'is_anonymous': self.is_anonymous
+        }
 
     def to_display_dict(self, attempts):
         user = self.to_dict()
@@ -49,7 +66,17 @@ class User(UserMixin):
         user['count_quizzes'] = len(attempts)
         return user
 
+    # Same as to_display_dict but from the stats aggregate instead of every attempt
+    def to_stats_display_dict(self, stats):
+        user = self.to_dict()
+        stats_display = (stats or UserStats(self.id, self.display_name, 0, 0)).to_display_dict()
+        for key in ['average_score', 'average_score_float', 'count_quizzes']:
+            user[key] = stats_display[key]
+        return user
+
 class Quiz:
+    __slots__ = ('id', 'title', 'link', 'level', 'questions', 'questions_list', 'question_ids', 'views', 'submission_schema')
+
     def __init__(self, id: str, title: str, level: str, questions: dict):
         self.id = id
         self.title = title
@@ -57,31 +84,64 @@ class Quiz:
         self.level = level 
         self.questions = questions # dict[question id, QuizQuestion]
         self.questions_list = questions.values() # making life easier with Jinja
+        self.question_ids = list(questions.keys())
+        self.views = {} # dict[question language, QuizView]
+        self.submission_schema = None
     
     def get_link(self):
         return f"{BASE_URL}/quiz/{self.id}"
 
     @staticmethod
     def from_dict(dict: dict):
-        return Quiz(dict['id'], dict['title'], dict['level'], \
-            {qq.id: qq for qq in [QuizQuestion.from_dict(q) for q in dict['questions']]})
+        quiz = Quiz(dict['id'], dict['title'], dict['level'], \
+            {qq.id: qq for qq in map(QuizQuestion.from_dict, dict['questions'])})
+        derived = dict.get('derived')
+        if derived and derived.get('version') == DERIVED_VERSION:
+            quiz.load_derived(derived)
+        return quiz
 
-    def get_quiz_view(self, question_language: str):
-        view = {
-            'id': self.id,
-            'title': self.title,
-            'link': self.link,
-            'level': self.level,
-            'questions': [{
-                'id': q.id,
-                'question': q.get_question(question_language)
-            } for q in self.questions.values()]
+    # The normalized answers and question text grading and the views use, precomputed by
+    # the quiz sync so instances don't build them on first use
+    def get_derived(self):
+        return {
+            'version': DERIVED_VERSION,
+            'questions': {str(id): {
+                'accepted_answers': {l: sorted(q.get_accepted_answers(l)) for l in LANGUAGES},
+                'question_text': {l: q.get_question(l) for l in LANGUAGES}
+            } for (id, q) in self.questions.items()}
         }
 
+    def load_derived(self, derived: dict):
+        for (id, q) in self.questions.items():
+            question = derived['questions'].get(str(id))
+            if question:
+                q.accepted_answers = {l: frozenset(a) for (l, a) in question['accepted_answers'].items()}
+                q.question_text = dict(question['question_text'])
+
+    def get_quiz_view(self, question_language: str):
+        view = self.get_prebuilt_view(question_language)
         # Don't return the questions in the same order each time
-        random.shuffle(view['questions'])
+        order = random.sample(range(len(view.questions)), len(view.questions))
+        return {
+            'id': view.id,
+            'title': view.title,
+            'link': view.link,
+            'level': view.level,
+            'questions': [view.questions[i] for i in order]
+        }
+
+    # Built once per question language, every request only shuffles the order
+    def get_prebuilt_view(self, question_language: str):
+        view = self.views.get(question_language)
+        if view is None:
+            view = QuizView(self, question_language)
+            self.views[question_language] = view
         return view
 
+    def get_submission_schema(self):
+        if self.submission_schema is None:
+            self.submission_schema = SubmissionSchema(self)
+        return self.submission_schema
 
     def to_dict(self):
         return {
@@ -89,16 +149,100 @@ class Quiz:
             'title': self.title,
             'link': self.link,
             'level': self.level,
-            'questions': {k: q.__dict__ for k,q in self.questions.items()},
-            'questions_list': [q.__dict__ for q in self.questions_list]
+            'questions': {k: q.to_dict() for k,q in self.questions.items()},
+            'questions_list': [q.to_dict() for q in self.questions_list]
         }
     
+class QuizView:
+    """Immutable view of a quiz for one question language, in question order."""
+    __slots__ = ('id', 'title', 'link', 'level', 'question_language', 'questions', 'json', 'etag')
+
+    def __init__(self, quiz: Quiz, question_language: str):
+        self.id = quiz.id
+        self.title = quiz.title
+        self.link = quiz.link
+        self.level = quiz.level
+        self.question_language = question_language
+        self.questions = tuple(MappingProxyType({
+            'id': q.id,
+            'question': q.get_question(question_language)
+        }) for q in quiz.questions.values())
+        self.json = json.dumps({
+            'id': self.id,
+            'title': self.title,
+            'level': self.level,
+            'question_language': question_language,
+            'questions': [dict(q) for q in self.questions]
+        }, ensure_ascii=False)
+        self.etag = hashlib.sha256(self.json.encode("utf-8")).hexdigest()[:32]
+
+class SubmissionError(ValueError):
+    """A submission that doesn't fit its quiz, rejected before any grading."""
+
+class SubmissionSchema:
+    """What a submission for one quiz may look like, built once per quiz from its questions.
+
+    Two formats are accepted. The original one keys each response by question id:
+        {"question_language": ..., "answer_language": ..., "responses": {"<id>": {"id": "<id>", "answer": ...}}}
+    The compact one lists the answers in the quiz's question order (quiz_question_ids in quiz.html):
+        {"question_language": ..., "answer_language": ..., "answers": [...]}
+    """
+    __slots__ = ('question_ids', 'response_keys', 'max_answer_chars', 'max_body_bytes')
+    # Every question allows at least this many characters, however short its answers
+    MIN_ANSWER_CHARS = 100
+    # Bytes of JSON around each answer and around the whole submission, generously
+    ANSWER_OVERHEAD_BYTES = 64
+    BODY_OVERHEAD_BYTES = 512
+
+    def __init__(self, quiz: Quiz):
+        self.question_ids = tuple(quiz.question_ids)
+        self.response_keys = tuple(str(id) for id in self.question_ids)
+        # Long enough to list every accepted answer, "A or B or C"
+        longest = max(len(" or ".join(q.get_answers(l))) for q in quiz.questions.values() for l in LANGUAGES)
+        self.max_answer_chars = max(self.MIN_ANSWER_CHARS, 2*longest)
+        # Six bytes per character covers \uXXXX escapes, the id appears twice in a response
+        self.max_body_bytes = self.BODY_OVERHEAD_BYTES + sum(
+            6*self.max_answer_chars + 2*len(key) + self.ANSWER_OVERHEAD_BYTES for key in self.response_keys)
+
+    # (question language, answer language, answers in question order), raises SubmissionError
+    def parse(self, data):
+        if not isinstance(data, dict):
+            raise SubmissionError("Submission must be a JSON object")
+        question_language = data.get('question_language')
+        answer_language = data.get('answer_language')
+        if question_language not in LANGUAGES or answer_language not in LANGUAGES or question_language == answer_language:
+            raise SubmissionError("Unknown or identical question and answer languages")
+
+        if 'answers' in data:
+            answers = data['answers']
+            if not isinstance(answers, list) or len(answers) != len(self.question_ids):
+                raise SubmissionError(f"answers must list {len(self.question_ids)} answers")
+        else:
+            responses = data.get('responses')
+            if not isinstance(responses, dict) or len(responses) != len(self.response_keys):
+                raise SubmissionError(f"responses must hold {len(self.response_keys)} responses")
+            try:
+                answers = [responses[key]['answer'] for key in self.response_keys]
+            except (KeyError, TypeError):
+                raise SubmissionError("responses must hold an answer for every question")
+
+        for answer in answers:
+            if not isinstance(answer, str):
+                raise SubmissionError("Answers must be strings")
+            if len(answer) > self.max_answer_chars:
+                raise SubmissionError(f"Answers are limited to {self.max_answer_chars} characters")
+        return (question_language, answer_language, answers)
+
 class QuizQuestion:
+    __slots__ = ('id', 'english', 'romanji', 'hiragana', 'accepted_answers', 'question_text')
+
     def __init__(self, id: str, english: list, romanji: list, hiragana: list):
         self.id = id
         self.english = english # list[string]
         self.romanji = romanji # list[string]
         self.hiragana = hiragana # list[string]
+        self.accepted_answers = {} # dict[answer language, frozenset of normalized answers]
+        self.question_text = {} # dict[question language, string]
 
     @staticmethod
     def from_dict(dict: dict):
@@ -108,7 +252,22 @@ class QuizQuestion:
             dict['romanji'],
             dict['hiragana'])
 
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'english': list(self.english),
+            'romanji': list(self.romanji),
+            'hiragana': list(self.hiragana)
+        }
+
     def get_question(self, question_language: str):
+        text = self.question_text.get(question_language)
+        if text is None:
+            text = self.build_question(question_language)
+            self.question_text[question_language] = text
+        return text
+
+    def build_question(self, question_language: str):
         match question_language:
             case 'english':
                 return '/'.join(self.english)
@@ -130,13 +289,34 @@ class QuizQuestion:
             case _:
                 return None
 
+    # Normalized answers for a language, built once and then graded by set membership
+    def get_accepted_answers(self, answer_language: str):
+        accepted = self.accepted_answers.get(answer_language)
+        if accepted is None:
+            answers = [MiscUtils.normalize_answer(a) for a in self.get_answers(answer_language)]
+            # Someone answering every option, e.g. "Arigatou or Arigatou gozaimasu"
+            accepted = frozenset(answers + [("or").join(answers)])
+            self.accepted_answers[answer_language] = accepted
+        return accepted
+
+    def is_correct(self, answer_language: str, answer: str):
+        return MiscUtils.normalize_answer(answer) in self.get_accepted_answers(answer_language)
+
 
 class QuizAttempt:
-    def __init__(self, user_id: str, quiz_id: str, quiz_title: str, question_language: str, answer_language: str, score: float, responses: dict, date: str = None):
+    __slots__ = ('id', 'user_id', 'quiz_id', 'quiz_title', 'quiz_level', 'timestamp', 'date', 'question_language', 'answer_language', 'score', 'responses')
+
+    # Everything but the per-question responses, enough to list an attempt
+    SUMMARY_FIELDS = ['id', 'user_id', 'quiz_id', 'quiz_title', 'date', 'timestamp', 'question_language', 'answer_language', 'score']
+
+    def __init__(self, user_id: str, quiz_id: str, quiz_title: str, question_language: str, answer_language: str, score: float, responses: dict, date: str = None, timestamp: float = None, id: str = None, quiz_level: int = None):
+        self.id = id # document id, set when saved
         self.user_id = user_id
         self.quiz_id = quiz_id
         self.quiz_title = quiz_title 
-        self.date = date if date else datetime.today().strftime("%d/%m/%Y %H:%M:%S")
+        self.quiz_level = quiz_level # not stored on attempts saved before level leaderboards
+        self.timestamp = timestamp if timestamp else (QuizAttempt.parse_date(date) if date else time.time())
+        self.date = date if date else datetime.fromtimestamp(self.timestamp).strftime(DATE_FORMAT)
         self.question_language = question_language
         self.answer_language = answer_language
         self.score = score
@@ -144,30 +324,86 @@ class QuizAttempt:
 
     @staticmethod
     def from_dict(dict: dict):
-        return QuizAttempt(dict['user_id'], dict['quiz_id'], dict['quiz_title'], dict['question_language'], dict['answer_language'], dict['score'], {uq.question_id: uq for uq in [QuizResponse.from_dict(q) for q in dict['questions'].values()]}, dict['date'])
+        return QuizAttempt(dict['user_id'], dict['quiz_id'], dict['quiz_title'], dict['question_language'], dict['answer_language'], dict['score'], {uq.question_id: uq for uq in map(QuizResponse.from_dict, dict['questions'].values())}, dict['date'], dict.get('timestamp'), dict.get('id'), dict.get('quiz_level'))
+
+    # Attempts saved before timestamps existed only have the formatted date
+    @staticmethod
+    def parse_date(date: str):
+        return datetime.strptime(date, DATE_FORMAT).timestamp()
 
     def get_results(self):
         return [qq.get_result() for qq in self.responses.values()]
 
     def to_dict(self):
         return {
+            'id': self.id,
             'user_id': self.user_id,
             'quiz_id': self.quiz_id,
             'quiz_title': self.quiz_title,
+            'quiz_level': self.quiz_level,
             'date': self.date,
+            'timestamp': self.timestamp,
             'question_language': self.question_language,
             'answer_language': self.answer_language,
             'score': self.score,
             'questions': {k: q.to_dict() for k,q in self.responses.items()}
         }
 
+    # The stored form: question ids as string keys (Firestore map keys must be strings) and
+    # nothing shared with the quiz the attempt was graded against
+    def to_document(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'quiz_id': self.quiz_id,
+            'quiz_title': self.quiz_title,
+            'quiz_level': self.quiz_level,
+            'date': self.date,
+            'timestamp': self.timestamp,
+            'question_language': self.question_language,
+            'answer_language': self.answer_language,
+            'score': self.score,
+            'questions': {str(k): q.to_dict() for k,q in self.responses.items()}
+        }
+
     def to_display_dict(self):
         quizAttempt = self.to_dict()
         quizAttempt['score'] = MiscUtils.format_percent(self.score)
         return quizAttempt
 
 
+class QuizAttemptSummary:
+    __slots__ = ('id', 'quiz_id', 'quiz_title', 'date', 'timestamp', 'question_language', 'answer_language', 'score')
+
+    def __init__(self, id: str, quiz_id: str, quiz_title: str, date: str, timestamp: float, question_language: str, answer_language: str, score: float):
+        self.id = id
+        self.quiz_id = quiz_id
+        self.quiz_title = quiz_title
+        self.date = date
+        self.timestamp = timestamp
+        self.question_language = question_language
+        self.answer_language = answer_language
+        self.score = score
+
+    @staticmethod
+    def from_dict(dict: dict):
+        return QuizAttemptSummary(dict['id'], dict['quiz_id'], dict['quiz_title'], dict['date'], dict['timestamp'], dict['question_language'], dict['answer_language'], dict['score'])
+
+    def to_display_dict(self):
+        return {
+            'id': self.id,
+            'quiz_id': self.quiz_id,
+            'quiz_title': self.quiz_title,
+            'date': self.date,
+            'question_language': self.question_language,
+            'answer_language': self.answer_language,
+            'score': MiscUtils.format_percent(self.score)
+        }
+
+
 class QuizResponse:
+    __slots__ = ('question_id', 'question', 'answers', 'user_answer', 'correct')
+
     def __init__(self, question_id: str, question: str, answers: list, user_answer: str, correct: bool):
         self.question_id = question_id 
         self.question = question
@@ -185,9 +421,131 @@ class QuizResponse:
         return data
 
     def to_dict(self):
-        return self.__dict__
+        return {
+            'question_id': self.question_id,
+            'question': self.question,
+            'answers': list(self.answers),
+            'user_answer': self.user_answer,
+            'correct': self.correct
+        }
+
+class UserStats:
+    __slots__ = ('user_id', 'display_name', 'total_score', 'count_quizzes')
+
+    def __init__(self, user_id: str, display_name: str, total_score: float, count_quizzes: int):
+        self.user_id = user_id
+        self.display_name = display_name
+        self.total_score = total_score # sum of all attempt scores, also the leaderboard rank key
+        self.count_quizzes = count_quizzes
+
+    @staticmethod
+    def from_dict(dict: dict):
+        return UserStats(dict['user_id'], dict.get('display_name'), dict.get('total_score', 0), dict.get('count_quizzes', 0))
+
+    @staticmethod
+    def from_attempts(user: User, attempts):
+        return UserStats(user.id, user.display_name, sum([a.score for a in attempts]), len(attempts))
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'display_name': self.display_name,
+            'total_score': self.total_score,
+            'count_quizzes': self.count_quizzes
+        }
+
+    # Same shape as User.to_display_dict so it can feed QuizUtils.calculate_leaderboard
+    def to_display_dict(self):
+        average = self.total_score/self.count_quizzes if self.count_quizzes > 0 else 0
+        return {
+            'id': self.user_id,
+            'display_name': self.display_name,
+            'average_score': MiscUtils.format_percent(average),
+            'average_score_float': average,
+            'count_quizzes': self.count_quizzes
+        }
+
+class QuizAnalytics:
+    """Running totals for one quiz and language pair, kept up to date as attempts are saved."""
+    __slots__ = ('quiz_id', 'question_language', 'answer_language', 'count_attempts', 'total_score', 'score_histogram', 'questions')
+
+    def __init__(self, quiz_id: str, question_language: str, answer_language: str, count_attempts: int, total_score: float, score_histogram: dict, questions: dict):
+        self.quiz_id = quiz_id
+        self.question_language = question_language
+        self.answer_language = answer_language
+        self.count_attempts = count_attempts
+        self.total_score = total_score
+        self.score_histogram = score_histogram # dict[bucket as string, count]
+        self.questions = questions # dict[question id as string, {'attempts', 'correct', 'wrong_answers': dict[answer, count]}]
+
+    @staticmethod
+    def from_dict(dict: dict):
+        return QuizAnalytics(dict['quiz_id'], dict['question_language'], dict['answer_language'], dict.get('count_attempts', 0),
+            dict.get('total_score', 0), dict.get('score_histogram', {}), dict.get('questions', {}))
+
+    def to_dict(self):
+        return {
+            'quiz_id': self.quiz_id,
+            'question_language': self.question_language,
+            'answer_language': self.answer_language,
+            'count_attempts': self.count_attempts,
+            'total_score': self.total_score,
+            'score_histogram': dict(self.score_histogram),
+            'questions': {id: {k: dict(v) if isinstance(v, dict) else v for k, v in q.items()} for id, q in self.questions.items()}
+        }
+
+    # Hardest questions first, each with its most common wrong answers
+    def to_display_dict(self, quiz: Quiz = None, top_wrong_answers: int = 5):
+        questions = []
+        for (id, q) in self.questions.items():
+            attempts = q.get('attempts', 0)
+            correct = q.get('correct', 0)
+            wrong_answers = sorted(q.get('wrong_answers', {}).items(), key=lambda a: (-a[1], a[0]))[:top_wrong_answers]
+            question = quiz.questions.get(int(id)) if quiz and id.isdigit() else None
+            questions.append({
+                'question_id': id,
+                'question': question.get_question(self.question_language) if question else None,
+                'attempts': attempts,
+                'correct_rate': correct/attempts if attempts > 0 else 0,
+                'common_wrong_answers': [{'answer': a, 'count': n} for (a, n) in wrong_answers]
+            })
+        questions.sort(key=lambda q: q['correct_rate'])
+        return {
+            'quiz_id': self.quiz_id,
+            'question_language': self.question_language,
+            'answer_language': self.answer_language,
+            'count_attempts': self.count_attempts,
+            'average_score': self.total_score/self.count_attempts if self.count_attempts > 0 else 0,
+            'score_histogram': [self.score_histogram.get(str(b), 0) for b in range(HISTOGRAM_BUCKETS)],
+            'questions': questions
+        }
+
+class QuizCounter:
+    """Attempt count and score sum of one quiz over every language pair, summed from its shards."""
+    __slots__ = ('quiz_id', 'count_attempts', 'total_score')
+
+    def __init__(self, quiz_id: str, count_attempts: int, total_score: float):
+        self.quiz_id = quiz_id
+        self.count_attempts = count_attempts
+        self.total_score = total_score
+
+    @staticmethod
+    def from_dict(dict: dict):
+        return QuizCounter(dict['quiz_id'], dict.get('count_attempts', 0), dict.get('total_score', 0))
+
+    def to_dict(self):
+        return {
+            'quiz_id': self.quiz_id,
+            'count_attempts': self.count_attempts,
+            'total_score': self.total_score
+        }
+
+    def get_average_score(self):
+        return MiscUtils.format_percent(self.total_score/self.count_attempts if self.count_attempts > 0 else 0)
 
 class LeaderboardRank:
+    __slots__ = ('place', 'user_id', 'user_name', 'count_quizzes', 'average_score')
+
     def __init__(self, place: int, user_id: str, user_name: str, count_quizzes: int, average_score: float):
         self.place = place
         self.user_id = user_id
@@ -196,4 +554,55 @@ class LeaderboardRank:
         self.average_score = average_score
 
     def to_dict(self):
-        return self.__dict__
\ No newline at end of file
+        return {
+            'place': self.place,
+            'user_id': self.user_id,
+            'user_name': self.user_name,
+            'count_quizzes': self.count_quizzes,
+            'average_score': self.average_score
+        }
+
+class ReviewItem:
+    """Spaced repetition state of one question for one user and language pair. The deck
+    (user and language pair) plus the due time is what review sessions are queried on."""
+    __slots__ = ('id', 'deck', 'user_id', 'quiz_id', 'question_id', 'question_language', 'answer_language',
+                 'ease', 'interval_days', 'repetitions', 'lapses', 'due', 'last_reviewed')
+
+    def __init__(self, id: str, deck: str, user_id: str, quiz_id: str, question_id: int, question_language: str, answer_language: str,
+                 ease: float, interval_days: float, repetitions: int, lapses: int, due: float, last_reviewed: float):
+        self.id = id
+        self.deck = deck
+        self.user_id = user_id
+        self.quiz_id = quiz_id
+        self.question_id = question_id
+        self.question_language = question_language
+        self.answer_language = answer_language
+        self.ease = ease
+        self.interval_days = interval_days
+        self.repetitions = repetitions # correct answers in a row
+        self.lapses = lapses
+        self.due = due # timestamp
+        self.last_reviewed = last_reviewed
+
+    @staticmethod
+    def from_dict(dict: dict):
+        return ReviewItem(dict['id'], dict['deck'], dict['user_id'], dict['quiz_id'], dict['question_id'],
+            dict['question_language'], dict['answer_language'], dict['ease'], dict['interval_days'],
+            dict['repetitions'], dict['lapses'], dict['due'], dict['last_reviewed'])
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'deck': self.deck,
+            'user_id': self.user_id,
+            'quiz_id': self.quiz_id,
+            'question_id': self.question_id,
+            'question_language': self.question_language,
+            'answer_language': self.answer_language,
+            'ease': self.ease,
+            'interval_days': self.interval_days,
+            'repetitions': self.repetitions,
+            'lapses': self.lapses,
+            'due': self.due,
+            'last_reviewed': self.last_reviewed
+        }
@@ -0,0 +1,88 @@
+import os
+import json
+import hashlib
+from models import LANGUAGES, DERIVED_VERSION
+
+# Quiz file fields and the JSON types they must have
+QUIZ_FIELDS = {'id': str, 'title': str, 'level': int, 'questions': list}
+QUESTION_FIELDS = {'id': int, **{l: list for l in LANGUAGES}}
+
+class QuizSyncUtils:
+    # Problems with one quiz file, an empty list when it is valid
+    @staticmethod
+    def validate(data):
+        if not isinstance(data, dict):
+            return ["not a JSON object"]
+        errors = QuizSyncUtils.validate_fields(data, QUIZ_FIELDS, "")
+        if errors:
+            return errors
+        if not data['id'].strip():
+            errors.append("id is empty")
+        if not data['title'].strip():
+            errors.append("title is empty")
+        if not data['questions']:
+            errors.append("questions is empty")
+
+        question_ids = set()
+        for (i, question) in enumerate(data['questions']):
+            where = f"questions[{i}]"
+            if not isinstance(question, dict):
+                errors.append(f"{where} is not an object")
+                continue
+            question_errors = QuizSyncUtils.validate_fields(question, QUESTION_FIELDS, f"{where}.")
+            if question_errors:
+                errors += question_errors
+                continue
+            if question['id'] in question_ids:
+                errors.append(f"{where}.id {question['id']} is a duplicate")
+            question_ids.add(question['id'])
+            for language in LANGUAGES:
+                answers = question[language]
+                if not answers:
+                    errors.append(f"{where}.{language} is empty")
+                elif not all(isinstance(a, str) and a.strip() for a in answers):
+                    errors.append(f"{where}.{language} must only hold non-empty strings")
+        return errors
+
+    @staticmethod
+    def validate_fields(data: dict, fields: dict, prefix: str):
+        errors = [f"{prefix}{f} is missing" for f in fields if f not in data]
+        errors += [f"{prefix}{f} is not a known field" for f in data if f not in fields]
+        # bool is an int to isinstance, but never a valid id or level
+        errors += [f"{prefix}{f} must be of type {t.__name__}" for (f, t) in fields.items()
+            if f in data and (not isinstance(data[f], t) or isinstance(data[f], bool))]
+        return errors
+
+    # Hash of the quiz's canonical JSON and the derived data version, so changing either
+    # pushes the quiz again
+    @staticmethod
+    def get_content_hash(data: dict):
+        canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(f"{DERIVED_VERSION}:{canonical}".encode("utf-8")).hexdigest()
+
+    # (dict[quiz id, quiz data], list[error]) for the *.json files in path. Any error means
+    # the directory shouldn't be synced.
+    @staticmethod
+    def load_directory(path: str):
+        quizzes = {}
+        files = {}
+        errors = []
+        for filename in sorted(os.listdir(path)):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(path, filename), encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                errors.append(f"{filename}: {e}")
+                continue
+            file_errors = QuizSyncUtils.validate(data)
+            if file_errors:
+                errors += [f"{filename}: {e}" for e in file_errors]
+                continue
+            if data['id'] in quizzes:
+                errors.append(f"{filename}: id {data['id']} is also used by {files[data['id']]}")
+                continue
+            quizzes[data['id']] = data
+            files[data['id']] = filename
+        return (quizzes, errors)
@@ -1,113 +1,582 @@
 import os
 import time
+import uuid
 import json
-import firebase_admin
-from firebase_admin import firestore
-from google.cloud.firestore_v1.base_query import FieldFilter
+import hashlib
+import threading
+from cachetools import TTLCache
 from models import *
+from backends import get_backend, Increment
+from cacheutils import VersionedCache
+from analyticsutils import AnalyticsUtils
+from counterutils import CounterUtils
+from quizsyncutils import QuizSyncUtils
+from reviewutils import ReviewUtils
+from writeutils import MAX_BATCH_WRITES
+from leaderboardutils import SortedLeaderboard, LeaderboardUtils, ALL_TIME
 
 class FirestoreRepo:
-    def __init__(self, collection):  
-        if not firebase_admin._apps:
-            firebase_admin.initialize_app()
-        self.db = firestore.client()
-        self.collection = self.db.collection(collection)
+    # Firestore caps the number of values in an 'in' filter
+    IN_QUERY_LIMIT = 30
+
+    def __init__(self, collection, backend=None):
+        self.explicit_backend = backend
+        self.collection = collection
+
+    # The process backend is looked up on first use, so creating the repos at import
+    # doesn't connect to Firestore
+    @property
+    def backend(self):
+        return self.explicit_backend or get_backend()
 
     def query(self, field, operation, val): 
-        docs = self.collection.where(filter=FieldFilter(field, operation, val)).stream()
-        return [doc.to_dict() for doc in docs]
+        return self.backend.query(self.collection, field, operation, val)
 
     def get(self, filename): 
-        res = self.collection.document(filename)
-        if res:
-            doc = res.get().to_dict()
-            return doc
-        else:
-            return None
+        return self.backend.get(self.collection, filename)
 
     def get_all(self):
-        docs = self.collection.get()
-        return [doc.to_dict() for doc in docs]
+        return self.backend.get_all(self.collection)
+
+    def get_many(self, filenames):
+        return self.backend.get_many(self.collection, filenames)
+
+    # An 'in' query per IN_QUERY_LIMIT values instead of one query per value
+    def query_in(self, field, vals):
+        vals = list(vals)
+        docs = []
+        for i in range(0, len(vals), self.IN_QUERY_LIMIT):
+            docs += self.backend.query(self.collection, field, 'in', vals[i:i + self.IN_QUERY_LIMIT])
+        return docs
+
+    # Every document, a page of page_size at a time so only one page is held in memory. In
+    # document id order, or with order_field in (order_field, id) order limited to
+    # since < order_field <= until.
+    def stream_pages(self, page_size: int, order_field: str = None, since: float = None, until: float = None):
+        cursor = None
+        while True:
+            items = self.backend.items_page(self.collection, page_size, cursor, order_field, since, until)
+            if items:
+                yield [doc for (_, doc) in items]
+            if len(items) < page_size:
+                return
+            (id, doc) = items[-1]
+            cursor = (doc[order_field], id) if order_field else id
 
     def save(self, filename, data): 
-        self.collection.document(filename).set(data)
+        self.backend.save(self.collection, filename, data)
 
 # Model repos
 class UsersRepo(FirestoreRepo):
-    def __init__(self):
-        super().__init__("users")
+    # Optional process-wide cache of user documents, off unless USER_CACHE_TTL_SECONDS is set.
+    # Keep the TTL short, other instances only see changes once it lapses.
+    CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", 0))
+    cache = TTLCache(maxsize=10000, ttl=CACHE_TTL_SECONDS) if CACHE_TTL_SECONDS > 0 else None
+    cache_lock = threading.Lock()
+
+    def __init__(self, backend=None):
+        super().__init__("users", backend)
 
     def get(self, user_id: str):
-        user = super().get(user_id)
+        user = self.get_cached(user_id)
+        if user is None:
+            user = super().get(user_id)
+            if user and self.cache is not None:
+                with self.cache_lock:
+                    self.cache[user_id] = user
         if user:
+            # A fresh User each time, callers mutate it (e.g. to_display_dict)
             return User.from_dict(user)
         return None
 
+    @classmethod
+    def get_cached(cls, user_id: str):
+        if cls.cache is None:
+            return None
+        with cls.cache_lock:
+            return cls.cache.get(user_id)
+
+    @classmethod
+    def invalidate(cls, user_id: str):
+        if cls.cache is not None:
+            with cls.cache_lock:
+                cls.cache.pop(user_id, None)
+
     def get_all(self):
         return [User.from_dict(u) for u in super().get_all()]
 
+    # Every write stamps updated_at, which incremental exports select users by
     def save(self, user: User):
-        data = user.to_dict()
+        data = dict(user.to_dict(), updated_at=time.time())
         super().save(user.id, data)
+        self.invalidate(user.id)
+
+    # Partial updates, a single write with no prior read so concurrent logins and
+    # logouts on other instances don't overwrite each other's fields
+    def update(self, user_id: str, fields: dict):
+        self.invalidate(user_id)
+        return self.backend.update(self.collection, user_id, dict(fields, updated_at=time.time()))
 
     def set_display_name(self, user_id, display_name):
-        user = self.get(user_id)
-        if user:
-            user.display_name = display_name
-            self.save(user)
+        if self.update(user_id, {'display_name': display_name}):
+            # Keep the leaderboard aggregate and the user's entries on the scoped boards in
+            # step with the new name
+            writes = [(UserStatsRepo.COLLECTION, user_id, {'user_id': user_id, 'display_name': display_name}, True)]
+            writes += [(LeaderboardsRepo.COLLECTION, f"{entry['scope']}-{user_id}", {'display_name': display_name}, True)
+                for entry in self.backend.query(LeaderboardsRepo.COLLECTION, 'user_id', "==", user_id)]
+            for i in range(0, len(writes), MAX_BATCH_WRITES):
+                self.backend.batch_save(writes[i:i + MAX_BATCH_WRITES])
+            LeaderboardsRepo.rename(user_id, display_name)
 
     def set_active(self, user_id: str):
-        user = self.get(user_id)
-        if user:
-            user.is_active = True
-            user.is_authenticated = True
-            self.save(user)
+        self.update(user_id, {'is_active': True, 'is_authenticated': True})
 
     def set_inactive(self, user_id: str):
+        self.update(user_id, {'is_active': False, 'is_authenticated': False})
+
+    # Creates or reactivates the user for a login, one read and one write
+    def login(self, user_id: str, name: str, email: str):
         user = self.get(user_id)
-        if user:
-            user.is_active = False
-            user.is_authenticated = False 
+        if not user:
+            user = User(id=user_id, name=name, display_name=name, email=email, is_active=True, is_authenticated=True)
             self.save(user)
+            return user
+        self.set_active(user_id)
+        user.is_active = True
+        user.is_authenticated = True
+        return user
 
 class QuizAttemptsRepo(FirestoreRepo):
-    def __init__(self):
-        super().__init__("quiz_attempts")
+    COLLECTION = "quiz_attempts"
+
+    # With a write_queue (writeutils.get_write_queue), saves are committed in the background
+    def __init__(self, backend=None, write_queue=None):
+        super().__init__(self.COLLECTION, backend)
+        self.write_queue = write_queue
+
+    def get(self, attempt_id: str):
+        attempt = super().get(attempt_id)
+        if attempt:
+            return QuizAttempt.from_dict(attempt)
+        return None
 
     def get_all_for_user(self, user_id: str):
         return [QuizAttempt.from_dict(qa) for qa in super().query('user_id',"==", user_id)]
 
+    # Newest first summaries without the per-question responses, plus the cursor for the next page
+    # (None on the last page). The cursor is the last attempt's (timestamp, id), as attempts can
+    # share a timestamp.
+    def get_page_for_user(self, user_id: str, limit: int, cursor: tuple = None):
+        docs = self.backend.query_page(self.collection, 'user_id', user_id, 'timestamp', limit,
+            start_after=cursor, descending=True, fields=QuizAttempt.SUMMARY_FIELDS)
+        return QuizAttemptsRepo.to_page(docs, limit)
+
+    @staticmethod
+    def to_page(docs, limit: int):
+        summaries = [QuizAttemptSummary.from_dict(d) for d in docs]
+        next_cursor = (summaries[-1].timestamp, summaries[-1].id) if len(summaries) == limit else None
+        return (summaries, next_cursor)
+
+    # dict[user id, list[QuizAttempt]] in a fixed number of round trips however many users
+    def get_all_for_users(self, user_ids):
+        attempts = {id: [] for id in user_ids}
+        for qa in super().query_in('user_id', attempts.keys()):
+            attempts[qa['user_id']].append(QuizAttempt.from_dict(qa))
+        return attempts
+
     def get_all_for_quiz(self, quiz_id: str):
         return [QuizAttempt.from_dict(qa) for qa in super().query('quiz_id',"==", quiz_id)]
 
-    def save(self, attempt: QuizAttempt):
-        data = attempt.to_dict()
-        super().save(attempt.quiz_id + "-" + attempt.user_id + '-' + str(time.time()), json.loads(json.dumps(data)))
+    # Writes the attempt, bumps the user's leaderboard aggregates and the quiz analytics and
+    # moves the questions' review items on in one atomic batch, directly when there is no
+    # write queue or it is full. Review items still waiting in the write queue are graded
+    # from their queued state, so answering a question again before a flush loses nothing.
+    def save(self, attempt: QuizAttempt, display_name: str = None):
+        item_ids = ReviewUtils.get_item_ids(attempt)
+        review_items = ReviewItemsRepo.to_items(item_ids, self.backend.get_many(ReviewItemsRepo.COLLECTION, item_ids), self.write_queue)
+        writes = QuizAttemptsRepo.get_writes(attempt, display_name, review_items)
+        if not (self.write_queue and self.write_queue.put(writes)):
+            self.backend.batch_save(writes)
+        LeaderboardsRepo.record(attempt, display_name)
+
+    # Attempt ids are random rather than built from the quiz, user and time, so a class
+    # submitting the same quiz together writes all over the key range instead of at one end
+    # of it, and two submissions in the same clock tick can't overwrite each other. The
+    # quiz's analytics and counter are written to a random shard for the same reason.
+    # review_items are the stored items of the attempt's questions (dict[item id, ReviewItem]).
+    @staticmethod
+    def get_writes(attempt: QuizAttempt, display_name: str = None, review_items: dict = None):
+        attempt.id = attempt.id or uuid.uuid4().hex
+        stats = {
+            'user_id': attempt.user_id,
+            'total_score': Increment(attempt.score),
+            'count_quizzes': Increment(1)
+        }
+        if display_name is not None:
+            stats['display_name'] = display_name
+
+        return [
+            (QuizAttemptsRepo.COLLECTION, attempt.id, attempt.to_document(), False),
+            (UserStatsRepo.COLLECTION, attempt.user_id, stats, True),
+            (QuizAnalyticsRepo.COLLECTION, CounterUtils.pick_shard_id(AnalyticsUtils.get_id(attempt.quiz_id, attempt.question_language, attempt.answer_language)),
+                AnalyticsUtils.get_fields(attempt), True),
+            (QuizCountersRepo.COLLECTION, CounterUtils.pick_shard_id(attempt.quiz_id), QuizCountersRepo.get_fields(attempt), True)
+        ] + LeaderboardsRepo.get_writes(attempt, display_name) \
+            + ReviewItemsRepo.get_writes(ReviewUtils.apply_attempt(attempt, review_items or {}, attempt.timestamp))
+
+    # Gives attempts saved before paging existed the id and timestamp fields it orders on
+    def backfill(self):
+        count = 0
+        for (id, qa) in self.backend.items(self.collection):
+            if 'id' not in qa or 'timestamp' not in qa:
+                self.backend.update(self.collection, id, {'id': id, 'timestamp': QuizAttempt.parse_date(qa['date'])})
+                count += 1
+        return count
+
+class UserStatsRepo(FirestoreRepo):
+    COLLECTION = "user_stats"
+    # Users whose attempts rebuild holds in memory at once, and commits in one batch
+    REBUILD_CHUNK_USERS = 100
+
+    def __init__(self, backend=None):
+        super().__init__(self.COLLECTION, backend)
+
+    def get(self, user_id: str):
+        stats = super().get(user_id)
+        if stats:
+            return UserStats.from_dict(stats)
+        return None
+
+    # Backfills the aggregate from the existing quiz_attempts documents, a chunk of users at a time
+    def rebuild(self, users_repo: UsersRepo, quiz_attempts_repo: QuizAttemptsRepo):
+        users = users_repo.get_all()
+        for i in range(0, len(users), self.REBUILD_CHUNK_USERS):
+            chunk = users[i:i + self.REBUILD_CHUNK_USERS]
+            attempts = quiz_attempts_repo.get_all_for_users([u.id for u in chunk])
+            self.backend.batch_save([(self.collection, u.id, UserStats.from_attempts(u, attempts[u.id]).to_dict(), False) for u in chunk])
+        return len(users)
+
+class LeaderboardsRepo(FirestoreRepo):
+    """Leaderboards by quiz, level, week and term, one document per board and user in the
+    same shape as user_stats. Each process keeps the boards it has served as
+    SortedLeaderboards, updated in place by its own submissions and reloaded once they are
+    CACHE_TTL_SECONDS old to pick up everyone else's."""
+    COLLECTION = "leaderboards"
+    CACHE_TTL_SECONDS = float(os.environ.get("LEADERBOARD_TTL_SECONDS", 30))
+    boards = {} # dict[scope, (SortedLeaderboard, expires at)], shared by the process
+    boards_lock = threading.Lock()
+
+    def __init__(self, backend=None):
+        super().__init__(self.COLLECTION, backend)
+
+    def get_board(self, scope: str):
+        board = LeaderboardsRepo.get_cached(scope)
+        if board is None:
+            board = LeaderboardsRepo.put_cached(scope, SortedLeaderboard(self.load(scope)))
+        return board
+
+    def load(self, scope: str):
+        if scope == ALL_TIME:
+            docs = self.backend.query(UserStatsRepo.COLLECTION, 'count_quizzes', ">", 0)
+        else:
+            docs = super().query('scope', "==", scope)
+        return [UserStats.from_dict(d) for d in docs]
+
+    @classmethod
+    def get_cached(cls, scope: str):
+        with cls.boards_lock:
+            cached = cls.boards.get(scope)
+            if cached and time.monotonic() < cached[1]:
+                return cached[0]
+            return None
+
+    @classmethod
+    def put_cached(cls, scope: str, board: SortedLeaderboard):
+        now = time.monotonic()
+        with cls.boards_lock:
+            # Past weeks and terms are never asked for again
+            for expired in [s for (s, (_, expires_at)) in cls.boards.items() if expires_at <= now]:
+                del cls.boards[expired]
+            cls.boards[scope] = (board, now + cls.CACHE_TTL_SECONDS)
+        return board
+
+    # Renames the user on the boards this process has loaded
+    @classmethod
+    def rename(cls, user_id: str, display_name: str):
+        with cls.boards_lock:
+            boards = [board for (board, _) in cls.boards.values()]
+        for board in boards:
+            board.rename(user_id, display_name)
+
+    # Applies a saved attempt to the boards this process has loaded, the rest load it from storage
+    @classmethod
+    def record(cls, attempt: QuizAttempt, display_name: str = None):
+        for scope in [ALL_TIME] + LeaderboardUtils.get_scopes(attempt):
+            board = cls.get_cached(scope)
+            if board is not None:
+                board.add(attempt.user_id, display_name, attempt.score)
+
+    @staticmethod
+    def get_writes(attempt: QuizAttempt, display_name: str = None):
+        writes = []
+        for scope in LeaderboardUtils.get_scopes(attempt):
+            entry = {
+                'scope': scope,
+                'user_id': attempt.user_id,
+                'total_score': Increment(attempt.score),
+                'count_quizzes': Increment(1)
+            }
+            if display_name is not None:
+                entry['display_name'] = display_name
+            writes.append((LeaderboardsRepo.COLLECTION, f"{scope}-{attempt.user_id}", entry, True))
+        return writes
+
+    # Backfills every scoped board from the existing quiz_attempts documents. Attempts saved
+    # before quiz levels were stored get theirs from the quiz catalog.
+    def rebuild(self, users_repo: UsersRepo, quizzes_repo: "QuizzesRepo"):
+        levels = {q.id: q.level for q in quizzes_repo.get_all()}
+        names = {u.id: u.display_name for u in users_repo.get_all()}
+        entries = {} # dict[doc id, entry]
+        for (_, doc) in self.backend.items(QuizAttemptsRepo.COLLECTION):
+            attempt = QuizAttempt.from_dict(doc)
+            if attempt.quiz_level is None:
+                attempt.quiz_level = levels.get(attempt.quiz_id)
+            for (_, id, entry, _) in LeaderboardsRepo.get_writes(attempt, names.get(attempt.user_id)):
+                total = entries.setdefault(id, {'scope': entry['scope'], 'user_id': attempt.user_id, 'display_name': entry.get('display_name'), 'total_score': 0, 'count_quizzes': 0})
+                total['total_score'] += attempt.score
+                total['count_quizzes'] += 1
+        writes = [(self.collection, id, entry, False) for (id, entry) in entries.items()]
+        for i in range(0, len(writes), MAX_BATCH_WRITES):
+            self.backend.batch_save(writes[i:i + MAX_BATCH_WRITES])
+        with LeaderboardsRepo.boards_lock:
+            LeaderboardsRepo.boards.clear()
+        return len(writes)
+
+class QuizAnalyticsRepo(FirestoreRepo):
+    """Analytics per quiz and language pair, each written to CounterUtils shards and summed
+    when read. Documents from before sharding (the unsuffixed id) are summed in too."""
+    COLLECTION = "quiz_analytics"
+
+    def __init__(self, backend=None):
+        super().__init__(self.COLLECTION, backend)
+
+    def get(self, quiz_id: str, question_language: str, answer_language: str):
+        analytics = [a for a in self.get_all_for_quiz(quiz_id)
+            if a.question_language == question_language and a.answer_language == answer_language]
+        return analytics[0] if analytics else None
+
+    # One per language pair the quiz has been taken in
+    def get_all_for_quiz(self, quiz_id: str):
+        shards = {}
+        for doc in super().query('quiz_id', "==", quiz_id):
+            shards.setdefault((doc['question_language'], doc['answer_language']), []).append(doc)
+        return [QuizAnalytics.from_dict(CounterUtils.sum_shards(docs)) for docs in shards.values()]
+
+    # Recomputes the analytics and counters of each quiz from its stored attempts, replacing
+    # the running totals: the totals go to the unsuffixed ids and every shard is emptied.
+    # Attempts saved while a quiz is being rebuilt may be counted twice or not at all.
+    def rebuild(self, quiz_attempts_repo: QuizAttemptsRepo, quiz_ids):
+        existing = {} # dict[quiz id, list[(collection, doc id, doc)]]
+        for collection in (self.collection, QuizCountersRepo.COLLECTION):
+            for (id, doc) in self.backend.items(collection):
+                existing.setdefault(doc.get('quiz_id'), []).append((collection, id, doc))
+
+        count = 0
+        for quiz_id in quiz_ids:
+            docs = AnalyticsUtils.compute(quiz_attempts_repo.get_all_for_quiz(quiz_id))
+            # Emptied shards keep the ids they're grouped by
+            writes = {(c, id): (c, id, {k: v for (k, v) in doc.items() if isinstance(v, str)}, False)
+                for (c, id, doc) in existing.get(quiz_id, [])}
+            for d in docs:
+                id = AnalyticsUtils.get_id(d['quiz_id'], d['question_language'], d['answer_language'])
+                writes[(self.collection, id)] = (self.collection, id, d, False)
+            counter = QuizCounter(quiz_id, sum(d['count_attempts'] for d in docs), sum(d['total_score'] for d in docs))
+            writes[(QuizCountersRepo.COLLECTION, quiz_id)] = (QuizCountersRepo.COLLECTION, quiz_id, counter.to_dict(), False)
+            writes = list(writes.values())
+            for i in range(0, len(writes), MAX_BATCH_WRITES):
+                self.backend.batch_save(writes[i:i + MAX_BATCH_WRITES])
+            count += len(docs)
+        QuizCountersRepo.invalidate()
+        return count
+
+class QuizCountersRepo(FirestoreRepo):
+    """Attempt count and score sum per quiz for the quiz listings, in CounterUtils shards small
+    enough to read all at once. Each process keeps the sums for CACHE_TTL_SECONDS."""
+    COLLECTION = "quiz_counters"
+    CACHE_TTL_SECONDS = float(os.environ.get("QUIZ_COUNTERS_TTL_SECONDS", 60))
+    counters = None # (dict[quiz id, QuizCounter], expires at), shared by the process
+    counters_lock = threading.Lock()
+
+    def __init__(self, backend=None):
+        super().__init__(self.COLLECTION, backend)
+
+    # dict[quiz id, QuizCounter], quizzes nobody has taken yet are missing
+    def get_all(self):
+        counters = QuizCountersRepo.get_cached()
+        if counters is None:
+            counters = QuizCountersRepo.put_cached(QuizCountersRepo.sum_shards(super().get_all()))
+        return counters
+
+    @staticmethod
+    def sum_shards(docs):
+        shards = {}
+        for doc in docs:
+            shards.setdefault(doc['quiz_id'], []).append(doc)
+        return {quiz_id: QuizCounter.from_dict(CounterUtils.sum_shards(docs)) for (quiz_id, docs) in shards.items()}
+
+    @classmethod
+    def get_cached(cls):
+        with cls.counters_lock:
+            if cls.counters and time.monotonic() < cls.counters[1]:
+                return cls.counters[0]
+            return None
+
+    @classmethod
+    def put_cached(cls, counters):
+        with cls.counters_lock:
+            cls.counters = (counters, time.monotonic() + cls.CACHE_TTL_SECONDS)
+        return counters
+
+    @classmethod
+    def invalidate(cls):
+        with cls.counters_lock:
+            cls.counters = None
+
+    @staticmethod
+    def get_fields(attempt: QuizAttempt):
+        return {'quiz_id': attempt.quiz_id, 'count_attempts': Increment(1), 'total_score': Increment(attempt.score)}
+
+class ReviewItemsRepo(FirestoreRepo):
+    COLLECTION = "review_items"
+
+    # With a write_queue, saves go through it after the attempts queued before them
+    def __init__(self, backend=None, write_queue=None):
+        super().__init__(self.COLLECTION, backend)
+        self.write_queue = write_queue
+
+    # dict[item id, ReviewItem] of the ones that exist, in one batched read
+    def get_items(self, item_ids):
+        return ReviewItemsRepo.to_items(item_ids, super().get_many(item_ids), self.write_queue)
+
+    # The stored items, replaced by any newer version still waiting in the write queue
+    @staticmethod
+    def to_items(item_ids, docs, write_queue=None):
+        items = {d['id']: ReviewItem.from_dict(d) for d in docs}
+        if write_queue:
+            items.update({id: ReviewItem.from_dict(d) for (id, d) in write_queue.get_pending(ReviewItemsRepo.COLLECTION, item_ids).items()})
+        return items
+
+    # Up to limit of the deck's items due by now, earliest first, and when the first item
+    # after them is due (None if none was read). Reads limit + 1 items off the (deck, due)
+    # index, however long the user's history is.
+    def get_due(self, user_id: str, question_language: str, answer_language: str, now: float, limit: int):
+        deck = ReviewUtils.get_deck(user_id, question_language, answer_language)
+        items = [ReviewItem.from_dict(d) for d in self.backend.query_page(self.collection, 'deck', deck, 'due', limit + 1, descending=False)]
+        due = [i for i in items if i.due <= now][:limit]
+        rest = items[len(due):]
+        return (due, rest[0].due if rest else None)
+
+    @staticmethod
+    def get_writes(items):
+        return [(ReviewItemsRepo.COLLECTION, i.id, i.to_dict(), False) for i in items]
+
+    def save_all(self, items):
+        writes = ReviewItemsRepo.get_writes(items)
+        if not (self.write_queue and self.write_queue.put(writes)):
+            self.backend.batch_save(writes)
+
+    # Replays every stored attempt, oldest first, into fresh review items
+    def rebuild(self):
+        attempts = [QuizAttempt.from_dict(doc) for (_, doc) in self.backend.items(QuizAttemptsRepo.COLLECTION)]
+        attempts.sort(key=lambda a: a.timestamp)
+        items = {} # dict[item id, ReviewItem]
+        for attempt in attempts:
+            for item in ReviewUtils.apply_attempt(attempt, items, attempt.timestamp):
+                items[item.id] = item
+        writes = ReviewItemsRepo.get_writes(items.values())
+        for i in range(0, len(writes), MAX_BATCH_WRITES):
+            self.backend.batch_save(writes[i:i + MAX_BATCH_WRITES])
+        return len(writes)
 
 class QuizzesRepo(FirestoreRepo):
-    def __init__(self):
-        super().__init__("quizzes")
-        #self.seed()
+    METADATA_COLLECTION = "metadata"
+    # Content hash per quiz id, as of the last sync
+    HASHES_DOC = "quiz_hashes"
+    CACHE_TTL_SECONDS = int(os.environ.get("QUIZ_CACHE_TTL_SECONDS", 300))
+    # Shared by every QuizzesRepo in the process
+    cache = VersionedCache(CACHE_TTL_SECONDS)
+
+    def __init__(self, backend=None):
+        super().__init__("quizzes", backend)
 
     def get(self, quiz_id: str):
-        quiz = super().get(quiz_id)
-        if quiz:
-            return Quiz.from_dict(quiz)
+        return self.get_catalog().get(quiz_id)
 
     def get_all(self):
-        return [Quiz.from_dict(q) for q in super().get_all()]
+        return list(self.get_catalog().values())
+
+    # dict[quiz id, Quiz] of parsed quizzes, served from the process cache when warm
+    def get_catalog(self):
+        return self.cache.get_items(self.get_version, self.load_catalog)
+
+    def load_catalog(self):
+        return {q.id: q for q in [Quiz.from_dict(q) for q in super().get_all()]}
+
+    def get_version(self):
+        doc = self.backend.get(self.METADATA_COLLECTION, "quizzes")
+        return doc.get('version') if doc else None
 
+    def cache_stats(self):
+        return self.cache.stats()
+
+    # Stores one quiz the way sync does, its content hash and a new version in the same batch,
+    # so every instance's cache reloads it
     def save(self, quiz: Quiz):
-        data = quiz.to_dict()
-        super().save(quiz.id, data)
-
-    # This re-seeds the quizzes to Firestore keeping the same ID's
-    def seed(self):
-        path = 'quizzes'
-        for filename in os.listdir(path):
-            file = os.path.join(path, filename)
-            with open(file, encoding="utf-8") as f:
-                data = json.load(f)
-                quiz = self.get(data['id'])
-                if not quiz:
-                    super().save(data['id'], data)
+        data = {'id': quiz.id, 'title': quiz.title, 'level': quiz.level, 'questions': [q.to_dict() for q in quiz.questions_list]}
+        content_hash = QuizSyncUtils.get_content_hash(data)
+        manifest = self.backend.get(self.METADATA_COLLECTION, self.HASHES_DOC) or {}
+        hashes = dict(manifest.get('hashes', {}))
+        hashes[quiz.id] = content_hash
+        self.backend.batch_save([
+            (self.collection, quiz.id, dict(data, content_hash=content_hash, derived=quiz.get_derived()), False),
+            (self.METADATA_COLLECTION, self.HASHES_DOC, {'hashes': hashes}, False),
+            (self.METADATA_COLLECTION, "quizzes", {'version': self.get_catalog_version(hashes)}, False)])
+        self.cache.invalidate()
+
+    @staticmethod
+    def get_catalog_version(hashes: dict):
+        return hashlib.sha256(json.dumps(sorted(hashes.items())).encode("utf-8")).hexdigest()
+
+    # Pushes the quizzes in path (keeping their ids) that are new or changed since the last
+    # sync, with their derived grading data, in batched writes. The stored content hashes
+    # are read in one fetch, so running it again without changes writes nothing.
+    def sync(self, path: str = 'quizzes', dry_run: bool = False):
+        (quizzes, errors) = QuizSyncUtils.load_directory(path)
+        result = {'errors': errors, 'created': [], 'updated': [], 'unchanged': 0, 'not_in_source': []}
+        if errors:
+            return result
+
+        manifest = self.backend.get(self.METADATA_COLLECTION, self.HASHES_DOC) or {}
+        stored_hashes = manifest.get('hashes', {})
+        hashes = dict(stored_hashes)
+        writes = []
+        for (quiz_id, data) in quizzes.items():
+            content_hash = QuizSyncUtils.get_content_hash(data)
+            if stored_hashes.get(quiz_id) == content_hash:
+                result['unchanged'] += 1
+                continue
+            result['updated' if quiz_id in stored_hashes else 'created'].append(quiz_id)
+            hashes[quiz_id] = content_hash
+            writes.append((self.collection, quiz_id, dict(data, content_hash=content_hash, derived=Quiz.from_dict(data).get_derived()), False))
+        result['not_in_source'] = sorted(set(stored_hashes) - set(quizzes))
+        if not writes or dry_run:
+            return result
+
+        # The hashes and the version go last, so an interrupted sync pushes the rest next time.
+        # Bumping the version makes every instance's cache reload on its next TTL check.
+        writes.append((self.METADATA_COLLECTION, self.HASHES_DOC, {'hashes': hashes}, False))
+        writes.append((self.METADATA_COLLECTION, "quizzes", {'version': self.get_catalog_version(hashes)}, False))
+        for i in range(0, len(writes), MAX_BATCH_WRITES):
+            self.backend.batch_save(writes[i:i + MAX_BATCH_WRITES])
+        self.cache.invalidate()
+        return result
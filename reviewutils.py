@@ -0,0 +1,94 @@
+from models import *
+
+# SM-2 parameters
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+DAY_SECONDS = 24*60*60
+# A missed question comes back within the same sitting rather than a day later
+RELEARN_SECONDS = 10*60
+# Grades are only right or wrong, these are the SM-2 qualities (0 to 5) they count as
+QUALITY_CORRECT = 4
+QUALITY_WRONG = 1
+# Longest gap between reviews, however many times in a row the question was right
+MAX_INTERVAL_DAYS = 365
+
+class ReviewUtils:
+    @staticmethod
+    def get_deck(user_id: str, question_language: str, answer_language: str):
+        return f"{user_id}:{question_language}:{answer_language}"
+
+    @staticmethod
+    def get_item_id(deck: str, quiz_id: str, question_id):
+        return f"{deck}:{quiz_id}:{question_id}"
+
+    # ids of the review items the attempt's questions update
+    @staticmethod
+    def get_item_ids(attempt: QuizAttempt):
+        deck = ReviewUtils.get_deck(attempt.user_id, attempt.question_language, attempt.answer_language)
+        return [ReviewUtils.get_item_id(deck, attempt.quiz_id, r.question_id) for r in attempt.responses.values()]
+
+    @staticmethod
+    def new_item(user_id: str, quiz_id: str, question_id, question_language: str, answer_language: str, now: float):
+        deck = ReviewUtils.get_deck(user_id, question_language, answer_language)
+        return ReviewItem(ReviewUtils.get_item_id(deck, quiz_id, question_id), deck, user_id, quiz_id, question_id,
+            question_language, answer_language, DEFAULT_EASE, 0, 0, 0, now, None)
+
+    # SM-2: each correct answer in a row pushes the next review out (1 day, 6 days, then
+    # by the ease factor, up to MAX_INTERVAL_DAYS), a wrong one starts the item over and
+    # lowers its ease. Correct answers before the item is due, like retaking a quiz, leave
+    # the schedule as it is.
+    @staticmethod
+    def grade(item: ReviewItem, correct: bool, now: float):
+        quality = QUALITY_CORRECT if correct else QUALITY_WRONG
+        if correct and now < item.due:
+            item.last_reviewed = now
+            return item
+        if correct:
+            if item.repetitions == 0:
+                item.interval_days = 1
+            elif item.repetitions == 1:
+                item.interval_days = 6
+            else:
+                item.interval_days = min(MAX_INTERVAL_DAYS, round(item.interval_days*item.ease, 2))
+            item.repetitions += 1
+            item.due = now + item.interval_days*DAY_SECONDS
+        else:
+            item.repetitions = 0
+            item.interval_days = 0
+            item.lapses += 1
+            item.due = now + RELEARN_SECONDS
+        item.ease = max(MIN_EASE, round(item.ease + 0.1 - (5 - quality)*(0.08 + (5 - quality)*0.02), 4))
+        item.last_reviewed = now
+        return item
+
+    # The attempt's questions graded onto their stored items (dict[item id, ReviewItem]),
+    # new items for questions seen for the first time
+    @staticmethod
+    def apply_attempt(attempt: QuizAttempt, items: dict, now: float):
+        updated = []
+        for (item_id, response) in zip(ReviewUtils.get_item_ids(attempt), attempt.responses.values()):
+            item = items.get(item_id) or ReviewUtils.new_item(attempt.user_id, attempt.quiz_id, response.question_id,
+                attempt.question_language, attempt.answer_language, now)
+            updated.append(ReviewUtils.grade(item, response.correct, now))
+        return updated
+
+    # Grades review answers onto their items (dict[item id, ReviewItem] of the stored ones).
+    # Returns the graded items and a QuizResponse for each, raises SubmissionError for items
+    # that aren't stored or no longer in the catalog and for answers over their quiz's limit.
+    @staticmethod
+    def grade_answers(item_ids, answers, items: dict, catalog: dict, now: float):
+        graded = []
+        responses = []
+        for (item_id, answer) in zip(item_ids, answers):
+            item = items.get(item_id)
+            quiz = catalog.get(item.quiz_id) if item else None
+            question = quiz.questions.get(item.question_id) if quiz else None
+            if question is None:
+                raise SubmissionError(f"Unknown review item {item_id}")
+            if not isinstance(answer, str) or len(answer) > quiz.get_submission_schema().max_answer_chars:
+                raise SubmissionError("Answers must be strings within their quiz's length limit")
+            correct = question.is_correct(item.answer_language, answer)
+            graded.append(ReviewUtils.grade(item, correct, now))
+            responses.append(QuizResponse(f"{item.quiz_id}:{item.question_id}", question.get_question(item.question_language),
+                question.get_answers(item.answer_language), answer, correct))
+        return (graded, responses)
@@ -1,13 +1,43 @@
 import os
-from google.cloud import secretmanager
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from startuputils import startup_timer
 
 PROJECT_ID = "jce-project-411601"
 
 class SecretUtils:
+    """Secret Manager access. The client is only created for the first secret that isn't in
+    the environment, and every secret is fetched at most once per process."""
     def __init__(self):
-        self.client = secretmanager.SecretManagerServiceClient()
+        self.client = None
         self.secret_path = f"projects/{PROJECT_ID}/secrets/<secret>/versions/1"
+        self.secrets = {} # dict[key, value]
+        self.lock = threading.Lock()
 
     def get_secret(self, key):
-        response = self.client.access_secret_version(name = self.secret_path.replace("<secret>",key))
-        return response.payload.data.decode("UTF-8")
+        # Local runs and benchmarks can provide secrets through the environment instead
+        if key in os.environ:
+            return os.environ[key]
+        if key not in self.secrets:
+            client = self.get_client()
+            with startup_timer.phase(f"secret {key}"):
+                response = client.access_secret_version(name = self.secret_path.replace("<secret>",key))
+            with self.lock:
+                self.secrets[key] = response.payload.data.decode("UTF-8")
+        return self.secrets[key]
+
+    def get_client(self):
+        with self.lock:
+            if self.client is None:
+                with startup_timer.phase("secret manager client"):
+                    from google.cloud import secretmanager
+                    self.client = secretmanager.SecretManagerServiceClient()
+            return self.client
+
+    # Fetches several secrets at once instead of one round trip after another
+    def prefetch(self, keys):
+        missing = [k for k in keys if k not in os.environ and k not in self.secrets]
+        if missing:
+            self.get_client()
+            with ThreadPoolExecutor(len(missing)) as pool:
+                list(pool.map(self.get_secret, missing))
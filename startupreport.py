@@ -0,0 +1,181 @@
+"""Cold start report with stubbed GCP clients.
+
+Imports main in a fresh process with Secret Manager and Firestore replaced by in-process
+stubs that sleep like the real network calls, then serves the first request with and
+without the App Engine warmup request in front of it, and prints each startup phase.
+
+    python startupreport.py --secret-latency-ms 80 --client-latency-ms 150 --firestore-latency-ms 30
+"""
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import subprocess
+
+SCENARIOS = {
+    'cold': "first request straight after import",
+    'warmup': "warmup request, then the first request"
+}
+
+class StubSecretManagerClient:
+    def __init__(self, latency: dict):
+        self.latency = latency
+        time.sleep(latency['client'])
+
+    def access_secret_version(self, name):
+        time.sleep(self.latency['secret'])
+        key = name.split("/secrets/")[1].split("/")[0]
+        return types.SimpleNamespace(payload=types.SimpleNamespace(data=f"stub-{key}".encode("UTF-8")))
+
+class StubSnapshot:
+    def __init__(self, id, data):
+        self.id = id
+        self.data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return self.data
+
+class StubQuery:
+    """Enough of the Firestore query API for the startup path, over an in-memory dict."""
+    def __init__(self, db, collection, filters=()):
+        self.db = db
+        self.collection = collection
+        self.filters = list(filters)
+
+    def where(self, filter):
+        from backends import MemoryBackend
+        match = MemoryBackend.OPERATIONS[filter.op_string]
+        return StubQuery(self.db, self.collection, self.filters + [lambda d: filter.field_path in d and match(d[filter.field_path], filter.value)])
+
+    def order_by(self, field, direction=None):
+        return self
+
+    def limit(self, count):
+        return self
+
+    def stream(self):
+        time.sleep(self.db.latency['firestore'])
+        docs = self.db.collections.get(self.collection, {})
+        return [StubSnapshot(id, d) for (id, d) in docs.items() if all(f(d) for f in self.filters)]
+
+    def get(self):
+        return self.stream()
+
+    def document(self, id):
+        return StubDocument(self.db, self.collection, id)
+
+class StubDocument:
+    def __init__(self, db, collection, id):
+        self.db = db
+        self.collection = collection
+        self.id = id
+
+    def get(self):
+        time.sleep(self.db.latency['firestore'])
+        return StubSnapshot(self.id, self.db.collections.get(self.collection, {}).get(self.id))
+
+class StubFirestore:
+    def __init__(self, latency: dict, collections: dict):
+        self.latency = latency
+        self.collections = collections
+
+    def collection(self, name):
+        return StubQuery(self, name)
+
+# Installs the stubs in place of google.cloud.secretmanager and firebase_admin
+def install_stubs(latency: dict, collections: dict):
+    import google.cloud
+    secretmanager = types.ModuleType("google.cloud.secretmanager")
+    secretmanager.SecretManagerServiceClient = lambda: StubSecretManagerClient(latency)
+    sys.modules["google.cloud.secretmanager"] = secretmanager
+    google.cloud.secretmanager = secretmanager
+
+    firebase_admin = types.ModuleType("firebase_admin")
+    firebase_admin._apps = {}
+    def initialize_app():
+        time.sleep(latency['client'])
+        firebase_admin._apps['[DEFAULT]'] = True
+    firebase_admin.initialize_app = initialize_app
+    firestore = types.ModuleType("firebase_admin.firestore")
+    def client():
+        time.sleep(latency['client'])
+        return StubFirestore(latency, collections)
+    firestore.client = client
+    firestore.Query = types.SimpleNamespace(ASCENDING="ASCENDING", DESCENDING="DESCENDING")
+    firebase_admin.firestore = firestore
+    sys.modules["firebase_admin"] = firebase_admin
+    sys.modules["firebase_admin.firestore"] = firestore
+
+# The bundled quizzes, as the stub Firestore's only data
+def load_collections():
+    quizzes = {}
+    for filename in sorted(os.listdir('quizzes')):
+        with open(os.path.join('quizzes', filename), encoding="utf-8") as f:
+            quiz = json.load(f)
+            quizzes[quiz['id']] = quiz
+    return {'quizzes': quizzes}
+
+def run_scenario(scenario: str, latency: dict):
+    import stubidp
+    identity_provider = stubidp.serve_in_background()
+    for key in ["SECRET_KEY", "GOOGLE_CLIENT_ID", "GOOGLE_CLIENT_SECRET"]:
+        os.environ.pop(key, None)
+    os.environ["DATASTORE_BACKEND"] = "firestore"
+    os.environ["OPENID_DISCOVERY_URL"] = stubidp.discovery_url(identity_provider)
+    install_stubs(latency, load_collections())
+
+    timings = {}
+    started = time.perf_counter()
+    import main
+    timings['import_ms'] = (time.perf_counter() - started)*1000
+
+    client = main.app.test_client()
+    if scenario == 'warmup':
+        started = time.perf_counter()
+        client.get('/_ah/warmup')
+        timings['warmup_ms'] = (time.perf_counter() - started)*1000
+
+    started = time.perf_counter()
+    response = client.get('/')
+    timings['first_request_ms'] = (time.perf_counter() - started)*1000
+    if response.status_code != 200:
+        raise RuntimeError(f"GET / returned {response.status_code}")
+
+    started = time.perf_counter()
+    client.get('/')
+    timings['second_request_ms'] = (time.perf_counter() - started)*1000
+    return {'timings': timings, 'startup': main.startup_timer.report()}
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Startup phase report with stubbed GCP clients")
+    parser.add_argument('--secret-latency-ms', type=float, default=80, help="per access_secret_version call")
+    parser.add_argument('--client-latency-ms', type=float, default=150, help="per client creation (Secret Manager, firebase_admin, Firestore)")
+    parser.add_argument('--firestore-latency-ms', type=float, default=30, help="per Firestore read")
+    parser.add_argument('--scenario', choices=SCENARIOS.keys(), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    latency = {'secret': args.secret_latency_ms/1000, 'client': args.client_latency_ms/1000, 'firestore': args.firestore_latency_ms/1000}
+    if args.scenario:
+        print(json.dumps(run_scenario(args.scenario, latency)))
+        return 0
+
+    for (scenario, description) in SCENARIOS.items():
+        # A fresh process each, so every import really is cold
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--scenario', scenario,
+            '--secret-latency-ms', str(args.secret_latency_ms), '--client-latency-ms', str(args.client_latency_ms),
+            '--firestore-latency-ms', str(args.firestore_latency_ms)], capture_output=True, text=True, check=True)
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        print(f"\n{scenario}: {description}")
+        print(f"{'phase':<32}{'thread':<24}{'start ms':>10}{'ms':>10}")
+        for p in result['startup']['phases']:
+            print(f"{p['phase']:<32}{p['thread'][:23]:<24}{p['start_ms']:>10.1f}{p['duration_ms']:>10.1f}")
+        for (name, ms) in result['timings'].items():
+            print(f"{name:<56}{ms:>10.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,63 @@
+import time
+import threading
+from contextlib import contextmanager
+
+class StartupTimer:
+    """Wall-clock time of each startup phase, for the /stats/startup report. Phases are
+    either marked in order while main is imported, or timed when something lazy is first
+    created, which may be at import, in the warmup request or in the first real request."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last_mark = self.started
+        self.lock = threading.Lock()
+        self.phases = [] # list[dict]
+
+    # Records the time since the previous mark as phase `name`
+    def mark(self, name: str):
+        now = time.perf_counter()
+        with self.lock:
+            self.add(name, self.last_mark, now)
+            self.last_mark = now
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.add(name, started, time.perf_counter())
+
+    def add(self, name: str, started: float, ended: float):
+        self.phases.append({
+            'phase': name,
+            'thread': threading.current_thread().name,
+            'start_ms': round((started - self.started)*1000, 3),
+            'duration_ms': round((ended - started)*1000, 3)
+        })
+
+    def report(self):
+        with self.lock:
+            return {'phases': list(self.phases), 'uptime_ms': round((time.perf_counter() - self.started)*1000, 3)}
+
+# Started when main imports this module, its first import
+startup_timer = StartupTimer()
+
+class Lazy:
+    """A value created by `factory` the first time it is needed, once per process even
+    when several threads ask at the same time."""
+    def __init__(self, name: str, factory):
+        self.name = name
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.value = None
+        self.ready = False
+
+    def get(self):
+        if not self.ready:
+            with self.lock:
+                if not self.ready:
+                    with startup_timer.phase(self.name):
+                        self.value = self.factory()
+                    self.ready = True
+        return self.value
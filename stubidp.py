@@ -0,0 +1,84 @@
+"""A stand-in OpenID Connect provider for local runs and benchmarks.
+
+Serves the discovery document, authorization, token and userinfo endpoints the
+login flow in main.py uses. Point the app at it with
+OPENID_DISCOVERY_URL=http://127.0.0.1:<port>/.well-known/openid-configuration
+and OAUTHLIB_INSECURE_TRANSPORT=1.
+
+    python stubidp.py --port 8081
+"""
+import uuid
+import argparse
+import threading
+from urllib.parse import urlencode
+from flask import Flask, request, redirect, jsonify
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+def create_app():
+    app = Flask(__name__)
+    codes = {} # dict[code, sub]
+    tokens = {} # dict[access token, sub]
+
+    @app.route("/.well-known/openid-configuration")
+    def discovery():
+        response = jsonify({
+            'issuer': request.host_url.rstrip('/'),
+            'authorization_endpoint': request.host_url + "authorize",
+            'token_endpoint': request.host_url + "token",
+            'userinfo_endpoint': request.host_url + "userinfo"
+        })
+        response.headers['Cache-Control'] = "public, max-age=3600"
+        return response
+
+    # Logs in as login_hint (or a fixed user) straight away, no consent screen
+    @app.route("/authorize")
+    def authorize():
+        code = uuid.uuid4().hex
+        codes[code] = request.args.get('login_hint', "stub-user")
+        params = {'code': code}
+        if request.args.get('state'):
+            params['state'] = request.args['state']
+        return redirect(request.args['redirect_uri'] + "?" + urlencode(params))
+
+    @app.route("/token", methods=['POST'])
+    def token():
+        sub = codes.pop(request.form.get('code'), None)
+        if sub is None:
+            return jsonify({'error': 'invalid_grant'}), 400
+        access_token = uuid.uuid4().hex
+        tokens[access_token] = sub
+        return jsonify({'access_token': access_token, 'token_type': 'Bearer', 'expires_in': 3600})
+
+    @app.route("/userinfo")
+    def userinfo():
+        sub = tokens.get(request.headers.get('Authorization', '').removeprefix("Bearer "))
+        if sub is None:
+            return jsonify({'error': 'invalid_token'}), 401
+        return jsonify({
+            'sub': sub,
+            'email': f"{sub}@example.com",
+            'email_verified': True,
+            'given_name': sub
+        })
+
+    return app
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+# Serves the stub on a background thread, returns the server so callers can shut it down
+def serve_in_background(host: str = "127.0.0.1", port: int = 0):
+    server = make_server(host, port, create_app(), threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def discovery_url(server):
+    return f"http://{server.host}:{server.port}/.well-known/openid-configuration"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenID Connect provider")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+    create_app().run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,31 @@
+import os
+import sys
+import json
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Must be configured before main is imported, the tests run against the in-memory datastore
+os.environ["DATASTORE_BACKEND"] = "memory"
+for key in ["SECRET_KEY", "GOOGLE_CLIENT_ID", "GOOGLE_CLIENT_SECRET"]:
+    os.environ.setdefault(key, "test")
+
+QUIZZES_PATH = os.path.join(ROOT, "quizzes")
+
+@pytest.fixture(scope="session")
+def quizzes():
+    from models import Quiz
+    quizzes = []
+    for filename in sorted(os.listdir(QUIZZES_PATH)):
+        with open(os.path.join(QUIZZES_PATH, filename), encoding="utf-8") as f:
+            quizzes.append(Quiz.from_dict(json.load(f)))
+    return quizzes
+
+# The bundled quizzes synced into the process datastore
+@pytest.fixture(scope="session")
+def quizzes_repo():
+    from repo import QuizzesRepo
+    repo = QuizzesRepo()
+    assert not repo.sync(QUIZZES_PATH)['errors']
+    return repo
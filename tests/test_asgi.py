@@ -0,0 +1,34 @@
+import asyncio
+import pytest
+from flask_login.utils import encode_cookie
+from models import User
+
+@pytest.fixture(scope="module")
+def apps(quizzes_repo):
+    import main
+    import asgi
+    main.users_repo.save(User("remembered", "R", "R", "r@example.com", True, True))
+    return (main, asgi)
+
+def get(asgi, path, cookie):
+    async def run():
+        response = await asgi.app.test_client().get(path, headers={'Cookie': cookie})
+        return response.status_code
+    return asyncio.run(run())
+
+def get_remember_cookie(main, user_id):
+    main.app.session_interface.load_secret_key(main.app)
+    with main.app.app_context():
+        return f"remember_token={encode_cookie(user_id)}"
+
+def test_remember_cookie_logs_in_without_session(apps):
+    (main, asgi) = apps
+    assert get(asgi, '/user/profile', get_remember_cookie(main, "remembered")) == 200
+    assert get(asgi, '/user/profile', "remember_token=remembered|forged") == 302
+
+def test_quiz_rejects_unknown_language(apps, quizzes_repo):
+    (main, asgi) = apps
+    quiz = quizzes_repo.get_all()[0]
+    cookie = get_remember_cookie(main, "remembered")
+    assert get(asgi, f'/quiz/{quiz.id}?question_language=english&answer_language=romanji', cookie) == 200
+    assert get(asgi, f'/quiz/{quiz.id}?question_language=english&answer_language=klingon', cookie) == 400
@@ -0,0 +1,71 @@
+import pytest
+from backends import MemoryBackend, SqliteBackend, Increment
+
+# Documents in every shape the repos store: indexed columns (user_id, quiz_id), nested maps
+# and fields some documents don't have
+DOCS = [
+    ('quiz_attempts', f"a{i}", {'id': f"a{i}", 'user_id': f"u{i % 3}", 'quiz_id': f"q{i % 2}", 'score': i/10,
+        'timestamp': 1000.0 + i // 2, 'questions': {'1': {'correct': i % 2 == 0}}})
+    for i in range(10)
+] + [
+    ('users', "u0", {'id': "u0", 'name': "Ünïcode", 'updated_at': 5.0}),
+    ('users', "u1", {'id': "u1", 'name': "B"}),
+]
+
+@pytest.fixture
+def backends(tmp_path):
+    backends = [MemoryBackend(), SqliteBackend(str(tmp_path / "test.sqlite3"))]
+    for backend in backends:
+        backend.batch_save([(c, id, data, False) for (c, id, data) in DOCS])
+    return backends
+
+# Both backends give the same answer to call, in the same order unless ordered is False
+def assert_same(backends, call, ordered=True):
+    (memory, sqlite) = [call(b) for b in backends]
+    if not ordered:
+        (memory, sqlite) = [sorted(r, key=lambda d: d['id']) for r in (memory, sqlite)]
+    assert memory == sqlite
+    return memory
+
+def test_reads(backends):
+    assert assert_same(backends, lambda b: b.get('users', "u0"))['name'] == "Ünïcode"
+    assert assert_same(backends, lambda b: b.get('users', "missing")) is None
+    assert len(assert_same(backends, lambda b: b.get_all('quiz_attempts'))) == 10
+    assert [d['id'] for d in assert_same(backends, lambda b: b.get_many('quiz_attempts', ["a3", "missing", "a1"]))] == ["a3", "a1"]
+    assert assert_same(backends, lambda b: b.items('users'))[0][0] == "u0"
+    assert_same(backends, lambda b: b.order_by('users', 'updated_at', descending=True))
+
+@pytest.mark.parametrize('field,operation,val', [
+    ('user_id', '==', "u1"), ('quiz_id', '!=', "q0"), ('score', '>', 0.5), ('score', '<=', 0.2),
+    ('user_id', 'in', ["u0", "u2"]), ('timestamp', 'not-in', [1000.0]), ('name', '==', "B"),
+])
+def test_query(backends, field, operation, val):
+    collection = 'users' if field == 'name' else 'quiz_attempts'
+    assert assert_same(backends, lambda b: b.query(collection, field, operation, val), ordered=False)
+
+def test_merged_writes(backends):
+    for backend in backends:
+        backend.save('stats', "u0", {'total': Increment(2), 'nested': {'a': Increment(1)}, 'name': "x"}, merge=True)
+        backend.batch_save([('stats', "u0", {'total': Increment(0.5), 'nested': {'b': 1}}, True)])
+        assert backend.update('stats', "u0", {'name': "y"})
+        assert not backend.update('stats', "missing", {'name': "y"})
+    assert assert_same(backends, lambda b: b.get('stats', "u0")) == {'total': 2.5, 'nested': {'a': 1, 'b': 1}, 'name': "y"}
+    assert assert_same(backends, lambda b: b.get('stats', "missing")) is None
+
+def test_pages(backends):
+    # Pages of 2 through one quiz's attempts, newest first then by id, resumed from the last (timestamp, id)
+    def read_all(backend, **kwargs):
+        (pages, cursor) = ([], None)
+        while True:
+            page = backend.query_page('quiz_attempts', 'quiz_id', "q0", 'timestamp', 2, start_after=cursor, **kwargs)
+            pages.append(page)
+            if len(page) < 2:
+                return pages
+            cursor = (page[-1]['timestamp'], page[-1]['id'])
+    assert sum(len(p) for p in assert_same(backends, read_all)) == 5
+    assert assert_same(backends, lambda b: read_all(b, descending=False, fields=['id', 'timestamp']))[0] == [{'id': "a0", 'timestamp': 1000.0}, {'id': "a2", 'timestamp': 1001.0}]
+
+    assert [id for (id, _) in assert_same(backends, lambda b: b.items_page('quiz_attempts', 3, start_after="a4"))] == ["a5", "a6", "a7"]
+    page = assert_same(backends, lambda b: b.items_page('quiz_attempts', 3, (1001.0, "a2"), 'timestamp', since=1000.0, until=1003.0))
+    assert [id for (id, _) in page] == ["a3", "a4", "a5"]
+    assert [id for (id, _) in assert_same(backends, lambda b: b.items_page('users', 10, order_field='updated_at'))] == ["u0"]
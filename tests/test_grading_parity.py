@@ -0,0 +1,40 @@
+from models import LANGUAGES
+
+# The grading rules as they were before answers were precompiled, which
+# QuizQuestion.is_correct (through MiscUtils.normalize_answer) has to match
+def format_question_answer(string):
+    string = string.lower()
+
+    # Ignores all spaces, punctuation, etc so we don't grade on dumb differences
+    strings_to_replace = ["'", ",", ".", "!", "?", " ", '"','\\"', "_", "。", "(beginning)", "(end)"]
+    for s in strings_to_replace:
+        string = string.replace(s,"")
+    return string.strip()
+
+def is_correct_reference(answers, answer):
+    formatted_response = format_question_answer(answer)
+    formatted_answers = [format_question_answer(a) for a in answers]
+    return (formatted_response in formatted_answers) or (formatted_response == ("or").join(formatted_answers))
+
+# Every answer in the quiz, plus variants of the question's own answers around the ignored
+# characters and words
+def get_candidates(quiz, answers):
+    candidates = [a for q in quiz.questions.values() for l in LANGUAGES for a in q.get_answers(l)]
+    candidates += [" or ".join(answers), "or".join(answers), "/".join(answers),
+        "", " ", "(beginning)", "(end)", "(e(beginning)nd)", "\\\"", "\tOR\n"]
+    for a in answers:
+        candidates += [a.upper(), f" {a}! ", f"{a}。", f'"{a}"', f"{a} (end)", f"(beginning) {a}",
+            a.replace(" ", "_"), a.replace(" ", "\t"), a[:-1], a + "s"]
+    return candidates
+
+def test_grading_matches_reference(quizzes):
+    mismatches = []
+    for quiz in quizzes:
+        for question in quiz.questions.values():
+            for language in LANGUAGES:
+                answers = question.get_answers(language)
+                for candidate in get_candidates(quiz, answers):
+                    if question.is_correct(language, candidate) != is_correct_reference(answers, candidate):
+                        mismatches.append((quiz.id, question.id, language, candidate))
+    assert quizzes
+    assert mismatches == []
@@ -0,0 +1,54 @@
+import json
+import pytest
+from backends import MemoryBackend, SqliteBackend
+from models import User
+from quizutils import QuizUtils
+from repo import QuizAttemptsRepo
+
+PAGE_SIZE = 4
+
+def save_attempts(repo, user, quiz, count):
+    ids = set()
+    for i in range(count):
+        attempt = QuizUtils.score_answers(user, quiz, 'english', 'romanji', [""]*len(quiz.questions))
+        # Three attempts per timestamp, so pages end in the middle of a tie
+        attempt.timestamp = 1000.0 + i // 3
+        repo.save(attempt)
+        ids.add(attempt.id)
+    return ids
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+def test_history_pages_cover_ties(quizzes, tmp_path, backend):
+    repo = QuizAttemptsRepo(MemoryBackend() if backend == 'memory' else SqliteBackend(str(tmp_path / "test.sqlite3")))
+    user = User("pager", "P", "P", "p@example.com", True, True)
+    ids = save_attempts(repo, user, quizzes[0], 3*PAGE_SIZE + 1)
+
+    (seen, cursor) = ([], None)
+    while True:
+        (attempts, cursor) = repo.get_page_for_user(user.id, PAGE_SIZE, cursor)
+        seen += attempts
+        if cursor is None:
+            break
+    assert sorted(a.id for a in seen) == sorted(ids)
+    assert [(a.timestamp, a.id) for a in seen] == sorted(((a.timestamp, a.id) for a in seen), reverse=True)
+
+def test_attempts_route_cursor(quizzes_repo):
+    import main
+    user = User("pager-route", "P", "P", "p@example.com", True, True)
+    main.users_repo.save(user)
+    ids = save_attempts(main.quiz_attempts_repo, user, quizzes_repo.get_all()[0], main.PROFILE_PAGE_SIZE + 2)
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = user.id
+        session['_fresh'] = True
+
+    (first, cursor) = main.quiz_attempts_repo.get_page_for_user(user.id, main.PROFILE_PAGE_SIZE)
+    seen = [a.id for a in first]
+    while cursor:
+        page = json.loads(client.get('/user/attempts', query_string={'cursor': f"{cursor[0]},{cursor[1]}"}).data)
+        seen += [a['id'] for a in page['attempts']]
+        cursor = page['next_cursor']
+    assert sorted(seen) == sorted(ids)
+
+    for cursor in ["nope", "1000.0", "x,id"]:
+        assert client.get('/user/attempts', query_string={'cursor': cursor}).status_code == 400
@@ -0,0 +1,81 @@
+import pytest
+from backends import MemoryBackend
+from models import User, SubmissionError
+from quizutils import QuizUtils
+from repo import QuizAttemptsRepo, ReviewItemsRepo
+from reviewutils import ReviewUtils, DEFAULT_EASE, MIN_EASE, DAY_SECONDS, RELEARN_SECONDS, MAX_INTERVAL_DAYS
+
+NOW = 1000000.0
+
+def new_item():
+    return ReviewUtils.new_item("reviewer", "quiz", 1, 'english', 'romanji', NOW)
+
+def test_correct_answers_space_reviews_out():
+    item = new_item()
+    now = NOW
+    intervals = []
+    for _ in range(20):
+        ReviewUtils.grade(item, True, now)
+        intervals.append(item.interval_days)
+        assert item.due == now + item.interval_days*DAY_SECONDS
+        now = item.due
+    assert intervals[:2] == [1, 6]
+    assert intervals[2] == 6*DEFAULT_EASE
+    assert intervals == sorted(intervals)
+    assert intervals[-1] == MAX_INTERVAL_DAYS
+    assert item.repetitions == 20
+
+def test_wrong_answer_starts_over():
+    item = new_item()
+    for now in (NOW, NOW + DAY_SECONDS):
+        ReviewUtils.grade(item, True, now)
+    ReviewUtils.grade(item, False, item.due)
+    assert (item.repetitions, item.interval_days, item.lapses) == (0, 0, 1)
+    assert item.due == item.last_reviewed + RELEARN_SECONDS
+    assert item.ease < DEFAULT_EASE
+
+def test_ease_has_a_floor():
+    item = new_item()
+    for i in range(20):
+        ReviewUtils.grade(item, False, NOW + i)
+    assert item.ease == MIN_EASE
+    assert item.lapses == 20
+
+def test_correct_before_due_keeps_schedule():
+    item = ReviewUtils.grade(new_item(), True, NOW)
+    before = item.to_dict()
+    ReviewUtils.grade(item, True, NOW + 60)
+    assert item.to_dict() == {**before, 'last_reviewed': NOW + 60}
+
+def test_attempts_schedule_due_items(quizzes):
+    repo = QuizAttemptsRepo(MemoryBackend())
+    review_items_repo = ReviewItemsRepo(repo.backend)
+    user = User("scheduled", "S", "S", "s@example.com", True, True)
+    quiz = quizzes[0]
+    attempt = QuizUtils.score_answers(user, quiz, 'english', 'romanji', ["wrong"]*len(quiz.questions))
+    repo.save(attempt, user.display_name)
+
+    item_ids = ReviewUtils.get_item_ids(attempt)
+    items = review_items_repo.get_items(item_ids)
+    assert sorted(items) == sorted(item_ids)
+    assert all(i.lapses == 1 and i.due == attempt.timestamp + RELEARN_SECONDS for i in items.values())
+
+    (due, next_due) = review_items_repo.get_due(user.id, 'english', 'romanji', attempt.timestamp, 5)
+    assert (due, next_due) == ([], attempt.timestamp + RELEARN_SECONDS)
+    (due, next_due) = review_items_repo.get_due(user.id, 'english', 'romanji', attempt.timestamp + RELEARN_SECONDS, 5)
+    assert len(due) == min(5, len(item_ids))
+    assert review_items_repo.get_due(user.id, 'romanji', 'english', attempt.timestamp + RELEARN_SECONDS, 5) == ([], None)
+
+def test_grade_answers_rejects_unknown_items(quizzes):
+    quiz = quizzes[0]
+    catalog = {quiz.id: quiz}
+    item = ReviewUtils.new_item("reviewer", quiz.id, quiz.question_ids[0], 'english', 'romanji', NOW)
+    (graded, responses) = ReviewUtils.grade_answers([item.id], ["wrong"], {item.id: item}, catalog, NOW)
+    assert graded[0].lapses == 1 and not responses[0].correct
+
+    with pytest.raises(SubmissionError):
+        ReviewUtils.grade_answers(["missing"], ["wrong"], {item.id: item}, catalog, NOW)
+    with pytest.raises(SubmissionError):
+        ReviewUtils.grade_answers([item.id], ["wrong"], {item.id: item}, {}, NOW)
+    with pytest.raises(SubmissionError):
+        ReviewUtils.grade_answers([item.id], [None], {item.id: item}, catalog, NOW)
@@ -0,0 +1,52 @@
+import json
+import pytest
+from models import User, SubmissionSchema, SubmissionError
+
+def submission(answers):
+    return {'question_language': 'english', 'answer_language': 'romanji', 'answers': answers}
+
+def test_both_formats_parse_the_same(quizzes):
+    quiz = quizzes[0]
+    schema = SubmissionSchema(quiz)
+    answers = [f"answer {i}" for i in range(len(quiz.question_ids))]
+    responses = {str(id): {'id': str(id), 'answer': answer} for (id, answer) in zip(quiz.question_ids, answers)}
+    expected = ('english', 'romanji', answers)
+    assert schema.parse(submission(answers)) == expected
+    assert schema.parse({'question_language': 'english', 'answer_language': 'romanji', 'responses': responses}) == expected
+
+@pytest.mark.parametrize('change', [
+    lambda quiz, data: [],
+    lambda quiz, data: {**data, 'question_language': 'klingon'},
+    lambda quiz, data: {**data, 'answer_language': data['question_language']},
+    lambda quiz, data: {**data, 'answers': data['answers'][1:]},
+    lambda quiz, data: {**data, 'answers': "not a list"},
+    lambda quiz, data: {**data, 'answers': [1] + data['answers'][1:]},
+    lambda quiz, data: {**data, 'answers': ["x"*100000] + data['answers'][1:]},
+    lambda quiz, data: {k: v for (k, v) in data.items() if k != 'answers'},
+    lambda quiz, data: {**{k: v for (k, v) in data.items() if k != 'answers'},
+        'responses': {str(id): {'id': str(id)} for id in quiz.question_ids}},
+])
+def test_rejected(quizzes, change):
+    quiz = quizzes[0]
+    data = submission([""]*len(quiz.question_ids))
+    with pytest.raises(SubmissionError):
+        SubmissionSchema(quiz).parse(change(quiz, data))
+
+def test_submit_route_rejects_before_grading(quizzes_repo):
+    import main
+    quiz = quizzes_repo.get_all()[0]
+    user = User("submitter", "S", "S", "s@example.com", True, True)
+    main.users_repo.save(user)
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = user.id
+        session['_fresh'] = True
+    url = f'/quiz/{quiz.id}/submit'
+    answers = [""]*len(quiz.question_ids)
+
+    response = client.post(url, data=json.dumps(submission(answers)), content_type='application/json')
+    assert response.status_code == 200
+    assert client.post(url, data="not json", content_type='application/json').status_code == 400
+    assert client.post(url, data=json.dumps(submission(answers[1:])), content_type='application/json').status_code == 400
+    oversize = json.dumps(submission(["x"]*(quiz.get_submission_schema().max_body_bytes)))
+    assert client.post(url, data=oversize, content_type='application/json').status_code == 413
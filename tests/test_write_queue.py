@@ -0,0 +1,26 @@
+from backends import MemoryBackend
+from models import User
+from quizutils import QuizUtils
+from repo import QuizAttemptsRepo, ReviewItemsRepo
+from reviewutils import ReviewUtils
+from writeutils import WriteBehindQueue
+
+def test_review_items_graded_from_queued_state(quizzes):
+    backend = MemoryBackend()
+    queue = WriteBehindQueue(backend, flush_seconds=60)
+    repo = QuizAttemptsRepo(backend, queue)
+    user = User("queued", "Q", "Q", "q@example.com", True, True)
+    quiz = quizzes[0]
+    try:
+        for _ in range(2):
+            attempt = QuizUtils.score_answers(user, quiz, 'english', 'romanji', ["wrong"]*len(quiz.questions))
+            repo.save(attempt, user.display_name)
+        item_ids = ReviewUtils.get_item_ids(attempt)
+        assert backend.get_many(ReviewItemsRepo.COLLECTION, item_ids) == []
+        assert [i.lapses for i in ReviewItemsRepo(backend, queue).get_items(item_ids).values()] == [2]*len(item_ids)
+
+        assert queue.flush()
+        assert [d['lapses'] for d in backend.get_many(ReviewItemsRepo.COLLECTION, item_ids)] == [2]*len(item_ids)
+        assert queue.get_pending(ReviewItemsRepo.COLLECTION, item_ids) == {}
+    finally:
+        queue.close()
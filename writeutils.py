@@ -0,0 +1,203 @@
+import os
+import time
+import atexit
+import threading
+from collections import deque
+from backends import get_backend, merge_fields
+
+# Firestore's limit on operations in one batched write
+MAX_BATCH_WRITES = 500
+
+class WriteBehindQueue:
+    """Buffers groups of writes in memory and commits them from a background thread as
+    batched writes of up to max_batch operations, once a batch fills up or flush_seconds
+    after the oldest pending write. Each group (e.g. an attempt and its leaderboard
+    increment) always lands in the same batch. Merged writes to the same document within
+    a batch are coalesced, so a burst of submissions by one user costs one stats write.
+
+    The buffer holds at most max_pending groups. put() returns False when it is full or the
+    queue is closed, and the caller is expected to write synchronously instead. Pending
+    writes are flushed when the process exits. get_pending() returns the documents queued
+    to be overwritten, so a read-modify-write can start from them instead of the older
+    stored ones. A batch that still fails after max_retries is
+    dropped and counted in the failure metrics."""
+    # backend None means the process backend, looked up on the first flush
+    def __init__(self, backend, max_batch: int = MAX_BATCH_WRITES, flush_seconds: float = 1.0,
+                 max_pending: int = 10000, max_retries: int = 3):
+        self.backend = backend
+        self.max_batch = min(max_batch, MAX_BATCH_WRITES)
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.pending = deque() # deque[(queued at, list[write])]
+        self.pending_writes = 0
+        self.unflushed = {} # dict[(collection, id), (latest data, queued count)] of the non-merged writes not committed yet
+        self.condition = threading.Condition()
+        self.in_flight = 0 # groups taken off pending but not committed yet
+        self.flush_requested = False
+        self.closed = False
+        self.metrics = {
+            'queued': 0,
+            'rejected': 0,
+            'batches': 0,
+            'writes': 0,
+            'coalesced': 0,
+            'retries': 0,
+            'failed_batches': 0,
+            'failed_groups': 0,
+            'last_error': None,
+            'last_flush_ms': 0,
+            'max_pending_seen': 0
+        }
+        self.thread = threading.Thread(target=self.run, name="write-behind", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # Queues one group of (collection, id, data, merge) writes
+    def put(self, writes):
+        if len(writes) > self.max_batch:
+            return False
+        with self.condition:
+            if self.closed or len(self.pending) >= self.max_pending:
+                self.metrics['rejected'] += 1
+                return False
+            self.pending.append((time.monotonic(), writes))
+            self.pending_writes += len(writes)
+            for (collection, id, data, merge) in writes:
+                if not merge:
+                    entry = self.unflushed.get((collection, id))
+                    self.unflushed[(collection, id)] = (data, entry[1] + 1 if entry else 1)
+            self.metrics['queued'] += 1
+            self.metrics['max_pending_seen'] = max(self.metrics['max_pending_seen'], len(self.pending))
+            if self.pending_writes >= self.max_batch:
+                self.condition.notify_all()
+        return True
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and not self.is_due():
+                    timeout = self.flush_seconds - (time.monotonic() - self.pending[0][0]) if self.pending else None
+                    self.condition.wait(timeout)
+                if self.closed and not self.pending:
+                    return
+                groups = self.take_batch()
+                self.in_flight += len(groups)
+            self.commit(groups)
+            with self.condition:
+                self.in_flight -= len(groups)
+                self.release(groups)
+                if not self.pending:
+                    self.flush_requested = False
+                self.condition.notify_all()
+
+    # Forgets committed (or dropped) writes, unless a later one to the same document is pending
+    def release(self, groups):
+        for (collection, id, data, merge) in (w for g in groups for w in g):
+            if not merge:
+                (latest, count) = self.unflushed[(collection, id)]
+                if count == 1:
+                    del self.unflushed[(collection, id)]
+                else:
+                    self.unflushed[(collection, id)] = (latest, count - 1)
+
+    # dict[id, document] of the latest queued, not yet committed, overwrite of each of ids
+    def get_pending(self, collection, ids):
+        with self.condition:
+            return {id: dict(self.unflushed[(collection, id)][0]) for id in ids if (collection, id) in self.unflushed}
+
+    # A full batch is waiting or the oldest write has waited flush_seconds
+    def is_due(self):
+        if not self.pending:
+            return False
+        return self.flush_requested or self.pending_writes >= self.max_batch or time.monotonic() - self.pending[0][0] >= self.flush_seconds
+
+    def take_batch(self):
+        groups = []
+        count = 0
+        while self.pending and count + len(self.pending[0][1]) <= self.max_batch:
+            writes = self.pending.popleft()[1]
+            groups.append(writes)
+            count += len(writes)
+        self.pending_writes -= count
+        return groups
+
+    def commit(self, groups):
+        writes = WriteBehindQueue.coalesce([w for g in groups for w in g])
+        started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                (self.backend or get_backend()).batch_save(writes)
+                break
+            except Exception as e:
+                error = e
+                if attempt < self.max_retries:
+                    with self.condition:
+                        self.metrics['retries'] += 1
+                    time.sleep(0.1*2**attempt)
+        else:
+            with self.condition:
+                self.metrics['failed_batches'] += 1
+                self.metrics['failed_groups'] += len(groups)
+                self.metrics['last_error'] = repr(error)
+            return False
+        with self.condition:
+            self.metrics['batches'] += 1
+            self.metrics['writes'] += len(writes)
+            self.metrics['coalesced'] += sum(len(g) for g in groups) - len(writes)
+            self.metrics['last_flush_ms'] = (time.perf_counter() - started)*1000
+        return True
+
+    # Folds merged writes to the same document into one, adding up their increments
+    @staticmethod
+    def coalesce(writes):
+        merged = {} # dict[(collection, id), index in coalesced]
+        coalesced = []
+        for (collection, id, data, merge) in writes:
+            key = (collection, id)
+            if merge and key in merged:
+                merge_fields(coalesced[merged[key]][2], data, keep_increments=True)
+                continue
+            if merge:
+                merged[key] = len(coalesced)
+                data = merge_fields({}, data, keep_increments=True)
+            else:
+                merged.pop(key, None)
+            coalesced.append((collection, id, data, merge))
+        return coalesced
+
+    # Blocks until everything queued so far is committed or has failed
+    def flush(self, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.flush_requested = True
+            self.condition.notify_all()
+            while (self.pending or self.in_flight) and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            return not (self.pending or self.in_flight)
+
+    def close(self, timeout: float = 30):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+    def stats(self):
+        with self.condition:
+            return dict(self.metrics, pending=len(self.pending), pending_writes=self.pending_writes)
+
+write_queue = None
+write_queue_lock = threading.Lock()
+
+# The process-wide queue for quiz attempts, None unless ATTEMPT_WRITE_BEHIND is set
+def get_write_queue():
+    global write_queue
+    with write_queue_lock:
+        if write_queue is None and os.environ.get("ATTEMPT_WRITE_BEHIND", "0") in ("1", "true"):
+            write_queue = WriteBehindQueue(None,
+                max_batch=int(os.environ.get("ATTEMPT_WRITE_BATCH_SIZE", MAX_BATCH_WRITES)),
+                flush_seconds=float(os.environ.get("ATTEMPT_WRITE_FLUSH_SECONDS", 1.0)),
+                max_pending=int(os.environ.get("ATTEMPT_WRITE_MAX_PENDING", 10000)))
+        return write_queue